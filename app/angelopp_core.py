@@ -3,8 +3,20 @@ from __future__ import annotations
 import os
 import re
 import sqlite3
-import requests
-from typing import List, Tuple, Optional, Dict
+from typing import List, Tuple, Optional, Dict, Iterable
+
+import batch_matcher
+import dbpool
+import fairness_state
+import landmark_index
+import migrations
+import offer_scheduler
+import outixs_anchors
+import outixs_outbox
+import provider_roster
+import session_state
+import travel_matrix
+from policies.topk import top_k
 
 # =========================
 # Angelopp USSD v1 (Bumala)
@@ -37,9 +49,8 @@ except Exception:
 # Basic helpers
 # -------------------------
 def db() -> sqlite3.Connection:
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    return conn
+    # Thread-local pooled connection (WAL, busy_timeout); close() just releases it.
+    return dbpool.connect(DB_PATH)
 
 def ussd_response(msg: str) -> str:
     return msg
@@ -87,62 +98,25 @@ def pick_from_list(title: str, items: List[Tuple[str, str]]) -> str:
 # -------------------------
 # Outixs integration (minimal)
 # -------------------------
-OUTIXS_URL = os.environ.get("OUTIXS_URL", "http://127.0.0.1:8080")
+OUTIXS_URL = outixs_outbox.OUTIXS_URL
 
 def outixs_ride_completed(internal_id: str, rider_phone: str | None = None) -> bool:
     """
-    Minimal anchor: only store that a job was completed.
-    Return True only if Outixs acknowledges (200/201).
+    Synchronous anchor (manual use only; complete_job goes through the outbox).
+    Return True only if Outixs acknowledges.
     Angelopp must never fail if Outixs is down.
     """
-    try:
-        payload = {
-            "recognized": True,
-            "non_trivial": True,
-            "transition_type": "RIDE_COMPLETED",
-            "transition": {
-                "kind": "ride_completed",
-                "internal_id": str(internal_id),
-                "rider_phone": str(rider_phone) if rider_phone else None
-            },
-            "context": {
-                "source": "angelopp",
-                "channel": "ussd"
-            }
-        }
-        r = requests.post(f"{OUTIXS_URL}/transition", json=payload, timeout=5)
-        return int(getattr(r, "status_code", 0)) in (200, 201)
-    except Exception as e:
-        # keep Angelopp running no matter what
-        print("Outixs event failed:", e)
-        return False
+    acked, _, error = outixs_outbox.post_transition(
+        outixs_outbox.ride_completed_payload(internal_id, rider_phone)
+    )
+    if not acked:
+        print("Outixs event failed:", error)
+    return acked
 
 
 def get_last_outixs_anchor_status(internal_id: str):
     """Return (anchored_ok: bool|None, anchored_at: str|None) from local bumala.db outixs_anchors."""
-    try:
-        conn = db()
-        cur = conn.cursor()
-        try:
-            cur.execute(
-                "SELECT anchored_ok, anchored_at FROM outixs_anchors WHERE internal_id=? ORDER BY id DESC LIMIT 1",
-                (str(internal_id),)
-            )
-            row = cur.fetchone()
-        except Exception:
-            cur.execute(
-                "SELECT 1 AS anchored_ok, created_at AS anchored_at FROM outixs_anchors WHERE internal_id=? ORDER BY id DESC LIMIT 1",
-                (str(internal_id),)
-            )
-            row = cur.fetchone()
-        conn.close()
-        if not row:
-            return (None, None)
-        anchored_ok = None if row[0] is None else bool(int(row[0]))
-        anchored_at = row[1] if len(row) > 1 else None
-        return (anchored_ok, anchored_at)
-    except Exception:
-        return (None, None)
+    return outixs_anchors.get_last_status(DB_PATH, internal_id)
 
 
 # -------------------------
@@ -150,168 +124,16 @@ def get_last_outixs_anchor_status(internal_id: str):
 # -------------------------
 VILLAGES = [("1", "Bumala"), ("2", "Busia"), ("3", "Other")]
 
-DEFAULT_SERVICES = [
-    ("Rider (Boda/Tuktuk)", "rider"),
-    ("Food / Restaurants", "business"),
-    ("Shop / Duka", "business"),
-    ("Plumber", "business"),
-    ("Carpenter", "business"),
-    ("Electrician", "business"),
-]
-
 # =========================
-# Schema (keeps old tables)
+# Schema (see migrations.py)
 # =========================
 def ensure_schema_legacy_minimal() -> None:
-    """Keep compatibility if old riders/businesses tables exist. Create if missing."""
-    conn = db()
-    cur = conn.cursor()
-
-    cur.execute("""
-    CREATE TABLE IF NOT EXISTS riders (
-        phone TEXT PRIMARY KEY,
-        name TEXT NOT NULL,
-        village TEXT NOT NULL DEFAULT 'Bumala',
-        rider_type TEXT NOT NULL DEFAULT 'Rider',
-        sacco TEXT DEFAULT '',
-        location TEXT DEFAULT '',
-        created_at TEXT DEFAULT (datetime('now')),
-        updated_at TEXT DEFAULT (datetime('now'))
-    )
-    """)
-
-    cur.execute("""
-    CREATE TABLE IF NOT EXISTS businesses (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        owner_phone TEXT NOT NULL,
-        name TEXT NOT NULL,
-        category TEXT NOT NULL,
-        village TEXT NOT NULL DEFAULT 'Bumala',
-        location TEXT DEFAULT '',
-        created_at TEXT DEFAULT (datetime('now')),
-        updated_at TEXT DEFAULT (datetime('now'))
-    )
-    """)
-
-    conn.commit()
-    conn.close()
+    """Kept for old callers; the legacy tables are part of the baseline migration."""
+    migrations.ensure_current(DB_PATH)
 
 def ensure_schema_v2() -> None:
-    ensure_schema_legacy_minimal()
-
-    conn = db()
-    cur = conn.cursor()
-
-    # Roles: 'customer' or 'provider'
-    cur.execute("""
-    CREATE TABLE IF NOT EXISTS user_roles (
-        phone TEXT PRIMARY KEY,
-        role TEXT NOT NULL,
-        updated_at TEXT NOT NULL DEFAULT (datetime('now'))
-    )
-    """)
-
-    # Provider profile (unified)
-    cur.execute("""
-    CREATE TABLE IF NOT EXISTS providers (
-        phone TEXT PRIMARY KEY,
-        provider_type TEXT NOT NULL, -- 'rider' or 'business'
-        name TEXT NOT NULL,
-        village TEXT NOT NULL DEFAULT 'Bumala',
-        sacco TEXT DEFAULT '',
-        current_landmark TEXT DEFAULT '',
-        created_at TEXT NOT NULL DEFAULT (datetime('now')),
-        updated_at TEXT NOT NULL DEFAULT (datetime('now'))
-    )
-    """)
-
-    # Landmarks (community map)
-    cur.execute("""
-    CREATE TABLE IF NOT EXISTS landmarks (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        village TEXT NOT NULL DEFAULT 'Bumala',
-        name TEXT NOT NULL,
-        description TEXT NOT NULL DEFAULT '',
-        added_by TEXT NOT NULL,
-        created_at TEXT NOT NULL DEFAULT (datetime('now'))
-    )
-    """)
-    cur.execute("CREATE INDEX IF NOT EXISTS idx_landmarks_village ON landmarks(village)")
-    cur.execute("CREATE INDEX IF NOT EXISTS idx_landmarks_added_by ON landmarks(added_by)")
-
-    # Service catalog
-    cur.execute("""
-    CREATE TABLE IF NOT EXISTS services (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        name TEXT NOT NULL UNIQUE,
-        kind TEXT NOT NULL DEFAULT 'any' -- 'rider','business','any'
-    )
-    """)
-
-    # Provider services
-    cur.execute("""
-    CREATE TABLE IF NOT EXISTS provider_services (
-        phone TEXT NOT NULL,
-        service_id INTEGER NOT NULL,
-        active INTEGER NOT NULL DEFAULT 1,
-        PRIMARY KEY (phone, service_id),
-        FOREIGN KEY (phone) REFERENCES providers(phone),
-        FOREIGN KEY (service_id) REFERENCES services(id)
-    )
-    """)
-
-    # Requests created by customers
-    cur.execute("""
-    CREATE TABLE IF NOT EXISTS service_requests (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        customer_phone TEXT NOT NULL,
-        service_id INTEGER NOT NULL,
-        village TEXT NOT NULL DEFAULT 'Bumala',
-        landmark TEXT NOT NULL DEFAULT '',
-        note TEXT NOT NULL DEFAULT '',
-        status TEXT NOT NULL DEFAULT 'NEW', -- NEW/OFFERED/ACCEPTED/CLOSED
-        created_at TEXT NOT NULL DEFAULT (datetime('now'))
-    )
-    """)
-
-    # Offers sent to providers
-    cur.execute("""
-    CREATE TABLE IF NOT EXISTS request_offers (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        request_id INTEGER NOT NULL,
-        provider_phone TEXT NOT NULL,
-        score REAL NOT NULL DEFAULT 0,
-        eta_minutes INTEGER NOT NULL DEFAULT 999,
-        status TEXT NOT NULL DEFAULT 'OFFERED', -- OFFERED/ACCEPTED/PASSED
-        created_at TEXT NOT NULL DEFAULT (datetime('now')),
-        UNIQUE(request_id, provider_phone)
-    )
-    """)
-    cur.execute("CREATE INDEX IF NOT EXISTS idx_offers_provider ON request_offers(provider_phone, status)")
-    cur.execute("CREATE INDEX IF NOT EXISTS idx_offers_request ON request_offers(request_id, status)")
-
-    # Assignments (for fairness)
-    cur.execute("""
-    CREATE TABLE IF NOT EXISTS assignments (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        request_id INTEGER NOT NULL UNIQUE,
-        provider_phone TEXT NOT NULL,
-        assigned_at TEXT NOT NULL DEFAULT (datetime('now'))
-    )
-    """)
-    cur.execute("CREATE INDEX IF NOT EXISTS idx_assignments_provider_time ON assignments(provider_phone, assigned_at)")
-
-    conn.commit()
-
-    # Seed services if empty
-    cur.execute("SELECT COUNT(*) AS c FROM services")
-    c = int(cur.fetchone()["c"])
-    if c == 0:
-        for name, kind in DEFAULT_SERVICES:
-            cur.execute("INSERT OR IGNORE INTO services(name, kind) VALUES (?,?)", (name, kind))
-        conn.commit()
-
-    conn.close()
+    # One-time per process; afterwards a set lookup (no DDL per keypress).
+    migrations.ensure_current(DB_PATH)
 
 # =========================
 # Role functions
@@ -354,8 +176,10 @@ def upsert_provider(phone: str, provider_type: str, name: str, village: str, sac
         sacco=excluded.sacco,
         updated_at=datetime('now')
     """, (phone, provider_type, name, village, sacco))
+    provider_roster.record_change(cur, phone, "profile")
     conn.commit()
     conn.close()
+    provider_roster.touch(DB_PATH, phone)
 
 def get_provider(phone: str) -> Optional[sqlite3.Row]:
     phone = normalize_phone(phone)
@@ -375,8 +199,24 @@ def set_provider_landmark(phone: str, landmark: str) -> None:
     SET current_landmark=?, updated_at=datetime('now')
     WHERE phone=?
     """, (landmark.strip(), phone))
+    provider_roster.record_change(cur, phone, "landmark")
+    conn.commit()
+    conn.close()
+    provider_roster.touch(DB_PATH, phone)
+
+def set_provider_available(phone: str, available: bool) -> None:
+    phone = normalize_phone(phone)
+    conn = db()
+    cur = conn.cursor()
+    cur.execute("""
+    UPDATE providers
+    SET is_available=?, updated_at=datetime('now')
+    WHERE phone=?
+    """, (1 if available else 0, phone))
+    provider_roster.record_change(cur, phone, "availability")
     conn.commit()
     conn.close()
+    provider_roster.touch(DB_PATH, phone)
 
 # =========================
 # Landmarks
@@ -395,17 +235,20 @@ def add_landmark(village: str, name: str, description: str, added_by: str) -> No
     """, (village, name, description, added_by))
     conn.commit()
     conn.close()
+    landmark_index.invalidate(DB_PATH, village)
+
+_LANDMARKS_SQL = """
+SELECT id, name, description
+FROM landmarks
+WHERE village=?
+ORDER BY created_at DESC
+LIMIT ?
+"""
 
 def list_landmarks(village: str, limit: int = 8) -> List[sqlite3.Row]:
     conn = db()
     cur = conn.cursor()
-    cur.execute("""
-    SELECT id, name, description
-    FROM landmarks
-    WHERE village=?
-    ORDER BY created_at DESC
-    LIMIT ?
-    """, (village, limit))
+    cur.execute(_LANDMARKS_SQL, (village, limit))
     rows = cur.fetchall()
     conn.close()
     return rows
@@ -433,17 +276,21 @@ def provider_set_service(phone: str, service_id: int, active: int) -> None:
     VALUES (?, ?, ?)
     ON CONFLICT(phone, service_id) DO UPDATE SET active=excluded.active
     """, (phone, int(service_id), int(active)))
+    provider_roster.record_change(cur, phone, "service")
     conn.commit()
     conn.close()
+    provider_roster.touch(DB_PATH, phone)
+
+_PROVIDER_SERVICES_SQL = """
+SELECT service_id FROM provider_services
+WHERE phone=? AND active=1
+"""
 
 def provider_services(phone: str) -> List[int]:
     phone = normalize_phone(phone)
     conn = db()
     cur = conn.cursor()
-    cur.execute("""
-    SELECT service_id FROM provider_services
-    WHERE phone=? AND active=1
-    """, (phone,))
+    cur.execute(_PROVIDER_SERVICES_SQL, (phone,))
     ids = [int(r["service_id"]) for r in cur.fetchall()]
     conn.close()
     return ids
@@ -451,55 +298,28 @@ def provider_services(phone: str) -> List[int]:
 # =========================
 # Fairness + offers
 # =========================
-def provider_recent_assignments(phone: str, hours: int = 24) -> int:
-    phone = normalize_phone(phone)
-    conn = db()
-    cur = conn.cursor()
-    cur.execute(f"""
-    SELECT COUNT(*) AS c
-    FROM assignments
-    WHERE provider_phone=?
-      AND datetime(assigned_at) >= datetime('now', '-{int(hours)} hours')
-    """, (phone,))
-    c = int(cur.fetchone()["c"])
-    conn.close()
-    return c
+PENALTY_MINUTES_PER_JOB = 2
 
 def compute_penalty_minutes(phone: str) -> int:
-    # Simple fairness: +2 minutes per assignment in last 24 hours
-    c = provider_recent_assignments(phone, hours=24)
-    return 2 * c
-
-def estimate_eta_minutes(customer_landmark: str, provider_landmark: str) -> int:
-    # If relative_distance exists, we rely on ranking/eta in the PersonLocation.
-    # Otherwise: cheap heuristic.
-    cl = (customer_landmark or "").strip().lower()
-    pl = (provider_landmark or "").strip().lower()
-    if not cl or not pl:
-        return 12
-    if cl == pl:
-        return 2
-    # same first word heuristic
-    if cl.split(" ")[0] == pl.split(" ")[0]:
-        return 5
-    return 9
-
-def get_candidate_providers(service_id: int, village: str, kind_hint: Optional[str]) -> List[sqlite3.Row]:
-    conn = db()
-    cur = conn.cursor()
-
-    # Providers who offer this service AND are in village
-    cur.execute("""
-    SELECT p.phone, p.provider_type, p.name, p.village, p.sacco, p.current_landmark
-    FROM providers p
-    JOIN provider_services ps ON ps.phone = p.phone
-    WHERE ps.service_id=? AND ps.active=1
-      AND p.village=?
-    ORDER BY p.updated_at DESC
-    """, (int(service_id), village))
-    rows = cur.fetchall()
-    conn.close()
-    return rows
+    # Simple fairness: +2 minutes per assignment in the fairness window (24h default)
+    c = fairness_state.get_window(DB_PATH).count(normalize_phone(phone))
+    return PENALTY_MINUTES_PER_JOB * c
+
+def compute_penalty_minutes_bulk(phones: List[str]) -> Dict[str, int]:
+    """Same rule as compute_penalty_minutes, for all candidates at once (in-memory)."""
+    counts = fairness_state.get_window(DB_PATH).counts({normalize_phone(p) for p in phones if p})
+    return {p: PENALTY_MINUTES_PER_JOB * c for p, c in counts.items()}
+
+def estimate_eta_minutes(customer_landmark: str, provider_landmark: str, village: Optional[str] = None) -> int:
+    # Canonical landmarks (landmark_index): "Mkt Gate" and "market-gate"
+    # resolve to the same id within a village. Learned / SACCO travel times
+    # (travel_matrix) first, then the cheap heuristic.
+    return travel_matrix.eta_minutes(DB_PATH, village, provider_landmark, customer_landmark)
+
+def get_candidate_providers(service_id: int, village: str, kind_hint: Optional[str]) -> List[Dict[str, object]]:
+    # Providers who offer this service AND are in village, newest update first
+    # (in-memory roster, refreshed from the provider_changes feed)
+    return provider_roster.get_roster(DB_PATH).candidates(village, int(service_id))
 
 def create_request(customer_phone: str, service_id: int, village: str, landmark: str, note: str) -> int:
     customer_phone = normalize_phone(customer_phone)
@@ -509,16 +329,21 @@ def create_request(customer_phone: str, service_id: int, village: str, landmark:
 
     conn = db()
     cur = conn.cursor()
+    # reoffer_at: offer_scheduler retries it even if nobody can be offered now
     cur.execute("""
-    INSERT INTO service_requests(customer_phone, service_id, village, landmark, note, status)
-    VALUES (?, ?, ?, ?, ?, 'NEW')
-    """, (customer_phone, int(service_id), village, landmark, note))
+    INSERT INTO service_requests(customer_phone, service_id, village, landmark, note, status, reoffer_at)
+    VALUES (?, ?, ?, ?, ?, 'NEW', datetime('now', ?))
+    """, (customer_phone, int(service_id), village, landmark, note, offer_scheduler.ttl_modifier()))
     rid = int(cur.lastrowid)
     conn.commit()
     conn.close()
     return rid
 
-def build_offers(request_id: int, max_offers: int = 5) -> int:
+def build_offers(request_id: int, max_offers: int = 5, exclude: Optional[Iterable[str]] = None) -> int:
+    """
+    Offer the request to the best `max_offers` providers, skipping `exclude`
+    (offer_scheduler passes everyone offered in earlier rounds).
+    """
     conn = db()
     cur = conn.cursor()
     cur.execute("""
@@ -543,19 +368,22 @@ def build_offers(request_id: int, max_offers: int = 5) -> int:
     conn.close()
 
     candidates = get_candidate_providers(service_id, village, kind_hint)
+    if exclude:
+        skip = {normalize_phone(p) for p in exclude}
+        candidates = [p for p in candidates if normalize_phone(p["phone"]) not in skip]
+    penalties = compute_penalty_minutes_bulk([p["phone"] for p in candidates])
 
     scored = []
     for p in candidates:
         p_phone = p["phone"]
         p_lm = (p["current_landmark"] or "").strip()
-        eta = estimate_eta_minutes(customer_landmark, p_lm)
-        penalty = compute_penalty_minutes(p_phone)
+        eta = estimate_eta_minutes(customer_landmark, p_lm, village)
+        penalty = penalties.get(normalize_phone(p_phone), 0)
         eff_eta = eta + penalty
         score = float(eff_eta)  # lower is better
         scored.append((score, eta, penalty, p_phone))
 
-    scored.sort(key=lambda x: x[0])
-    top = scored[:max_offers]
+    top = top_k(scored, max_offers, key=lambda x: x[0])
 
     if not top:
         return 0
@@ -574,178 +402,188 @@ def build_offers(request_id: int, max_offers: int = 5) -> int:
         except Exception:
             pass
 
-    # Mark request as OFFERED
-    cur.execute("UPDATE service_requests SET status='OFFERED' WHERE id=?", (int(request_id),))
+    # Mark request as OFFERED; unanswered offers expire after the TTL (offer_scheduler)
+    cur.execute("UPDATE service_requests SET status='OFFERED', reoffer_at=datetime('now', ?) WHERE id=?",
+                (offer_scheduler.ttl_modifier(), int(request_id)))
     conn.commit()
     conn.close()
     return inserted
 
+_PENDING_OFFERS_SQL = """
+SELECT ro.id AS offer_id, ro.request_id, ro.eta_minutes, sr.village, sr.landmark, sr.note
+FROM request_offers ro
+JOIN service_requests sr ON sr.id = ro.request_id
+WHERE ro.provider_phone=? AND ro.status='OFFERED'
+ORDER BY ro.created_at DESC
+LIMIT ?
+"""
+
 def provider_pending_offers(phone: str, limit: int = 5) -> List[sqlite3.Row]:
     phone = normalize_phone(phone)
     conn = db()
     cur = conn.cursor()
-    cur.execute("""
-    SELECT ro.id AS offer_id, ro.request_id, ro.eta_minutes, sr.village, sr.landmark, sr.note
-    FROM request_offers ro
-    JOIN service_requests sr ON sr.id = ro.request_id
-    WHERE ro.provider_phone=? AND ro.status='OFFERED'
-    ORDER BY ro.created_at DESC
-    LIMIT ?
-    """, (phone, limit))
+    cur.execute(_PENDING_OFFERS_SQL, (phone, limit))
     rows = cur.fetchall()
     conn.close()
     return rows
 
-def accept_offer(provider_phone: str, offer_id: int) -> bool:
+# claim_offer() outcomes
+CLAIM_ACCEPTED = "ACCEPTED"   # this provider got the job
+CLAIM_TAKEN = "TAKEN"         # another provider was first; this offer is now PASSED
+CLAIM_GONE = "GONE"           # no OFFERED offer with this id for this provider
+CLAIM_BUSY = "BUSY"           # database stayed locked past busy_timeout; nothing changed
+
+_CLAIM_OFFER_SQL = """
+UPDATE request_offers SET status='ACCEPTED'
+WHERE id=? AND provider_phone=? AND status='OFFERED'
+"""
+
+_CLAIM_ASSIGN_SQL = """
+INSERT INTO assignments(request_id, provider_phone, from_landmark)
+VALUES (?, ?, (SELECT current_landmark FROM providers WHERE phone=?))
+ON CONFLICT(request_id) DO NOTHING
+"""
+
+_PASS_OTHER_OFFERS_SQL = """
+UPDATE request_offers
+SET status='PASSED'
+WHERE request_id=? AND id<>? AND status='OFFERED'
+"""
+
+def claim_offer(provider_phone: str, offer_id: int) -> Tuple[str, Optional[int]]:
+    """
+    Accept an offer in one BEGIN IMMEDIATE transaction:
+    conditional UPDATE of the offer (status='OFFERED'), then
+    INSERT ... ON CONFLICT(request_id) DO NOTHING into assignments.
+    Exactly one provider per request wins, however many accept at once.
+    Returns (outcome, request_id or None).
+    """
     provider_phone = normalize_phone(provider_phone)
     conn = db()
     cur = conn.cursor()
+    try:
+        cur.execute("BEGIN IMMEDIATE")
+        cur.execute(_CLAIM_OFFER_SQL, (int(offer_id), provider_phone))
+        if cur.rowcount != 1:
+            conn.rollback()
+            return CLAIM_GONE, None
+        cur.execute("SELECT request_id FROM request_offers WHERE id=?", (int(offer_id),))
+        request_id = int(cur.fetchone()["request_id"])
+
+        cur.execute(_CLAIM_ASSIGN_SQL, (request_id, provider_phone, provider_phone))
+        if cur.rowcount != 1:
+            cur.execute("UPDATE request_offers SET status='PASSED' WHERE id=?", (int(offer_id),))
+            conn.commit()
+            return CLAIM_TAKEN, request_id
+        assignment_id = int(cur.lastrowid)
 
-    # Fetch offer
-    cur.execute("""
-    SELECT request_id FROM request_offers
-    WHERE id=? AND provider_phone=? AND status='OFFERED'
-    """, (int(offer_id), provider_phone))
-    row = cur.fetchone()
-    if not row:
-        conn.close()
-        return False
-    request_id = int(row["request_id"])
-
-    # Ensure not already assigned
-    cur.execute("SELECT 1 FROM assignments WHERE request_id=?", (request_id,))
-    if cur.fetchone():
-        # Mark offer as passed
-        cur.execute("UPDATE request_offers SET status='PASSED' WHERE id=?", (int(offer_id),))
+        cur.execute("UPDATE service_requests SET status='ACCEPTED' WHERE id=?", (request_id,))
+        # Other offers for this request -> PASSED
+        cur.execute(_PASS_OTHER_OFFERS_SQL, (request_id, int(offer_id)))
         conn.commit()
+    except sqlite3.OperationalError as e:
+        conn.rollback()
+        print("claim_offer: database busy:", e)
+        return CLAIM_BUSY, None
+    finally:
         conn.close()
-        return False
 
-    # Assign
-    cur.execute("INSERT INTO assignments(request_id, provider_phone) VALUES (?, ?)", (request_id, provider_phone))
-    cur.execute("UPDATE request_offers SET status='ACCEPTED' WHERE id=?", (int(offer_id),))
-    cur.execute("UPDATE service_requests SET status='ACCEPTED' WHERE id=?", (request_id,))
+    fairness_state.get_window(DB_PATH).record(provider_phone, assignment_id)
+    return CLAIM_ACCEPTED, request_id
 
-    # Other offers for this request -> PASSED
-    cur.execute("""
-    UPDATE request_offers
-    SET status='PASSED'
-    WHERE request_id=? AND id<>?
-    """, (request_id, int(offer_id)))
+def accept_offer(provider_phone: str, offer_id: int) -> bool:
+    return claim_offer(provider_phone, offer_id)[0] == CLAIM_ACCEPTED
 
-    conn.commit()
-    conn.close()
-    return True
+_PASS_OFFER_SQL = """
+UPDATE request_offers
+SET status='PASSED'
+WHERE id=? AND provider_phone=? AND status='OFFERED'
+"""
 
 def pass_offer(provider_phone: str, offer_id: int) -> bool:
     provider_phone = normalize_phone(provider_phone)
     conn = db()
     cur = conn.cursor()
-    cur.execute("""
-    UPDATE request_offers
-    SET status='PASSED'
-    WHERE id=? AND provider_phone=? AND status='OFFERED'
-    """, (int(offer_id), provider_phone))
+    cur.execute(_PASS_OFFER_SQL, (int(offer_id), provider_phone))
     ok = (cur.rowcount > 0)
+    due_now = False
+    if ok:
+        # Last open offer passed: re-offer now instead of waiting for the TTL
+        cur.execute("""
+        UPDATE service_requests
+        SET reoffer_at=datetime('now')
+        WHERE id=(SELECT request_id FROM request_offers WHERE id=?)
+          AND status='OFFERED'
+          AND NOT EXISTS (SELECT 1 FROM request_offers ro
+                          WHERE ro.request_id=service_requests.id AND ro.status='OFFERED')
+        """, (int(offer_id),))
+        due_now = cur.rowcount > 0
     conn.commit()
     conn.close()
+    if due_now:
+        offer_scheduler.kick(DB_PATH)
     return ok
 
 
 # =========================
 # Completing jobs (minimal)
 # =========================
+_ACTIVE_JOBS_SQL = """
+SELECT sr.id AS request_id, s.name AS service_name, sr.landmark, sr.note, sr.status
+FROM assignments a
+JOIN service_requests sr ON sr.id = a.request_id
+JOIN services s ON s.id = sr.service_id
+WHERE a.provider_phone=?
+  AND sr.status='ACCEPTED'
+ORDER BY sr.created_at DESC
+LIMIT ?
+"""
+
 def provider_active_jobs(phone: str, limit: int = 8) -> List[sqlite3.Row]:
     phone = normalize_phone(phone)
     conn = db()
     cur = conn.cursor()
-    cur.execute("""
-    SELECT sr.id AS request_id, s.name AS service_name, sr.landmark, sr.note, sr.status
-    FROM assignments a
-    JOIN service_requests sr ON sr.id = a.request_id
-    JOIN services s ON s.id = sr.service_id
-    WHERE a.provider_phone=?
-      AND sr.status='ACCEPTED'
-    ORDER BY sr.created_at DESC
-    LIMIT ?
-    """, (phone, int(limit)))
+    cur.execute(_ACTIVE_JOBS_SQL, (phone, int(limit)))
     rows = cur.fetchall()
     conn.close()
     return rows
 
+_COMPLETE_JOB_SQL = """
+UPDATE service_requests
+SET status='CLOSED', closed_at=datetime('now')
+WHERE id=? AND status='ACCEPTED'
+  AND EXISTS (SELECT 1 FROM assignments a WHERE a.request_id=? AND a.provider_phone=?)
+"""
+
 def complete_job(provider_phone: str, request_id: int) -> bool:
     """
     Mark job as CLOSED (completed) ONLY if it belongs to this provider and is ACCEPTED.
-    Then anchor to Outixs and log locally so menus can show anchor status.
+    The Outixs anchor is queued in outixs_outbox; the drain worker sends it
+    and records the ack in outixs_anchors.
     """
     provider_phone = normalize_phone(provider_phone)
 
-    # 1) Validate assignment + ACCEPTED
+    # One short transaction: conditional close + queue the anchor
+    internal_id = f"angelopp_req_{int(request_id)}"
     conn = db()
     cur = conn.cursor()
-    cur.execute("""
-    SELECT 1
-    FROM assignments a
-    JOIN service_requests sr ON sr.id = a.request_id
-    WHERE a.provider_phone=? AND a.request_id=? AND sr.status='ACCEPTED'
-    """, (provider_phone, int(request_id)))
-    if not cur.fetchone():
+    cur.execute(_COMPLETE_JOB_SQL, (int(request_id), int(request_id), provider_phone))
+    if cur.rowcount != 1:
         conn.close()
         return False
-
-    # 2) Close request
-    cur.execute("UPDATE service_requests SET status='CLOSED' WHERE id=?", (int(request_id),))
+    outixs_outbox.enqueue(
+        cur, internal_id,
+        outixs_outbox.ride_completed_payload(internal_id, provider_phone),
+        request_id=int(request_id), rider_phone=provider_phone,
+    )
     conn.commit()
     conn.close()
 
-    # 3) Anchor
-    internal_id = f"angelopp_req_{int(request_id)}"
-    try:
-        anchored_ok = bool(outixs_ride_completed(internal_id, provider_phone))
-    except Exception as e:
-        print("Outixs anchor failed:", e)
-        anchored_ok = False
-
-    # 4) Local log (bumala.db) - clean schema with anchored_ok
+    # 3) Anchor in the background (never on the USSD response path)
     try:
-        import sqlite3
-        conn2 = sqlite3.connect(DB_PATH)
-        cur2 = conn2.cursor()
-
-        # migrate legacy outixs_anchors if it has NOT NULL hash/height schema
-        cur2.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='outixs_anchors'")
-        if cur2.fetchone():
-            cur2.execute("PRAGMA table_info(outixs_anchors)")
-            cols = [r[1] for r in cur2.fetchall()]
-            if ("outixs_block_hash" in cols and "outixs_height" in cols and "anchored_ok" not in cols):
-                legacy = f"outixs_anchors_legacy_{int(time.time())}"
-                cur2.execute(f"ALTER TABLE outixs_anchors RENAME TO {legacy}")
-
-        cur2.execute("""
-        CREATE TABLE IF NOT EXISTS outixs_anchors (
-          id INTEGER PRIMARY KEY AUTOINCREMENT,
-          request_id INTEGER,
-          internal_id TEXT NOT NULL UNIQUE,
-          rider_phone TEXT,
-          transition_type TEXT,
-          anchored_ok INTEGER NOT NULL DEFAULT 0,
-          anchored_at TEXT NOT NULL DEFAULT (datetime('now'))
-        );
-        """)
-
-        cur2.execute(
-            "INSERT INTO outixs_anchors (request_id, internal_id, rider_phone, transition_type, anchored_ok, anchored_at) "
-            "VALUES (?,?,?,?,?, datetime('now')) "
-            "ON CONFLICT(internal_id) DO UPDATE SET "
-            "request_id=excluded.request_id, rider_phone=excluded.rider_phone, transition_type=excluded.transition_type, "
-            "anchored_ok=excluded.anchored_ok, anchored_at=datetime('now')",
-            (int(request_id), internal_id, provider_phone, "RIDE_COMPLETED", 1 if anchored_ok else 0)
-        )
-
-        conn2.commit()
-        conn2.close()
+        outixs_outbox.kick(DB_PATH)
     except Exception as e:
-        print("Outixs anchor log failed:", e)
+        print("Outixs outbox kick failed:", e)
 
     return True
 
@@ -794,20 +632,12 @@ DIST_KM = {
 }
 
 def ensure_traveler_schema() -> None:
-    conn = db()
-    cur = conn.cursor()
-    cur.execute("""
-    CREATE TABLE IF NOT EXISTS traveler_prefs (
-      phone TEXT PRIMARY KEY,
-      nairobi_region TEXT DEFAULT '1',
-      updated_at TEXT DEFAULT (datetime('now'))
-    );
-    """)
-    conn.commit()
-    conn.close()
+    migrations.ensure_current(DB_PATH)
+
+def get_traveler_region(phone: str, session_id: Optional[str] = None) -> str:
+    return session_state.memo(session_id, "traveler_region", lambda: _load_traveler_region(phone))
 
-def get_traveler_region(phone: str) -> str:
-    ensure_traveler_schema()
+def _load_traveler_region(phone: str) -> str:
     conn = db()
     cur = conn.cursor()
     cur.execute("SELECT nairobi_region FROM traveler_prefs WHERE phone=?", (phone,))
@@ -816,7 +646,6 @@ def get_traveler_region(phone: str) -> str:
     return (row["nairobi_region"] if row and row["nairobi_region"] else "1")
 
 def set_traveler_region(phone: str, region_key: str) -> None:
-    ensure_traveler_schema()
     conn = db()
     cur = conn.cursor()
     cur.execute("""
@@ -834,8 +663,8 @@ def estimate_airport_fare_kes(km: int, region_key: str) -> int:
     fare = int(max(min_fare, km * per_km) * mult)
     return fare
 
-def traveler_menu(phone: str) -> str:
-    region = get_traveler_region(phone)
+def traveler_menu(phone: str, session_id: Optional[str] = None) -> str:
+    region = get_traveler_region(phone, session_id)
     region_name = dict(NAIROBI_REGIONS).get(region, "Nairobi CBD")
     return "\n".join([
         "CON Traveler & Airport",
@@ -846,12 +675,12 @@ def traveler_menu(phone: str) -> str:
         "0. Exit"
     ])
 
-def handle_traveler(parts: List[str], phone: str) -> Tuple[str, int]:
+def handle_traveler(parts: List[str], phone: str, session_id: Optional[str] = None) -> Tuple[str, int]:
     phone = normalize_phone(phone)
 
     # Root of traveler role
     if len(parts) == 1:
-        return ussd_response(traveler_menu(phone)), 200
+        return ussd_response(traveler_menu(phone, session_id)), 200
 
     c1 = parts[1].strip()
 
@@ -867,11 +696,12 @@ def handle_traveler(parts: List[str], phone: str) -> Tuple[str, int]:
         if len(parts) == 2:
             return ussd_response(pick_from_list("Choose Nairobi region:", NAIROBI_REGIONS)), 200
         if parts[2].strip() == "0":
-            return ussd_response(traveler_menu(phone)), 200
+            return ussd_response(traveler_menu(phone, session_id)), 200
         rk = parts[2].strip()
         if rk not in dict(NAIROBI_REGIONS):
             return ussd_response("CON Invalid.\n0. Back"), 200
         set_traveler_region(phone, rk)
+        session_state.drop(session_id, "traveler_region")
         return ("END Saved ✓", 200)
 
     # 1) Book airport ride wizard
@@ -885,7 +715,7 @@ def handle_traveler(parts: List[str], phone: str) -> Tuple[str, int]:
                 "0. Back"
             ])), 200
         if parts[2].strip() == "0":
-            return ussd_response(traveler_menu(phone)), 200
+            return ussd_response(traveler_menu(phone, session_id)), 200
         direction = parts[2].strip()
         if direction not in ("1", "2"):
             return ussd_response("CON Invalid.\n0. Back"), 200
@@ -894,7 +724,7 @@ def handle_traveler(parts: List[str], phone: str) -> Tuple[str, int]:
         if len(parts) == 3:
             return ussd_response(pick_from_list("Choose province:", PROVINCES)), 200
         if parts[3].strip() == "0":
-            return ussd_response(traveler_menu(phone)), 200
+            return ussd_response(traveler_menu(phone, session_id)), 200
         prov = parts[3].strip()
         if prov not in dict(PROVINCES):
             return ussd_response("CON Invalid.\n0. Back"), 200
@@ -904,7 +734,7 @@ def handle_traveler(parts: List[str], phone: str) -> Tuple[str, int]:
         if len(parts) == 4:
             return ussd_response(pick_from_list("Choose town/village:", towns)), 200
         if parts[4].strip() == "0":
-            return ussd_response(traveler_menu(phone)), 200
+            return ussd_response(traveler_menu(phone, session_id)), 200
         town = parts[4].strip()
         if town not in dict(towns):
             return ussd_response("CON Invalid.\n0. Back"), 200
@@ -913,13 +743,13 @@ def handle_traveler(parts: List[str], phone: str) -> Tuple[str, int]:
         if len(parts) == 5:
             return ussd_response(pick_from_list("Choose airport:", AIRPORTS)), 200
         if parts[5].strip() == "0":
-            return ussd_response(traveler_menu(phone)), 200
+            return ussd_response(traveler_menu(phone, session_id)), 200
         airport = parts[5].strip()
         if airport not in dict(AIRPORTS):
             return ussd_response("CON Invalid.\n0. Back"), 200
 
         # Step 5: quote + confirm
-        region_key = get_traveler_region(phone)
+        region_key = get_traveler_region(phone, session_id)
         km = DIST_KM.get((prov, town, airport), 50)  # fallback km
         fare = estimate_airport_fare_kes(km, region_key)
 
@@ -942,7 +772,7 @@ def handle_traveler(parts: List[str], phone: str) -> Tuple[str, int]:
             ])), 200
 
         if parts[6].strip() == "0":
-            return ussd_response(traveler_menu(phone)), 200
+            return ussd_response(traveler_menu(phone, session_id)), 200
 
         if parts[6].strip() == "1":
             # create a service_request using a dedicated service_id name (ensure inserted in DB outside)
@@ -1035,7 +865,7 @@ def handle_customer(parts: List[str], session_id: str, phone: str) -> Tuple[str,
         return ussd_response(provider_menu()), 200
 
     if choice == "1":
-        return handle_customer_find_service(parts, phone)
+        return handle_customer_find_service(parts, phone, session_id)
 
     if choice == "2":
         return handle_customer_my_requests(parts, phone)
@@ -1069,18 +899,7 @@ def handle_customer_set_landmark(parts: List[str], phone: str) -> Tuple[str, int
     return ussd_response("CON Invalid.\n0. Back"), 200
 
 def ensure_customer_prefs_schema():
-    conn = db()
-    cur = conn.cursor()
-    cur.execute("""
-    CREATE TABLE IF NOT EXISTS customer_prefs (
-        phone TEXT PRIMARY KEY,
-        village TEXT NOT NULL DEFAULT 'Bumala',
-        landmark TEXT NOT NULL DEFAULT '',
-        updated_at TEXT NOT NULL DEFAULT (datetime('now'))
-    )
-    """)
-    conn.commit()
-    conn.close()
+    migrations.ensure_current(DB_PATH)
 
 def set_customer_landmark(phone: str, landmark: str) -> None:
     phone = normalize_phone(phone)
@@ -1211,6 +1030,15 @@ def handle_customer_travel(parts: list, phone: str):
     return ussd_response("CON Invalid.\n0. Back"), 200
 
 
+_CUSTOMER_REQUESTS_SQL = """
+SELECT sr.id, sr.status, s.name AS service_name, sr.village, sr.landmark
+FROM service_requests sr
+JOIN services s ON s.id = sr.service_id
+WHERE sr.customer_phone=?
+ORDER BY sr.created_at DESC
+LIMIT 8
+"""
+
 def handle_customer_my_requests(parts: List[str], phone: str) -> Tuple[str, int]:
     """
     Customer -> My requests hub
@@ -1241,14 +1069,7 @@ def handle_customer_my_requests(parts: List[str], phone: str) -> Tuple[str, int]
     if choice == "1":
         conn = db()
         cur = conn.cursor()
-        cur.execute("""
-        SELECT sr.id, sr.status, s.name AS service_name, sr.village, sr.landmark
-        FROM service_requests sr
-        JOIN services s ON s.id = sr.service_id
-        WHERE sr.customer_phone=?
-        ORDER BY sr.created_at DESC
-        LIMIT 8
-        """, (phone,))
+        cur.execute(_CUSTOMER_REQUESTS_SQL, (phone,))
         rows = cur.fetchall()
         conn.close()
 
@@ -1257,8 +1078,12 @@ def handle_customer_my_requests(parts: List[str], phone: str) -> Tuple[str, int]
             lines += ["No requests yet.", "0. Back"]
             return ussd_response("\n".join(lines)), 200
 
+        anchored = outixs_anchors.status_by_request_ids(
+            DB_PATH, [r["id"] for r in rows if r["status"] == "CLOSED"]
+        )
         for r in rows:
-            lines.append(f"{r['id']}. {r['service_name']} [{r['status']}] @ {r['landmark']}")
+            mark = " ✓" if anchored.get(int(r["id"])) else ""
+            lines.append(f"{r['id']}. {r['service_name']} [{r['status']}{mark}] @ {r['landmark']}")
         lines.append("0. Back")
         return ussd_response("\n".join(lines)), 200
 
@@ -1270,7 +1095,21 @@ def handle_customer_my_requests(parts: List[str], phone: str) -> Tuple[str, int]
     return ussd_response("CON Invalid.\n0. Back"), 200
 
 
-def handle_customer_find_service(parts: List[str], phone: str) -> Tuple[str, int]:
+def _session_services(session_id: Optional[str]) -> List[List]:
+    """[[id, name], ...] for the service picker, cached per session."""
+    return session_state.memo(
+        session_id, "services",
+        lambda: [[int(s["id"]), s["name"]] for s in list_services()[:MAX_LIST]]
+    )
+
+def _session_landmarks(session_id: Optional[str], village: str, limit: int = 6) -> List[str]:
+    """Landmark names for the picker in this village, cached per session."""
+    return session_state.memo(
+        session_id, f"landmarks:{village}:{int(limit)}",
+        lambda: [lm["name"] for lm in list_landmarks(village, limit=limit)]
+    )
+
+def handle_customer_find_service(parts: List[str], phone: str, session_id: Optional[str] = None) -> Tuple[str, int]:
     # Flow:
     # C*1 -> choose service
     # C*1*<serviceIndex> -> choose village
@@ -1279,22 +1118,21 @@ def handle_customer_find_service(parts: List[str], phone: str) -> Tuple[str, int
     phone = normalize_phone(phone)
 
     # Step 1: list services (all)
+    services = _session_services(session_id)
     if len(parts) == 2:
-        services = list_services()
-        items = [(str(i+1), s["name"]) for i, s in enumerate(services[:MAX_LIST])]
+        items = [(str(i+1), s[1]) for i, s in enumerate(services)]
         return ussd_response(pick_from_list("Choose service:", items)), 200
 
     # Step 2: parse service selection
-    services = list_services()
     try:
         sidx = int(parts[2])
     except Exception:
         return ussd_response("CON Invalid.\n0. Back"), 200
     if sidx == 0:
         return ussd_response(customer_menu()), 200
-    if sidx < 1 or sidx > min(len(services), MAX_LIST):
+    if sidx < 1 or sidx > len(services):
         return ussd_response("CON Invalid service.\n0. Back"), 200
-    service_id = int(services[sidx-1]["id"])
+    service_id = int(services[sidx-1][0])
 
     # Step 3: choose village
     if len(parts) == 3:
@@ -1307,11 +1145,11 @@ def handle_customer_find_service(parts: List[str], phone: str) -> Tuple[str, int
 
     # Step 4: choose landmark: show last landmarks + option to type new
     if len(parts) == 4:
-        lms = list_landmarks(village, limit=6)
+        lms = _session_landmarks(session_id, village)
         lines = [f"CON Choose landmark ({village})"]
         if lms:
             for i, lm in enumerate(lms, 1):
-                lines.append(f"{i}. {lm['name']}")
+                lines.append(f"{i}. {lm}")
             lines.append("7. Type new landmark")
         else:
             lines.append("7. Type new landmark")
@@ -1333,14 +1171,14 @@ def handle_customer_find_service(parts: List[str], phone: str) -> Tuple[str, int
             return ussd_response("CON Too short.\n0. Back"), 200
     else:
         # pick from list
-        lms = list_landmarks(village, limit=6)
+        lms = _session_landmarks(session_id, village)
         try:
             lm_idx = int(parts[4])
         except Exception:
             return ussd_response("CON Invalid.\n0. Back"), 200
         if lm_idx < 1 or lm_idx > len(lms):
             return ussd_response("CON Invalid landmark.\n0. Back"), 200
-        landmark = lms[lm_idx-1]["name"]
+        landmark = lms[lm_idx-1]
 
     # Step 6: optional note
     # If user typed new landmark, note is parts[6] else note is parts[5]
@@ -1358,7 +1196,13 @@ def handle_customer_find_service(parts: List[str], phone: str) -> Tuple[str, int
 
     # Create request + offers
     req_id = create_request(phone, service_id, village, landmark, note)
-    offer_count = build_offers(req_id, max_offers=5)
+    if batch_matcher.enabled():
+        # Matched with the other requests of this village's window (batch_matcher.py)
+        batch_matcher.submit(req_id, village)
+        offer_count = None
+    else:
+        offer_count = build_offers(req_id, max_offers=5)
+    offer_scheduler.kick(DB_PATH)
 
     if offer_count == 0:
         return (
@@ -1399,14 +1243,14 @@ def handle_provider(parts: List[str], session_id: str, phone: str) -> Tuple[str,
         return handle_provider_services(parts, phone)
 
     if choice == "3":
-        return handle_provider_landmark(parts, phone)
+        return handle_provider_landmark(parts, phone, session_id)
 
     if choice == "4":
-        return handle_provider_incoming(parts, phone)
+        return handle_provider_incoming(parts, phone, session_id)
 
 
     if choice == "5":
-        return handle_provider_complete(parts, phone)
+        return handle_provider_complete(parts, phone, session_id)
 
     return ussd_response(provider_menu() + "\n\nInvalid."), 200
 
@@ -1479,7 +1323,7 @@ def mirror_into_legacy_riders(phone: str, name: str, village: str, sacco: str) -
     conn.commit()
     conn.close()
 
-def handle_provider_landmark(parts: List[str], phone: str) -> Tuple[str, int]:
+def handle_provider_landmark(parts: List[str], phone: str, session_id: Optional[str] = None) -> Tuple[str, int]:
     phone = normalize_phone(phone)
     p = get_provider(phone)
     if not p:
@@ -1488,11 +1332,11 @@ def handle_provider_landmark(parts: List[str], phone: str) -> Tuple[str, int]:
     if len(parts) == 2:
         # show recent landmarks in provider village
         village = p["village"]
-        lms = list_landmarks(village, limit=6)
+        lms = _session_landmarks(session_id, village)
         lines = [f"CON Update landmark ({village})"]
         if lms:
             for i, lm in enumerate(lms, 1):
-                lines.append(f"{i}. {lm['name']}")
+                lines.append(f"{i}. {lm}")
             lines.append("7. Type new landmark")
         else:
             lines.append("7. Type new landmark")
@@ -1516,14 +1360,14 @@ def handle_provider_landmark(parts: List[str], phone: str) -> Tuple[str, int]:
         # add to community landmarks too (optional)
         add_landmark(village, landmark, "Added by provider", phone)
     else:
-        lms = list_landmarks(village, limit=6)
+        lms = _session_landmarks(session_id, village)
         try:
             idx = int(parts[2])
         except Exception:
             return ussd_response("CON Invalid.\n0. Back"), 200
         if idx < 1 or idx > len(lms):
             return ussd_response("CON Invalid.\n0. Back"), 200
-        landmark = lms[idx-1]["name"]
+        landmark = lms[idx-1]
 
     set_provider_landmark(phone, landmark)
 
@@ -1571,16 +1415,16 @@ def handle_provider_services(parts: List[str], phone: str) -> Tuple[str, int]:
 
     return ussd_response("CON Updated ✓\n0. Back"), 200
 
-def handle_provider_incoming(parts: List[str], phone: str) -> Tuple[str, int]:
+def handle_provider_incoming(parts: List[str], phone: str, session_id: Optional[str] = None) -> Tuple[str, int]:
     phone = normalize_phone(phone)
     p = get_provider(phone)
     if not p:
         return ussd_response("CON Register your profile first.\n(Provider Menu -> 1)\n0. Back"), 200
 
-    offers = provider_pending_offers(phone, limit=5)
-
     # P*4 -> list
     if len(parts) == 2:
+        offers = provider_pending_offers(phone, limit=5)
+        session_state.snapshot_put(session_id, "provider_offers", [int(o["offer_id"]) for o in offers])
         lines = ["CON Incoming requests"]
         if not offers:
             lines += ["No offers yet.", "0. Back"]
@@ -1595,15 +1439,18 @@ def handle_provider_incoming(parts: List[str], phone: str) -> Tuple[str, int]:
     if parts[2] == "0":
         return ussd_response(provider_menu()), 200
 
-    # P*4*<index> -> accept/pass menu
+    # P*4*<index> -> accept/pass menu (resolved against the list shown)
     try:
         idx = int(parts[2])
     except Exception:
         return ussd_response("CON Invalid.\n0. Back"), 200
-    if idx < 1 or idx > len(offers):
+    have, offer_id = session_state.snapshot_pick(session_id, "provider_offers", idx)
+    if not have:
+        offers = provider_pending_offers(phone, limit=5)
+        offer_id = int(offers[idx-1]["offer_id"]) if 1 <= idx <= len(offers) else None
+    if offer_id is None:
         return ussd_response("CON Invalid.\n0. Back"), 200
-
-    offer_id = int(offers[idx-1]["offer_id"])
+    offer_id = int(offer_id)
 
     if len(parts) == 3:
         return ussd_response(
@@ -1617,14 +1464,16 @@ def handle_provider_incoming(parts: List[str], phone: str) -> Tuple[str, int]:
     if action == "0":
         return ussd_response(provider_menu()), 200
     if action == "1":
-        ok = accept_offer(phone, offer_id)
-        if ok:
+        outcome, _ = claim_offer(phone, offer_id)
+        if outcome == CLAIM_ACCEPTED:
             return (
                 "END Accepted ✓\n"
                 "Phone numbers stay hidden.\n"
                 "SACCO/admin can connect you.",
                 200
             )
+        if outcome == CLAIM_BUSY:
+            return ("END Busy, please try again.", 200)
         return ("END Not available.\n(Already assigned)", 200)
 
     if action == "2":
@@ -1633,16 +1482,16 @@ def handle_provider_incoming(parts: List[str], phone: str) -> Tuple[str, int]:
 
     return ussd_response("CON Invalid.\n0. Back"), 200
 
-def handle_provider_complete(parts: List[str], phone: str) -> Tuple[str, int]:
+def handle_provider_complete(parts: List[str], phone: str, session_id: Optional[str] = None) -> Tuple[str, int]:
     phone = normalize_phone(phone)
     p = get_provider(phone)
     if not p:
         return ussd_response("CON Register your profile first.\n(Provider Menu -> 1)\n0. Back"), 200
 
-    jobs = provider_active_jobs(phone, limit=8)
-
     # P*5 -> list active jobs
     if len(parts) == 2:
+        jobs = provider_active_jobs(phone, limit=8)
+        session_state.snapshot_put(session_id, "provider_jobs", [int(j["request_id"]) for j in jobs])
         lines = ["CON Complete a job"]
         if not jobs:
             lines += ["No active jobs.", "0. Back"]
@@ -1658,15 +1507,18 @@ def handle_provider_complete(parts: List[str], phone: str) -> Tuple[str, int]:
     if parts[2] == "0":
         return ussd_response(provider_menu()), 200
 
-    # P*5*<index> -> confirm
+    # P*5*<index> -> confirm (resolved against the list shown)
     try:
         idx = int(parts[2])
     except Exception:
         return ussd_response("CON Invalid.\n0. Back"), 200
-    if idx < 1 or idx > len(jobs):
+    have, request_id = session_state.snapshot_pick(session_id, "provider_jobs", idx)
+    if not have:
+        jobs = provider_active_jobs(phone, limit=8)
+        request_id = int(jobs[idx-1]["request_id"]) if 1 <= idx <= len(jobs) else None
+    if request_id is None:
         return ussd_response("CON Invalid.\n0. Back"), 200
-
-    request_id = int(jobs[idx-1]["request_id"])
+    request_id = int(request_id)
 
     if len(parts) == 3:
         return ussd_response(
@@ -1685,6 +1537,8 @@ def handle_provider_complete(parts: List[str], phone: str) -> Tuple[str, int]:
         if ok:
             if anchored_ok is True:
                 outixs_line = "Outixs: ANCHORED ✅ (" + internal_id + ")"
+            elif outixs_outbox.get_status(DB_PATH, internal_id) == "PENDING":
+                outixs_line = "Outixs: PENDING ⏳ (" + internal_id + ")"
             elif anchored_ok is False:
                 outixs_line = "Outixs: NOT ANCHORED ⚠️ (" + internal_id + ")"
             else:
@@ -1699,6 +1553,10 @@ def handle_provider_complete(parts: List[str], phone: str) -> Tuple[str, int]:
 # Main router
 # =========================
 def handle_ussd(session_id: str, phone_number: str, text: str) -> Tuple[str, int]:
+    # session state lives until the session ENDs (or its TTL runs out)
+    return session_state.end(session_id, _handle_ussd(session_id, phone_number, text))
+
+def _handle_ussd(session_id: str, phone_number: str, text: str) -> Tuple[str, int]:
     ensure_schema_v2()
     phone = normalize_phone(phone_number)
     parts = parse_text(text)
@@ -1725,8 +1583,7 @@ def handle_ussd(session_id: str, phone_number: str, text: str) -> Tuple[str, int
             return ussd_response(provider_menu()), 200
         if c == "3":
             set_role(phone, "traveler")
-            ensure_traveler_schema()
-            return ussd_response(traveler_menu(phone)), 200
+            return ussd_response(traveler_menu(phone, session_id)), 200
         if c == "0":
             return "END Bye.", 200
         return ussd_response(root_menu(phone)), 200
@@ -1745,6 +1602,9 @@ def handle_ussd(session_id: str, phone_number: str, text: str) -> Tuple[str, int
         parts2 = ["P"] + parts
         return handle_provider(parts2, session_id, phone)
 
+    if role == "traveler":
+        return handle_traveler(["T"] + parts, phone, session_id)
+
     # Fallback
     return ussd_response(root_menu(phone)), 200
 
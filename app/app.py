@@ -11,6 +11,12 @@ import sqlite3
 import os
 import re
 
+import dbpool
+import fairness_state
+import migrations
+import outixs_outbox
+import provider_roster
+
 
 # --- Roles schema for web cockpit (simple, local) ---
 app = Flask(__name__)
@@ -32,7 +38,7 @@ def ensure_roles_schema(db_path: str):
     con.close()
 
 def set_active_role(db_path: str, phone: str, primary: str, sub: str = "", village: str = "Church") -> None:
-    con = sqlite3.connect(db_path)
+    con = dbpool.connect(db_path)
     cur = con.cursor()
     # Make sure table/cols exist (safe)
     cur.execute("""
@@ -57,7 +63,7 @@ def set_active_role(db_path: str, phone: str, primary: str, sub: str = "", villa
     con.close()
 
 def get_active_role(db_path: str, phone: str):
-    con = sqlite3.connect(db_path)
+    con = dbpool.connect(db_path)
     cur = con.cursor()
     try:
         cur.execute("SELECT primary_role, sub_role, village FROM user_roles WHERE phone=? LIMIT 1", (phone,))
@@ -91,7 +97,7 @@ def whoami():
     # 2) infer from providers table if active not set
     inferred_primary, inferred_sub = "customer", ""
     try:
-        con = sqlite3.connect(DB_PATH)
+        con = dbpool.connect(DB_PATH)
         cur = con.cursor()
         if phone:
             cur.execute("SELECT provider_type FROM providers WHERE phone=? LIMIT 1", (phone,))
@@ -247,6 +253,7 @@ def api_seed_demo():
                       is_available=excluded.is_available,
                       updated_at=datetime('now')
                 """, (ph, ptype, name, vil, sacco, lm, avail))
+                provider_roster.record_change(cur, ph, "profile")
             out["seeded"]["providers"] = len(riders)
         except Exception as e:
             out["seeded"]["providers"] = 0
@@ -285,8 +292,11 @@ def api_clear_demo():
 
         # remove demo riders
         try:
-            cur.execute("DELETE FROM providers WHERE phone IN ('+254700000003','+254700000004','+254700000002')")
+            demo = ("+254700000003", "+254700000004", "+254700000002")
+            cur.execute("DELETE FROM providers WHERE phone IN (?,?,?)", demo)
             out["cleared"]["providers"] = cur.rowcount
+            for ph in demo:
+                provider_roster.record_change(cur, ph, "delete")
         except Exception as e:
             out["cleared"]["providers"] = 0
             out["providers_error"] = str(e)
@@ -308,6 +318,15 @@ def api_clear_demo():
     return jsonify(out), 200
 
 
+_STATE_RIDERS_SQL = """
+SELECT phone, name, current_landmark, sacco, is_available
+FROM providers
+WHERE provider_type='rider'
+  AND COALESCE(is_available,1)=1
+ORDER BY updated_at DESC
+LIMIT 20
+"""
+
 def api_state():
     phone = request.args.get("phone","").strip()
     if not phone:
@@ -352,14 +371,7 @@ def api_state():
         # Nearest riders (simple heuristic: all available riders in same village/landmark)
         # providers schema: phone, provider_type, name, village, sacco, current_landmark, is_available
         try:
-            rows = cur.execute("""
-                SELECT phone, name, current_landmark, sacco, is_available
-                FROM providers
-                WHERE provider_type='rider'
-                  AND COALESCE(is_available,1)=1
-                ORDER BY datetime(updated_at) DESC
-                LIMIT 20
-            """).fetchall()
+            rows = cur.execute(_STATE_RIDERS_SQL).fetchall()
             for r in rows:
                 out["nearest_riders"].append({
                     "phone": r["phone"],
@@ -437,8 +449,7 @@ def api_outixs_ticker():
     if limit > 200: limit = 200
 
     db = _db_path()
-    con = sqlite3.connect(db)
-    con.row_factory = sqlite3.Row
+    con = dbpool.connect(db)
     cur = con.cursor()
     cur.execute("""
         SELECT id, created_at, phone, event_type, ref_type, ref_id, amount, note, payload_json
@@ -461,8 +472,29 @@ def tester():
 def health():
     return ("ok", 200)
 
+@app.route("/api/db_stats", methods=["GET"])
+def api_db_stats():
+    # per-process counters from the shared SQLite connection provider
+    return jsonify({"ok": True, "pid": os.getpid(), "stats": dbpool.stats()})
+
+@app.route("/api/ussd_routes", methods=["GET"])
+def api_ussd_routes():
+    # per-process hit counts + latency per USSD route (ussd_router)
+    try:
+        import ussd as ussd_module
+        router = ussd_module.ROUTER
+    except Exception as e:
+        return jsonify({"ok": False, "error": str(e)}), 500
+    return jsonify({"ok": True, "pid": os.getpid(), "routes": router.routes(), "stats": router.stats()})
+
 DB_PATH = os.environ.get("ANGELOPP_DB", "/opt/angelopp/data/bumala.db")
 ensure_roles_schema(DB_PATH)
+# Versioned schema: migrate once at startup so /ussd requests never run DDL
+migrations.ensure_current(DB_PATH)
+# Warm the fairness window from the assignments table (startup rebuild)
+fairness_state.get_window(DB_PATH).snapshot()
+# Send anchors still queued from before a restart
+outixs_outbox.kick(DB_PATH)
 ANON_SALT = os.environ.get("ANGELOPP_ANON_SALT", "angelopp-public-v1")
 
 # -----------------------------
@@ -497,9 +529,7 @@ def anon_user(phone: str) -> str:
     return 'u_' + hashlib.sha256(raw).hexdigest()[:10]
 
 def db():
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    return conn
+    return dbpool.connect(DB_PATH)
 
 def ensure_public_policy():
     con = db()
@@ -584,15 +614,38 @@ def _db_path():
     return "/opt/angelopp/data/bumala.db"
 
 def _q(sql, params=()):
-    conn = sqlite3.connect(_db_path())
+    conn = dbpool.connect(_db_path())
     try:
-        conn.row_factory = sqlite3.Row
         cur = conn.cursor()
         cur.execute(sql, params)
         return [dict(r) for r in cur.fetchall()]
     finally:
         conn.close()
 
+_PANEL_BUSINESSES_SQL = """
+SELECT phone, name, village, current_landmark
+FROM providers
+WHERE provider_type='business'
+ORDER BY created_at DESC
+LIMIT 10
+"""
+
+_PANEL_LATEST_DELIVERIES_SQL = """
+SELECT id, source_type, source_phone, pickup_village, pickup_landmark,
+       dropoff_village, dropoff_landmark, status, assigned_rider_phone, created_at
+FROM delivery_requests
+ORDER BY id DESC
+LIMIT 10
+"""
+
+_PANEL_OPEN_DELIVERIES_SQL = """
+SELECT id, pickup_landmark, dropoff_landmark, status, assigned_rider_phone, created_at
+FROM delivery_requests
+WHERE status IN ('new','open','requested','pending','offered','accepted','picked_up')
+ORDER BY id DESC
+LIMIT 10
+"""
+
 @app.route("/api/panels", methods=["GET"])
 def api_panels():
     phone = (request.args.get("phone","") or "").strip()
@@ -610,27 +663,11 @@ def api_panels():
     if not village:
         village = "Church"
 
-    # “Nearest riders” panel (simple: available riders in same village)
-    riders = _q("""
-      SELECT phone, name, current_landmark, is_available
-      FROM providers
-      WHERE provider_type='rider'
-        AND village=?
-        AND COALESCE(is_available,1)=1
-      ORDER BY
-        CASE WHEN current_landmark IS NULL OR current_landmark='' THEN 99 ELSE 0 END,
-        phone ASC
-      LIMIT 10
-    """, (village,))
+    # “Nearest riders” panel (simple: available riders in same village, from the roster cache)
+    riders = provider_roster.get_roster(_db_path()).riders_panel(village, limit=10)
 
     # Businesses panel
-    businesses = _q("""
-      SELECT phone, name, village, current_landmark
-      FROM providers
-      WHERE provider_type='business'
-      ORDER BY created_at DESC
-      LIMIT 10
-    """)
+    businesses = _q(_PANEL_BUSINESSES_SQL)
 
     # Channels panel (schema depends on your channels table; try best-effort)
     channels = []
@@ -648,21 +685,9 @@ def api_panels():
             channels = []
 
     # Delivery requests panel (latest + open)
-    deliveries_latest = _q("""
-      SELECT id, source_type, source_phone, pickup_village, pickup_landmark,
-             dropoff_village, dropoff_landmark, status, assigned_rider_phone, created_at
-      FROM delivery_requests
-      ORDER BY id DESC
-      LIMIT 10
-    """)
+    deliveries_latest = _q(_PANEL_LATEST_DELIVERIES_SQL)
 
-    deliveries_open = _q("""
-      SELECT id, pickup_landmark, dropoff_landmark, status, assigned_rider_phone, created_at
-      FROM delivery_requests
-      WHERE COALESCE(status,'new') IN ('new','open','requested','pending','offered','accepted','picked_up')
-      ORDER BY id DESC
-      LIMIT 10
-    """)
+    deliveries_open = _q(_PANEL_OPEN_DELIVERIES_SQL)
 
     return jsonify({
         "ok": True,
@@ -0,0 +1,211 @@
+"""
+batch_matcher.py
+
+Optional batched matching: requests that arrive within WINDOW_SECONDS in
+one village (a bus arriving at Busia) are matched together, instead of
+each running build_offers on its own and all getting the same nearest
+riders. Off by default (ANGELOPP_BATCH_MATCH_SECONDS=0).
+
+- submit(request_id, village) queues a NEW request; the first one in a
+  village starts a timer, and flush() matches the whole window when it
+  fires (or as soon as MAX_BATCH requests are waiting)
+- costs per (request, rider): ETA + fairness penalty, the same numbers as
+  build_offers (bulk_requests.candidate_costs: one roster / fairness /
+  ETA lookup for the window)
+- primaries: min-cost assignment over the window (policies.assignment);
+  a rider's 2nd, 3rd.. primary in one window costs SECOND_JOB_MINUTES more;
+  the solver only sees each request's 2 x max_offers cheapest riders, and
+  a window holds at most MAX_BATCH requests (the solve runs in the web
+  worker, see scripts/bench_batch_matcher.py --solve-only)
+- every request is offered to its primary first, then to the next-best
+  riders (riders who are another request's primary rank lower)
+- the requests keep reoffer_at from create_request: if this process dies
+  before a flush, offer_scheduler offers them after the TTL
+
+    ANGELOPP_BATCH_MATCH_SECONDS=8 gunicorn ...
+"""
+
+import math
+import os
+import threading
+import time
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+import offer_scheduler
+from policies.assignment import min_cost_assignment
+from policies.topk import top_k
+
+WINDOW_SECONDS = float(os.environ.get("ANGELOPP_BATCH_MATCH_SECONDS", "0"))
+MAX_BATCH = int(os.environ.get("ANGELOPP_BATCH_MATCH_MAX", "50"))
+SECOND_JOB_MINUTES = float(os.environ.get("ANGELOPP_BATCH_SECOND_JOB_MINUTES", "5"))
+CANDIDATES_PER_REQUEST = 2    # x max_offers: columns the solver sees per request
+NOT_ALLOWED = 1e6       # rider does not offer the service / is not in the village
+
+
+def enabled() -> bool:
+    return WINDOW_SECONDS > 0
+
+
+# =========================
+# Solve
+# =========================
+def assign(costs: List[List[Tuple[float, str]]], second_job: float = SECOND_JOB_MINUTES,
+           per_request: int = 10) -> List[Optional[str]]:
+    """
+    Primary rider per request, lowest total cost. costs[i] is the
+    (cost, phone) list of request i. With more requests than riders a
+    rider can be primary more than once, at `second_job` extra per repeat.
+
+    Only the union of every request's `per_request` cheapest riders become
+    columns: the solve is pure Python in the web worker (holding the GIL),
+    and a column per rider in the village made it take seconds.
+    """
+    phones = sorted({phone for c in costs for _, phone in top_k(c, per_request, key=lambda x: x[0])})
+    if not costs or not phones:
+        return [None] * len(costs)
+    copies = max(1, math.ceil(len(costs) / len(phones)))
+    columns = [(phone, k) for k in range(copies) for phone in phones]
+    matrix = []
+    for c in costs:
+        by_phone = {phone: cost for cost, phone in c}
+        matrix.append([
+            by_phone[phone] + k * second_job if phone in by_phone else NOT_ALLOWED
+            for phone, k in columns
+        ])
+    picked = min_cost_assignment(matrix)
+    return [
+        columns[j][0] if j >= 0 and matrix[i][j] < NOT_ALLOWED else None
+        for i, j in enumerate(picked)
+    ]
+
+
+def plan_offers(rows, max_offers: int = 5) -> List[list]:
+    """Offers per row (bulk_requests.BulkRow), primary first."""
+    import bulk_requests   # imports angelopp_core, which imports this module
+
+    costs = bulk_requests.candidate_costs(rows)
+    primary = assign(costs, per_request=max(1, max_offers) * CANDIDATES_PER_REQUEST)
+    taken = Counter(p for p in primary if p)
+    out = []
+    for c, prim in zip(costs, primary):
+        eff = {phone: cost for cost, phone in c}
+        backups = [(cost + (SECOND_JOB_MINUTES if phone in taken else 0.0), cost, phone)
+                   for cost, phone in c if phone != prim]
+        best = top_k(backups, max_offers - (1 if prim else 0), key=lambda x: x[0])
+        offers = [bulk_requests.Offer(prim, eff[prim], int(eff[prim]))] if prim else []
+        floor = eff[prim] if prim else 0.0
+        # score keeps the offer order: nobody ranks above the primary
+        offers.extend(bulk_requests.Offer(phone, max(score, floor), int(cost)) for score, cost, phone in best)
+        out.append(offers)
+    return out
+
+
+def match_requests(request_ids: List[int], max_offers: int = 5) -> Dict[str, object]:
+    """Match NEW requests together and write their offers in one transaction."""
+    import angelopp_core as core
+    import bulk_requests
+
+    t0 = time.perf_counter()
+    conn = core.db()
+    marks = ",".join("?" * len(request_ids))
+    reqs = conn.execute(f"""
+    SELECT id, customer_phone, service_id, village, landmark, note
+    FROM service_requests
+    WHERE id IN ({marks}) AND status='NEW'
+    ORDER BY id
+    """, [int(r) for r in request_ids]).fetchall() if request_ids else []
+    conn.close()
+
+    rows = [bulk_requests.BulkRow(r["customer_phone"], int(r["service_id"]), r["village"],
+                                  r["landmark"] or "", r["note"] or "") for r in reqs]
+    plans = plan_offers(rows, max_offers=max_offers)
+    t_solve = time.perf_counter() - t0
+
+    conn = core.db()
+    cur = conn.cursor()
+    offered = 0
+    try:
+        cur.execute("BEGIN IMMEDIATE")
+        for r, offers in zip(reqs, plans):
+            if not offers:
+                continue
+            # still NEW? (offer_scheduler may have got there first)
+            cur.execute("UPDATE service_requests SET status='OFFERED', reoffer_at=datetime('now', ?) "
+                        "WHERE id=? AND status='NEW'", (offer_scheduler.ttl_modifier(), int(r["id"])))
+            if cur.rowcount != 1:
+                continue
+            cur.executemany("""
+            INSERT OR IGNORE INTO request_offers(request_id, provider_phone, score, eta_minutes, status)
+            VALUES (?, ?, ?, ?, 'OFFERED')
+            """, [(int(r["id"]), o.phone, o.score, o.eta_minutes) for o in offers])
+            offered += 1
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+    tops = Counter(p[0].phone for p in plans if p)
+    return {
+        "requests": len(rows),
+        "offered": offered,
+        "riders_with_top_slot": len(tops),
+        "max_top_slots_per_rider": max(tops.values()) if tops else 0,
+        "solve_ms": round(t_solve * 1000.0, 1),
+    }
+
+
+# =========================
+# Window
+# =========================
+_PENDING: Dict[Tuple[str, str], List[int]] = {}
+_TIMERS: Dict[Tuple[str, str], threading.Timer] = {}     # window timer per key, cancelled on flush
+_LOCK = threading.Lock()
+
+def submit(request_id: int, village: str) -> None:
+    """Queue a NEW request; it is matched when its village's window closes."""
+    import angelopp_core as core
+
+    key = (str(core.DB_PATH), (village or "").strip())
+    with _LOCK:
+        ids = _PENDING.setdefault(key, [])
+        ids.append(int(request_id))
+        full = len(ids) >= MAX_BATCH
+        if not full and key not in _TIMERS:
+            t = _TIMERS[key] = threading.Timer(WINDOW_SECONDS, _expire, args=(key,))
+            t.daemon = True
+            t.start()
+    if full:
+        threading.Thread(target=flush, args=(key,), name="batch-matcher", daemon=True).start()
+
+
+def _expire(key: Tuple[str, str]) -> None:
+    # a timer that lost the race with a full-window flush must not close the next window early
+    with _LOCK:
+        if _TIMERS.get(key) is not threading.current_thread():
+            return
+    flush(key)
+
+
+def flush(key: Tuple[str, str]) -> Optional[Dict[str, object]]:
+    import angelopp_core as core
+
+    with _LOCK:
+        ids = _PENDING.pop(key, [])
+        t = _TIMERS.pop(key, None)
+    if t is not None and t is not threading.current_thread():
+        t.cancel()
+    if not ids:
+        return None
+    if str(core.DB_PATH) != key[0]:
+        print("batch_matcher: DB_PATH changed, leaving", len(ids), "requests to offer_scheduler")
+        return None
+    try:
+        res = match_requests(ids)
+    except Exception as e:
+        print("batch_matcher flush failed (offer_scheduler will retry):", e)
+        return None
+    print(f"batch_matcher {key[1]}: {res}")
+    return res
@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+"""
+bulk_requests.py
+
+Bulk ingestion for SACCO/admin-entered jobs (market days, school runs):
+many service_requests in one transaction, matched as one batch.
+
+- candidates per (village, service) come from the provider roster once per
+  batch; fairness penalties are one fairness_state lookup for all riders;
+  landmark resolution and ETAs are cached per (village, from, to)
+- same scoring as build_offers (ETA + fairness penalty, lower is better),
+  plus SPREAD_MINUTES per top slot a rider already got in this batch, so
+  one well-placed rider does not get the top slot of every request
+- requests + offers are written in one BEGIN IMMEDIATE transaction; the
+  requests enter offer_scheduler's expiry / re-offer cycle like any other
+
+CSV (header row; service is an id or a service name):
+    customer_phone,service,village,landmark,note
+    +254712345678,Rider (Boda/Tuktuk),Bumala,Market Gate,school run 7am
+
+CLI:
+    python bulk_requests.py --db /opt/angelopp/data/bumala.db --csv pickups.csv
+    python bulk_requests.py --db ... --csv pickups.csv --dry-run
+"""
+
+import argparse
+import csv
+import os
+import time
+from collections import Counter
+from typing import Dict, IO, List, NamedTuple, Tuple
+
+import angelopp_core as core
+import landmark_index
+import migrations
+import offer_scheduler
+import provider_roster
+import travel_matrix
+from policies.topk import top_k
+
+DEFAULT_DB = os.environ.get("ANGELOPP_DB", "/opt/angelopp/data/bumala.db")
+SPREAD_MINUTES = float(os.environ.get("ANGELOPP_BULK_SPREAD_MINUTES", "3"))
+
+
+class BulkRow(NamedTuple):
+    customer_phone: str
+    service_id: int
+    village: str
+    landmark: str
+    note: str = ""
+    line: int = 0           # CSV line, for error reports
+
+
+class Offer(NamedTuple):
+    phone: str
+    score: float
+    eta_minutes: int        # eta + fairness penalty, as build_offers stores it
+
+
+# =========================
+# Input
+# =========================
+def service_ids() -> Dict[str, int]:
+    """Lookup for the CSV `service` column: id or lowercased name -> id."""
+    out = {}
+    for r in core.list_services():
+        out[str(r["id"])] = int(r["id"])
+        out[str(r["name"]).strip().lower()] = int(r["id"])
+    return out
+
+
+def parse_csv(f: IO[str]) -> Tuple[List[BulkRow], List[str]]:
+    """Rows that can be ingested, and one error line per rejected row."""
+    services = service_ids()
+    rows, errors = [], []
+    for n, rec in enumerate(csv.DictReader(f), start=2):
+        rec = {(k or "").strip().lower(): (v or "").strip() for k, v in rec.items()}
+        phone = core.normalize_phone(rec.get("customer_phone", ""))
+        sid = services.get(rec.get("service", "").lower())
+        if not core.digits_only(phone):
+            errors.append(f"line {n}: missing customer_phone")
+            continue
+        if sid is None:
+            errors.append(f"line {n}: unknown service {rec.get('service', '')!r}")
+            continue
+        rows.append(BulkRow(
+            customer_phone=phone,
+            service_id=sid,
+            village=(rec.get("village") or "Bumala").strip() or "Bumala",
+            landmark=core._clean_text(rec.get("landmark", ""), 28),
+            note=core._clean_text(rec.get("note", ""), 40),
+            line=n,
+        ))
+    return rows, errors
+
+
+# =========================
+# Matching
+# =========================
+def candidate_costs(rows: List[BulkRow]) -> List[List[Tuple[float, str]]]:
+    """
+    (ETA + fairness penalty, phone) for every candidate of every row, in
+    roster order. Rosters, penalties, landmarks and ETAs are looked up once
+    per batch (batch_matcher.py uses the same costs). Rows with the same
+    village, service and pickup get the same list object: read-only.
+    """
+    db_path = core.DB_PATH
+    roster = provider_roster.get_roster(db_path)
+    ix = landmark_index.get_index(db_path)
+
+    candidates: Dict[Tuple[str, int], List[Dict[str, object]]] = {}
+    for r in rows:
+        key = (r.village, r.service_id)
+        if key not in candidates:
+            candidates[key] = roster.candidates(r.village, r.service_id)
+    phones = {core.normalize_phone(p["phone"]) for c in candidates.values() for p in c}
+    penalties = core.compute_penalty_minutes_bulk(list(phones))
+
+    places: Dict[Tuple[str, str], landmark_index.Resolved] = {}
+    etas: Dict[Tuple[str, object, object], int] = {}
+
+    def place(village: str, name: str) -> landmark_index.Resolved:
+        key = (village, name or "")
+        if key not in places:
+            places[key] = ix.lookup(village, name)
+        return places[key]
+
+    def place_key(pl: landmark_index.Resolved) -> object:
+        return pl.id if pl.id is not None else pl.norm
+
+    # per (village, service): (phone, penalty, where the rider is), resolved once
+    riders: Dict[Tuple[str, int], List[Tuple[str, int, landmark_index.Resolved]]] = {}
+    for (village, sid), cands in candidates.items():
+        out_c = []
+        for p in cands:
+            phone = core.normalize_phone(p["phone"])
+            out_c.append((phone, penalties.get(phone, 0), place(village, (p["current_landmark"] or "").strip())))
+        riders[(village, sid)] = out_c
+
+    # rows with the same pickup (a bus stage) share one cost list
+    by_pickup: Dict[Tuple[str, int, object], List[Tuple[float, str]]] = {}
+    out = []
+    for r in rows:
+        to = place(r.village, r.landmark)
+        to_key = place_key(to)
+        costs = by_pickup.get((r.village, r.service_id, to_key))
+        if costs is None:
+            costs = by_pickup[(r.village, r.service_id, to_key)] = []
+            for phone, penalty, frm in riders[(r.village, r.service_id)]:
+                ekey = (r.village, place_key(frm), to_key)
+                eta = etas.get(ekey)
+                if eta is None:
+                    eta = etas[ekey] = travel_matrix.eta_between(db_path, r.village, frm, to)
+                costs.append((float(eta + penalty), phone))
+        out.append(costs)
+    return out
+
+
+def match_batch(rows: List[BulkRow], max_offers: int = 5) -> List[List[Offer]]:
+    """Offers per row (same order as rows): greedy in row order, top slots spread."""
+    tops: Counter = Counter()
+    out = []
+    for costs in candidate_costs(rows):
+        scored = [(eff + SPREAD_MINUTES * tops[phone], eff, phone) for eff, phone in costs]
+        best = top_k(scored, max_offers, key=lambda x: x[0])
+        if best:
+            tops[best[0][2]] += 1
+        out.append([Offer(phone, float(score), int(eff)) for score, eff, phone in best])
+    return out
+
+
+# =========================
+# Ingest
+# =========================
+def ingest(rows: List[BulkRow], max_offers: int = 5, dry_run: bool = False) -> Dict[str, object]:
+    """
+    Insert all rows as service_requests and their offers in one transaction.
+    Returns counts, the new request ids and the top-slot spread.
+    """
+    t0 = time.perf_counter()
+    matches = match_batch(rows, max_offers=max_offers)
+    t_match = time.perf_counter() - t0
+
+    tops = Counter(m[0].phone for m in matches if m)
+    summary: Dict[str, object] = {
+        "requests": len(rows),
+        "offers": sum(len(m) for m in matches),
+        "unmatched": sum(1 for m in matches if not m),
+        "riders_with_top_slot": len(tops),
+        "max_top_slots_per_rider": max(tops.values()) if tops else 0,
+        "match_ms": round(t_match * 1000.0, 1),
+        "request_ids": [],
+    }
+    if dry_run or not rows:
+        return summary
+
+    conn = core.db()
+    cur = conn.cursor()
+    try:
+        cur.execute("BEGIN IMMEDIATE")
+        offer_rows = []
+        ids = []
+        for r, offers in zip(rows, matches):
+            cur.execute("""
+            INSERT INTO service_requests(customer_phone, service_id, village, landmark, note, status, reoffer_at)
+            VALUES (?, ?, ?, ?, ?, ?, datetime('now', ?))
+            """, (r.customer_phone, r.service_id, r.village, r.landmark, r.note,
+                  "OFFERED" if offers else "NEW", offer_scheduler.ttl_modifier()))
+            rid = int(cur.lastrowid)
+            ids.append(rid)
+            offer_rows.extend((rid, o.phone, o.score, o.eta_minutes) for o in offers)
+        cur.executemany("""
+        INSERT OR IGNORE INTO request_offers(request_id, provider_phone, score, eta_minutes, status)
+        VALUES (?, ?, ?, ?, 'OFFERED')
+        """, offer_rows)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+    # unmatched rows (NEW) are retried by the scheduler like any request
+    offer_scheduler.kick(core.DB_PATH)
+    summary["request_ids"] = ids
+    summary["total_ms"] = round((time.perf_counter() - t0) * 1000.0, 1)
+    return summary
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Bulk-insert SACCO/admin jobs from a CSV and match them as one batch")
+    ap.add_argument("--db", default=DEFAULT_DB)
+    ap.add_argument("--csv", required=True, help="customer_phone,service,village,landmark,note")
+    ap.add_argument("--max-offers", type=int, default=5)
+    ap.add_argument("--dry-run", action="store_true", help="match and report, write nothing")
+    ap.add_argument("--strict", action="store_true", help="write nothing if any row is rejected")
+    args = ap.parse_args()
+
+    core.DB_PATH = args.db
+    migrations.ensure_current(args.db)
+    with open(args.csv, newline="", encoding="utf-8") as f:
+        rows, errors = parse_csv(f)
+    for e in errors:
+        print("skip", e)
+    if errors and args.strict:
+        print(f"{len(errors)} rejected rows, nothing written (--strict)")
+        raise SystemExit(1)
+
+    res = ingest(rows, max_offers=args.max_offers, dry_run=args.dry_run)
+    ids = res.pop("request_ids")
+    print(" ".join(f"{k}={v}" for k, v in res.items()))
+    if ids:
+        print(f"request ids {ids[0]}..{ids[-1]}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,322 @@
+#!/usr/bin/env python3
+"""
+cold_archive.py
+
+Hot/cold split for bumala.db: closed rows older than RETENTION_DAYS move
+to a separate archive database (bumala_archive.db next to it, ATTACHed as
+`cold`), so the hot DB the USSD flow and cockpit read stays small enough
+to live in the page cache.
+
+What moves (COLD_TABLES):
+- service_requests CLOSED / EXPIRED, closed (or created) before the cutoff,
+  together with their assignments and offers (request_offers and
+  request_offers_archive -> cold.request_offers_archive)
+- delivery_requests delivered / cancelled, last updated before the cutoff
+- messages created before the cutoff, except the newest KEEP_MESSAGES per
+  channel_id and per category: the channel "last message" screen and
+  ussd.get_latest_messages read the hot table, and a quiet channel must
+  not go empty
+- points_ledger created before the cutoff (nothing reads old ledger rows;
+  points_balance holds the balance)
+
+How:
+- cold tables are created from the hot table's own CREATE TABLE (same
+  columns and ids); columns added to the hot table later are added to the
+  cold one before copying
+- batches of BATCH_SIZE parent rows, walking the hot table by id; one
+  BEGIN IMMEDIATE per batch: INSERT OR REPLACE into cold, then DELETE from
+  hot. With WAL the two files do not commit as one, so a crash in between
+  can leave a row in both; the next run replaces the cold copy and
+  deletes the hot one
+- reports: connect() returns a connection with the archive attached and
+  TEMP views <table>_all (hot UNION ALL cold) per archived table;
+  request_offers_all covers hot offers, offer_archive.py's table and cold
+- RETENTION_DAYS must stay above the windows that read history from the
+  hot DB (provider_roster TRUST_DAYS, fairness window)
+
+CLI (cron, e.g. weekly, after offer_archive.py):
+    python cold_archive.py --db /opt/angelopp/data/bumala.db
+    python cold_archive.py --db ... --days 180 --archive /data/bumala_archive.db
+    python cold_archive.py --db ... --verify      # counts per table, ids in both
+"""
+
+import argparse
+import os
+import re
+import sqlite3
+import time
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+import migrations
+
+DEFAULT_DB = os.environ.get("ANGELOPP_DB", "/opt/angelopp/data/bumala.db")
+ARCHIVE_DB = os.environ.get("ANGELOPP_ARCHIVE_DB", "")      # default: <db>_archive.db
+RETENTION_DAYS = int(os.environ.get("ANGELOPP_ARCHIVE_DAYS", "90"))
+BATCH_SIZE = int(os.environ.get("ANGELOPP_ARCHIVE_BATCH", "2000"))
+KEEP_MESSAGES = int(os.environ.get("ANGELOPP_ARCHIVE_KEEP_MESSAGES", "5"))   # per channel / category, stay hot
+
+
+class Child(NamedTuple):
+    table: str          # hot table
+    column: str         # points at the parent id
+    cold: str           # cold table it goes to
+
+
+class ColdTable(NamedTuple):
+    table: str
+    closed: str         # SQL condition; :cutoff is the datetime('now', ?) modifier
+    children: Tuple[Child, ...] = ()
+    keep: str = ""      # SELECT of ids that stay hot whatever their age (once per run, into temp.keep_<table>)
+
+
+COLD_TABLES: List[ColdTable] = [
+    ColdTable("service_requests",
+              "status IN ('CLOSED', 'EXPIRED') AND COALESCE(closed_at, created_at) < datetime('now', :cutoff)",
+              (Child("assignments", "request_id", "assignments"),
+               Child("request_offers", "request_id", "request_offers_archive"),
+               Child("request_offers_archive", "request_id", "request_offers_archive"))),
+    ColdTable("delivery_requests",
+              "status IN ('delivered', 'cancelled') AND updated_at < datetime('now', :cutoff)"),
+    ColdTable("messages", "created_at < datetime('now', :cutoff)", keep=f"""
+              SELECT id FROM (
+                SELECT id,
+                       ROW_NUMBER() OVER (PARTITION BY channel_id ORDER BY id DESC) AS by_channel,
+                       ROW_NUMBER() OVER (PARTITION BY lower(trim(category)) ORDER BY id DESC) AS by_category
+                FROM main.messages)
+              WHERE by_channel <= {int(KEEP_MESSAGES)} OR by_category <= {int(KEEP_MESSAGES)}"""),
+    ColdTable("points_ledger", "created_at < datetime('now', :cutoff)"),
+]
+
+# TEMP view -> tables it unions (columns of the first one)
+VIEWS: Dict[str, List[str]] = {
+    "service_requests_all": ["main.service_requests", "cold.service_requests"],
+    "assignments_all": ["main.assignments", "cold.assignments"],
+    "request_offers_all": ["main.request_offers", "main.request_offers_archive", "cold.request_offers_archive"],
+    "delivery_requests_all": ["main.delivery_requests", "cold.delivery_requests"],
+    "messages_all": ["main.messages", "cold.messages"],
+    "points_ledger_all": ["main.points_ledger", "cold.points_ledger"],
+}
+
+
+def archive_path_for(db_path: str) -> str:
+    return ARCHIVE_DB or os.path.splitext(str(db_path))[0] + "_archive.db"
+
+
+def cutoff_modifier(days: int) -> str:
+    return f"-{int(days)} days"
+
+
+def batch_sql(t: ColdTable) -> str:
+    """
+    Next batch of parent ids. NOT INDEXED keeps this a rowid walk: a status
+    index would sort every closed row again for each batch.
+    """
+    keep = f" AND id NOT IN temp.keep_{t.table}" if t.keep else ""
+    return (f"SELECT id FROM main.{t.table} NOT INDEXED "
+            f"WHERE id > :after AND {t.closed}{keep} ORDER BY id LIMIT :limit")
+
+
+# =========================
+# Schema
+# =========================
+def _columns(conn, schema: str, table: str) -> List[Tuple[str, str]]:
+    return [(r[1], r[2]) for r in conn.execute(f"PRAGMA {schema}.table_info({table})").fetchall()]
+
+
+def _cold_tables() -> List[str]:
+    out = []
+    for t in COLD_TABLES:
+        for name in [t.table] + [c.cold for c in t.children]:
+            if name not in out:
+                out.append(name)
+    return out
+
+
+def ensure_cold_schema(conn) -> None:
+    """Create missing cold tables from the hot CREATE TABLE; add new columns."""
+    for name in _cold_tables():
+        row = conn.execute("SELECT sql FROM main.sqlite_master WHERE type='table' AND name=?", (name,)).fetchone()
+        if not row:
+            continue
+        ddl = re.sub(r"^CREATE TABLE\s+(IF NOT EXISTS\s+)?[\"`\[]?\w+[\"`\]]?",
+                     f"CREATE TABLE IF NOT EXISTS cold.{name}", row[0].strip(), count=1, flags=re.I)
+        conn.execute(ddl)
+        have = {c for c, _ in _columns(conn, "cold", name)}
+        for col, decl in _columns(conn, "main", name):
+            if col not in have:
+                conn.execute(f"ALTER TABLE cold.{name} ADD COLUMN {col} {decl}")
+    conn.execute("CREATE INDEX IF NOT EXISTS cold.idx_cold_assignments_provider ON assignments(provider_phone, assigned_at)")
+    conn.execute("CREATE INDEX IF NOT EXISTS cold.idx_cold_offers_request ON request_offers_archive(request_id)")
+
+
+def create_views(conn) -> None:
+    for view, sources in VIEWS.items():
+        cols = ", ".join(c for c, _ in _columns(conn, *sources[0].split(".")))
+        union = "\nUNION ALL\n".join(f"SELECT {cols} FROM {src}" for src in sources)
+        conn.execute(f"DROP VIEW IF EXISTS temp.{view}")
+        conn.execute(f"CREATE TEMP VIEW {view} AS\n{union}")
+
+
+def create_keep_tables(conn) -> None:
+    """TEMP id tables behind ColdTable.keep; archive() fills them before moving that table."""
+    for t in COLD_TABLES:
+        if t.keep:
+            conn.execute(f"CREATE TEMP TABLE IF NOT EXISTS keep_{t.table}(id INTEGER PRIMARY KEY)")
+
+
+def _fill_keep(conn, t: ColdTable) -> None:
+    # Outside the batch transactions: rows written later are newer than the cutoff anyway
+    conn.execute(f"DELETE FROM temp.keep_{t.table}")
+    conn.execute(f"INSERT INTO temp.keep_{t.table}(id) {t.keep}")
+
+
+def connect(db_path, archive_path: Optional[str] = None) -> sqlite3.Connection:
+    """
+    Plain (not pooled: ATTACH and TEMP views stay with the connection)
+    connection to the hot DB with the archive attached as `cold` and the
+    <table>_all views. Caller closes it.
+    """
+    migrations.ensure_current(db_path)
+    conn = sqlite3.connect(str(db_path), timeout=30, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA busy_timeout=5000")
+    conn.execute("ATTACH DATABASE ? AS cold", (archive_path or archive_path_for(db_path),))
+    conn.execute("PRAGMA cold.journal_mode=WAL")
+    ensure_cold_schema(conn)
+    create_views(conn)
+    create_keep_tables(conn)
+    return conn
+
+
+# =========================
+# Move
+# =========================
+def _copy(cur, src: str, dst: str, where: str, ids: List[int]) -> None:
+    cols = ", ".join(c for c, _ in _columns(cur.connection, "main", src))
+    marks = ",".join("?" * len(ids))
+    cur.execute(f"INSERT OR REPLACE INTO cold.{dst}({cols}) SELECT {cols} FROM main.{src} WHERE {where} IN ({marks})",
+                ids)
+    cur.execute(f"DELETE FROM main.{src} WHERE {where} IN ({marks})", ids)
+
+
+def _move(conn, t: ColdTable, after_id: int, days: int, limit: int) -> Tuple[int, int]:
+    """One batch: parents + their children. Returns (rows moved, last parent id)."""
+    cur = conn.cursor()
+    cur.execute("BEGIN IMMEDIATE")
+    try:
+        cur.execute(batch_sql(t), {"after": int(after_id), "cutoff": cutoff_modifier(days), "limit": int(limit)})
+        ids = [int(r[0]) for r in cur.fetchall()]
+        if not ids:
+            cur.execute("COMMIT")
+            return 0, after_id
+        moved = 0
+        for c in t.children:
+            _copy(cur, c.table, c.cold, c.column, ids)
+            moved += int(cur.rowcount or 0)
+        _copy(cur, t.table, t.table, "id", ids)
+        moved += int(cur.rowcount or 0)
+        cur.execute("COMMIT")
+        return moved, ids[-1]
+    except Exception:
+        cur.execute("ROLLBACK")
+        raise
+
+
+def counts(conn) -> Dict[str, int]:
+    """Rows per source table (main.x / cold.x) and per _all view."""
+    out = {}
+    for view, sources in VIEWS.items():
+        for src in sources:
+            if src not in out:
+                out[src] = int(conn.execute(f"SELECT COUNT(*) FROM {src}").fetchone()[0])
+        out[view] = int(conn.execute(f"SELECT COUNT(*) FROM temp.{view}").fetchone()[0])
+    return out
+
+
+def verify(conn) -> List[str]:
+    """Problems found (empty = fine): ids in both hot and cold, views that do not add up."""
+    problems = []
+    for name in _cold_tables():
+        both = conn.execute(f"SELECT COUNT(*) FROM main.{name} h JOIN cold.{name} c ON c.id = h.id").fetchone()[0]
+        if both:
+            problems.append(f"{name}: {both} ids in hot and cold")
+    c = counts(conn)
+    for view, sources in VIEWS.items():
+        parts = sum(c[src] for src in sources)
+        if c[view] != parts:
+            problems.append(f"{view}: {c[view]} rows, tables hold {parts}")
+    return problems
+
+
+def archive(db_path, archive_path: Optional[str] = None, days: int = RETENTION_DAYS,
+            batch_size: int = BATCH_SIZE, pause: float = 0.0) -> Dict[str, object]:
+    """
+    Move everything closed and older than `days` days. Returns rows moved
+    per parent table (children included) and the _all view counts before and after, which
+    must be equal.
+    """
+    conn = connect(db_path, archive_path)
+    try:
+        before = {v: n for v, n in counts(conn).items() if v in VIEWS}
+        moved: Dict[str, int] = {}
+        for t in COLD_TABLES:
+            if t.keep:
+                _fill_keep(conn, t)
+            last_id, n = 0, 0
+            while True:
+                m, last_id = _move(conn, t, last_id, days, batch_size)
+                if not m:
+                    break
+                n += m
+                if pause:
+                    time.sleep(pause)
+            moved[t.table] = n
+        after = {v: n for v, n in counts(conn).items() if v in VIEWS}
+    finally:
+        conn.close()
+    return {"moved": moved, "before": before, "after": after}
+
+
+# =========================
+# CLI
+# =========================
+def main():
+    ap = argparse.ArgumentParser(description="Move closed rows older than N days to the attached archive DB")
+    ap.add_argument("--db", default=DEFAULT_DB)
+    ap.add_argument("--archive", default="", help="archive DB (default: <db>_archive.db)")
+    ap.add_argument("--days", type=int, default=RETENTION_DAYS)
+    ap.add_argument("--batch", type=int, default=BATCH_SIZE)
+    ap.add_argument("--pause", type=float, default=0.05, help="seconds between batches")
+    ap.add_argument("--verify", action="store_true", help="only check counts and print them")
+    ap.add_argument("--vacuum", action="store_true", help="VACUUM the hot DB afterwards (locks it)")
+    args = ap.parse_args()
+    archive_db = args.archive or archive_path_for(args.db)
+
+    if args.verify:
+        conn = connect(args.db, archive_db)
+        try:
+            for name, n in counts(conn).items():
+                print(f"{name:34} {n}")
+            problems = verify(conn)
+        finally:
+            conn.close()
+        for p in problems:
+            print("PROBLEM", p)
+        raise SystemExit(1 if problems else 0)
+
+    t0 = time.perf_counter()
+    res = archive(args.db, archive_db, days=args.days, batch_size=args.batch, pause=args.pause)
+    print(" ".join(f"{k}={v}" for k, v in res["moved"].items()) +
+          f" days={args.days} ms={(time.perf_counter() - t0) * 1000.0:.0f} -> {archive_db}")
+    lost = {k: (res["before"][k], res["after"].get(k)) for k in res["before"] if res["before"][k] != res["after"].get(k)}
+    if lost:
+        print("PROBLEM view counts changed (before, after):", lost)
+        raise SystemExit(1)
+    if args.vacuum:
+        conn = sqlite3.connect(args.db, timeout=60, isolation_level=None)
+        conn.execute("VACUUM")
+        conn.close()
+        print("vacuumed", args.db)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+"""
+dbpool.py
+
+One SQLite connection provider for the whole app.
+
+- one connection per (thread, db path), reused across calls
+- WAL + busy_timeout + synchronous=NORMAL on open
+- sqlite3 statement cache (cached_statements) for the repeated USSD queries
+- a connection handed out again with a transaction still open (caller
+  raised before commit/close) is rolled back first, and counted as leaked
+- stats(): connections opened, reuses, leaked transactions, queries run,
+  time spent in SQLite
+
+Callers keep the old pattern:
+    conn = dbpool.connect(DB_PATH)
+    ...
+    conn.commit()
+    conn.close()   # releases (rolls back anything uncommitted), does not close
+"""
+
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict
+
+BUSY_TIMEOUT_MS = int(os.environ.get("ANGELOPP_DB_BUSY_MS", "5000"))
+STATEMENT_CACHE = int(os.environ.get("ANGELOPP_DB_STMT_CACHE", "256"))
+
+_local = threading.local()
+_stats_lock = threading.Lock()
+_stats = {"opened": 0, "reused": 0, "leaked": 0, "queries": 0, "query_seconds": 0.0}
+
+
+def _count(queries: int, seconds: float) -> None:
+    with _stats_lock:
+        _stats["queries"] += queries
+        _stats["query_seconds"] += seconds
+
+
+class PooledCursor(sqlite3.Cursor):
+    def execute(self, sql, parameters=()):
+        t0 = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            _count(1, time.perf_counter() - t0)
+
+    def executemany(self, sql, seq_of_parameters):
+        t0 = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            _count(1, time.perf_counter() - t0)
+
+
+class PooledConnection(sqlite3.Connection):
+    """sqlite3.Connection whose close() hands it back instead of closing it."""
+
+    def cursor(self, factory=PooledCursor):
+        return super().cursor(factory)
+
+    # sqlite3's C Connection.execute() does not call cursor(); route the
+    # shortcuts through PooledCursor so they are counted too.
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def executescript(self, sql_script):
+        return self.cursor().executescript(sql_script)
+
+    def close(self):
+        if self.in_transaction:
+            # Same outcome as closing a connection with uncommitted work.
+            self.rollback()
+
+    def really_close(self):
+        super().close()
+
+
+def _open(db_path: str) -> PooledConnection:
+    conn = sqlite3.connect(
+        db_path,
+        factory=PooledConnection,
+        timeout=BUSY_TIMEOUT_MS / 1000.0,
+        cached_statements=STATEMENT_CACHE,
+    )
+    conn.row_factory = sqlite3.Row
+    try:
+        conn.execute("PRAGMA journal_mode=WAL")
+    except sqlite3.OperationalError:
+        # read-only media / :memory: -- keep the default journal
+        pass
+    conn.execute(f"PRAGMA busy_timeout={int(BUSY_TIMEOUT_MS)}")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    with _stats_lock:
+        _stats["opened"] += 1
+    return conn
+
+
+def connect(db_path) -> PooledConnection:
+    """Return this thread's connection for db_path (opened on first use)."""
+    key = str(db_path)
+    pid = os.getpid()
+    conns: Dict[str, PooledConnection] = getattr(_local, "conns", None)
+    if conns is None or getattr(_local, "pid", None) != pid:
+        # first use in this thread, or we are a freshly forked gunicorn worker
+        conns = _local.conns = {}
+        _local.pid = pid
+
+    conn = conns.get(key)
+    if conn is not None:
+        with _stats_lock:
+            _stats["reused"] += 1
+        if conn.in_transaction:
+            # a previous caller raised between its write and commit()/close():
+            # drop that work instead of letting our commit() publish it
+            conn.rollback()
+            with _stats_lock:
+                _stats["leaked"] += 1
+            print("dbpool: rolled back a transaction left open on", key)
+        # callers may have swapped the row_factory; hand out the agreed default
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    conn = _open(key)
+    conns[key] = conn
+    return conn
+
+
+def close_thread() -> None:
+    """Close this thread's connections (e.g. at the end of a worker thread)."""
+    conns = getattr(_local, "conns", None) or {}
+    for conn in conns.values():
+        try:
+            conn.really_close()
+        except Exception:
+            pass
+    _local.conns = {}
+
+
+def stats() -> Dict[str, float]:
+    with _stats_lock:
+        out = dict(_stats)
+    out["query_ms"] = round(out.pop("query_seconds") * 1000.0, 3)
+    return out
+
+
+def reset_stats() -> None:
+    with _stats_lock:
+        for k in _stats:
+            _stats[k] = 0.0 if k == "query_seconds" else 0
@@ -0,0 +1,176 @@
+"""
+fairness_state.py
+
+In-memory sliding window of assignments per provider (fairness signal).
+
+- rebuilt from the `assignments` table on first use (process start)
+- fed directly by accept_offer() via record()
+- catches up on assignments written by other workers with a cheap
+  `id > last_id` read, at most every SYNC_SECONDS
+- count()/counts() are dict lookups; no disk access on the hot path
+
+The durable record stays the `assignments` table; this is only a view of
+its last WINDOW_HOURS.
+"""
+
+import os
+import threading
+import time
+from collections import deque
+from datetime import datetime, timezone
+from typing import Deque, Dict, Iterable, Optional, Set, Tuple
+
+import dbpool
+
+WINDOW_HOURS = float(os.environ.get("ANGELOPP_FAIRNESS_WINDOW_HOURS", "24"))
+SYNC_SECONDS = float(os.environ.get("ANGELOPP_FAIRNESS_SYNC_SECONDS", "2"))
+
+
+def _parse_ts(s: str) -> float:
+    # assigned_at is datetime('now') text: UTC, "YYYY-MM-DD HH:MM:SS"
+    try:
+        dt = datetime.strptime((s or "")[:19], "%Y-%m-%d %H:%M:%S")
+        return dt.replace(tzinfo=timezone.utc).timestamp()
+    except Exception:
+        return time.time()
+
+
+_REBUILD_SQL = """
+SELECT provider_phone, assigned_at
+FROM assignments
+WHERE assigned_at >= datetime('now', ?) AND id <= ?
+ORDER BY assigned_at, id
+"""
+
+_SYNC_SQL = """
+SELECT id, provider_phone, assigned_at
+FROM assignments
+WHERE id > ?
+ORDER BY id
+"""
+
+class AssignmentWindow:
+    def __init__(self, db_path: str, window_hours: float = WINDOW_HOURS, sync_seconds: float = SYNC_SECONDS):
+        self.db_path = str(db_path)
+        self.window_seconds = float(window_hours) * 3600.0
+        self.sync_seconds = float(sync_seconds)
+
+        self._lock = threading.Lock()
+        self._events: Deque[Tuple[float, str]] = deque()
+        self._counts: Dict[str, int] = {}
+        self._last_id = 0
+        self._local_ids: Set[int] = set()   # recorded here, not yet seen by _sync()
+        self._last_sync = 0.0
+        self._built = False
+
+    # -------------------------
+    # Reads
+    # -------------------------
+    def count(self, phone: str) -> int:
+        with self._lock:
+            self._refresh()
+            return self._counts.get(phone, 0)
+
+    def counts(self, phones: Iterable[str]) -> Dict[str, int]:
+        with self._lock:
+            self._refresh()
+            return {p: self._counts.get(p, 0) for p in phones}
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            self._refresh()
+            return dict(self._counts)
+
+    # -------------------------
+    # Writes
+    # -------------------------
+    def record(self, phone: str, assignment_id: Optional[int] = None, at: Optional[float] = None) -> None:
+        """Feed a fresh assignment (call after the accept transaction committed)."""
+        with self._lock:
+            if not self._built:
+                # rebuild will read this row from the table anyway
+                return
+            if assignment_id is not None:
+                if int(assignment_id) <= self._last_id:
+                    return
+                self._local_ids.add(int(assignment_id))
+            self._add(phone, time.time() if at is None else at)
+
+    def rebuild(self) -> None:
+        with self._lock:
+            self._rebuild()
+
+    # -------------------------
+    # Internals (caller holds the lock)
+    # -------------------------
+    def _add(self, phone: str, ts: float) -> None:
+        self._events.append((ts, phone))
+        self._counts[phone] = self._counts.get(phone, 0) + 1
+
+    def _expire(self, now: float) -> None:
+        cutoff = now - self.window_seconds
+        ev = self._events
+        while ev and ev[0][0] < cutoff:
+            _, phone = ev.popleft()
+            c = self._counts.get(phone, 0) - 1
+            if c > 0:
+                self._counts[phone] = c
+            else:
+                self._counts.pop(phone, None)
+
+    def _refresh(self) -> None:
+        now = time.time()
+        if not self._built:
+            self._rebuild()
+        elif now - self._last_sync >= self.sync_seconds:
+            self._sync()
+        self._expire(now)
+
+    def _rebuild(self) -> None:
+        conn = dbpool.connect(self.db_path)
+        cur = conn.cursor()
+        cur.execute("SELECT COALESCE(MAX(id), 0) FROM assignments")
+        last_id = int(cur.fetchone()[0] or 0)
+        cur.execute(_REBUILD_SQL, (f"-{int(self.window_seconds)} seconds", last_id))
+        rows = cur.fetchall()
+        conn.close()
+
+        self._events.clear()
+        self._counts.clear()
+        self._local_ids.clear()
+        for r in rows:
+            self._add(r[0], _parse_ts(r[1]))
+        self._last_id = last_id
+        self._last_sync = time.time()
+        self._built = True
+
+    def _sync(self) -> None:
+        # Assignments committed by other gunicorn workers / CLIs
+        conn = dbpool.connect(self.db_path)
+        cur = conn.cursor()
+        cur.execute(_SYNC_SQL, (self._last_id,))
+        rows = cur.fetchall()
+        conn.close()
+
+        for r in rows:
+            aid = int(r[0])
+            if aid in self._local_ids:
+                self._local_ids.discard(aid)
+            else:
+                self._add(r[1], _parse_ts(r[2]))
+            self._last_id = max(self._last_id, aid)
+        self._last_sync = time.time()
+
+
+_WINDOWS: Dict[str, AssignmentWindow] = {}
+_WINDOWS_LOCK = threading.Lock()
+
+def get_window(db_path) -> AssignmentWindow:
+    key = str(db_path)
+    w = _WINDOWS.get(key)
+    if w is None:
+        with _WINDOWS_LOCK:
+            w = _WINDOWS.get(key)
+            if w is None:
+                w = _WINDOWS[key] = AssignmentWindow(key)
+    return w
@@ -1,10 +1,12 @@
 import sqlite3
 from datetime import datetime, timedelta, timezone
 
+import dbpool
+
 DB = "/opt/ussd/market.db"
 
 def _conn():
-    return sqlite3.connect(DB)
+    return dbpool.connect(DB)
 
 def ensure_schema():
     conn = _conn()
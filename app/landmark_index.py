@@ -0,0 +1,321 @@
+#!/usr/bin/env python3
+"""
+landmark_index.py
+
+Normalized landmark catalog per village, so typed landmarks resolve to
+one canonical id: "Market gate", "market-gate", "Mkt Gate" -> same id.
+
+- built from the `landmarks` table (+ `landmark_aliases`, migrations.py v5)
+- rows with the same normalized name collapse to the lowest id (canonical)
+- resolve order: exact/alias -> unique prefix -> trigram similarity
+- in-memory per process; rebuilt when MAX(id) of the village changes
+  (checked at most every REFRESH_SECONDS) or after invalidate()
+
+ETA (angelopp_core.estimate_eta_minutes) and ranking compare ids, not raw
+strings.
+
+CLI:
+    python landmark_index.py --db /opt/angelopp/data/bumala.db --village Bumala --list
+    python landmark_index.py --db ... --village Bumala --resolve "mkt gate"
+    python landmark_index.py --db ... --village Bumala --alias "sokoni" --to 12
+    python landmark_index.py --db ... --village Bumala --bench 10000
+"""
+
+import argparse
+import bisect
+import os
+import re
+import threading
+import time
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+import dbpool
+
+DEFAULT_DB = os.environ.get("ANGELOPP_DB", "/opt/angelopp/data/bumala.db")
+REFRESH_SECONDS = float(os.environ.get("ANGELOPP_LANDMARK_REFRESH_SECONDS", "2"))
+FUZZY_MIN = 0.55        # dice coefficient over trigrams
+PREFIX_MIN_LEN = 3
+
+# Common shorthand on feature phones (token level, after lowercasing)
+ABBREVIATIONS = {
+    "mkt": "market", "mkts": "market", "soko": "market",
+    "stn": "station", "stg": "stage",
+    "sch": "school", "schl": "school", "pri": "primary", "sec": "secondary",
+    "hosp": "hospital", "hsp": "hospital", "disp": "dispensary",
+    "ch": "church", "chrch": "church",
+    "rd": "road", "jn": "junction", "jnc": "junction", "jct": "junction", "jnct": "junction",
+    "govt": "government", "hq": "headquarters", "po": "post office",
+}
+STOPWORDS = {"the", "at", "near", "nr"}
+
+_APOSTROPHES = re.compile(r"['\u2019`]")
+_NON_ALNUM = re.compile(r"[^a-z0-9]+")
+
+
+def normalize(text: Optional[str]) -> str:
+    """'Mkt-Gate ' -> 'market gate', "St. Mary's" -> 'st marys'"""
+    tokens = []
+    for tok in _NON_ALNUM.sub(" ", _APOSTROPHES.sub("", (text or "").lower())).split():
+        if tok in STOPWORDS:
+            continue
+        tokens.append(ABBREVIATIONS.get(tok, tok))
+    return " ".join(tokens)
+
+
+def _trigrams(norm: str) -> set:
+    s = f"  {norm} "
+    return {s[i:i + 3] for i in range(len(s) - 2)}
+
+
+class Resolved(NamedTuple):
+    id: Optional[int]       # canonical landmark id, None if not in the catalog
+    name: str               # canonical display name (or the cleaned input)
+    norm: str               # normalized form used for comparisons
+
+    def same_place(self, other: "Resolved") -> bool:
+        if not self.norm or not other.norm:
+            return False
+        if self.id is not None and other.id is not None:
+            return self.id == other.id
+        return self.norm == other.norm
+
+
+class VillageIndex:
+    def __init__(self, rows: List[Tuple[int, str]], aliases: List[Tuple[str, int]], max_ids: Tuple):
+        self.max_ids = max_ids
+        self.names: Dict[int, str] = {}         # canonical id -> display name
+        self.norms: Dict[int, str] = {}         # canonical id -> normalized name
+        self.keys: Dict[str, int] = {}          # normalized name/alias -> canonical id
+        self.canonical: Dict[int, int] = {}     # any landmarks.id -> canonical id
+        canonical_of = self.canonical
+
+        for lid, name in rows:                  # ordered by id: first one wins
+            n = normalize(name)
+            if not n:
+                continue
+            cid = self.keys.get(n)
+            if cid is None:
+                cid = self.keys[n] = int(lid)
+                self.names[cid] = (name or "").strip()
+                self.norms[cid] = n
+            canonical_of[int(lid)] = cid
+
+        for alias, lid in aliases:
+            n = normalize(alias)
+            cid = canonical_of.get(int(lid))
+            if n and cid is not None:
+                self.keys.setdefault(n, cid)
+
+        self._sorted = sorted(self.keys)
+        self._grams: Dict[str, List[str]] = {}
+        self._gram_n: Dict[str, int] = {}
+        for key in self._sorted:
+            grams = _trigrams(key)
+            self._gram_n[key] = len(grams)
+            for g in grams:
+                self._grams.setdefault(g, []).append(key)
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def resolve(self, text: Optional[str]) -> Optional[int]:
+        return self.resolve_norm(normalize(text))
+
+    def resolve_norm(self, n: str) -> Optional[int]:
+        if not n:
+            return None
+        cid = self.keys.get(n)
+        if cid is not None:
+            return cid
+
+        # "market g" -> "market gate"; a prefix of several places stays unresolved
+        if len(n) >= PREFIX_MIN_LEN:
+            found = set()
+            i = bisect.bisect_left(self._sorted, n)
+            while i < len(self._sorted) and self._sorted[i].startswith(n):
+                found.add(self.keys[self._sorted[i]])
+                if len(found) > 1:
+                    break
+                i += 1
+            if len(found) == 1:
+                return found.pop()
+            if found:
+                return None
+
+        # typos / word order: best trigram overlap
+        grams = _trigrams(n)
+        shared: Dict[str, int] = {}
+        for g in grams:
+            for key in self._grams.get(g, ()):
+                shared[key] = shared.get(key, 0) + 1
+        best, best_score = None, 0.0
+        for key, k in shared.items():
+            score = 2.0 * k / (len(grams) + self._gram_n[key])
+            if score > best_score or (score == best_score and best is not None and self.keys[key] < self.keys[best]):
+                best, best_score = key, score
+        if best is not None and best_score >= FUZZY_MIN:
+            return self.keys[best]
+        return None
+
+
+class LandmarkIndex:
+    def __init__(self, db_path: str, refresh_seconds: float = REFRESH_SECONDS):
+        self.db_path = str(db_path)
+        self.refresh_seconds = float(refresh_seconds)
+        self._lock = threading.Lock()
+        self._villages: Dict[str, VillageIndex] = {}
+        self._checked: Dict[str, float] = {}
+
+    # -------------------------
+    # Reads
+    # -------------------------
+    def village(self, village: str) -> Optional[VillageIndex]:
+        v = (village or "").strip()
+        if not v:
+            return None
+        now = time.time()
+        with self._lock:
+            vi = self._villages.get(v)
+            if vi is not None and now - self._checked.get(v, 0.0) < self.refresh_seconds:
+                return vi
+        try:
+            conn = dbpool.connect(self.db_path)
+            try:
+                max_ids = tuple(conn.execute(
+                    "SELECT (SELECT MAX(id) FROM landmarks WHERE village=?), "
+                    "(SELECT MAX(id) FROM landmark_aliases WHERE village=?)",
+                    (v, v)
+                ).fetchone())
+                if vi is None or vi.max_ids != max_ids:
+                    rows = conn.execute(
+                        "SELECT id, name FROM landmarks WHERE village=? AND name != '' ORDER BY id", (v,)
+                    ).fetchall()
+                    aliases = conn.execute(
+                        "SELECT alias, landmark_id FROM landmark_aliases WHERE village=? ORDER BY id", (v,)
+                    ).fetchall()
+                    vi = VillageIndex([(r[0], r[1]) for r in rows], [(a[0], a[1]) for a in aliases], max_ids)
+            finally:
+                conn.close()
+        except Exception as e:
+            print("landmark_index refresh failed:", e)
+            return vi
+        with self._lock:
+            self._villages[v] = vi
+            self._checked[v] = now
+        return vi
+
+    def lookup(self, village: Optional[str], text: Optional[str]) -> Resolved:
+        n = normalize(text)
+        cleaned = (text or "").strip()
+        if not n:
+            return Resolved(None, cleaned, "")
+        vi = self.village(village or "")
+        cid = vi.resolve_norm(n) if vi is not None else None
+        if cid is None:
+            return Resolved(None, cleaned, n)
+        return Resolved(cid, vi.names[cid], vi.norms[cid])
+
+    def resolve(self, village: Optional[str], text: Optional[str]) -> Optional[int]:
+        return self.lookup(village, text).id
+
+    def invalidate(self, village: Optional[str] = None) -> None:
+        with self._lock:
+            if village is None:
+                self._checked.clear()
+            else:
+                self._checked.pop((village or "").strip(), None)
+
+
+_INDEXES: Dict[str, LandmarkIndex] = {}
+_INDEXES_LOCK = threading.Lock()
+
+def get_index(db_path) -> LandmarkIndex:
+    key = str(db_path)
+    ix = _INDEXES.get(key)
+    if ix is None:
+        with _INDEXES_LOCK:
+            ix = _INDEXES.get(key)
+            if ix is None:
+                ix = _INDEXES[key] = LandmarkIndex(key)
+    return ix
+
+
+def lookup(db_path, village: Optional[str], text: Optional[str]) -> Resolved:
+    return get_index(db_path).lookup(village, text)
+
+
+def invalidate(db_path, village: Optional[str] = None) -> None:
+    get_index(db_path).invalidate(village)
+
+
+def add_alias(db_path, village: str, alias: str, landmark_id: int) -> bool:
+    """Map `alias` to landmark_id in this village; False if the alias already exists."""
+    n = normalize(alias)
+    if not n:
+        return False
+    conn = dbpool.connect(db_path)
+    try:
+        cur = conn.execute(
+            "INSERT INTO landmark_aliases(village, alias, landmark_id) VALUES (?,?,?) "
+            "ON CONFLICT(village, alias) DO NOTHING",
+            ((village or "").strip(), n, int(landmark_id))
+        )
+        conn.commit()
+        added = cur.rowcount > 0
+    finally:
+        conn.close()
+    invalidate(db_path, village)
+    return added
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Landmark catalog: list / resolve / alias")
+    ap.add_argument("--db", default=DEFAULT_DB)
+    ap.add_argument("--village", required=True)
+    ap.add_argument("--list", action="store_true", help="canonical landmarks and their keys")
+    ap.add_argument("--resolve", metavar="TEXT")
+    ap.add_argument("--alias", metavar="TEXT")
+    ap.add_argument("--to", type=int, metavar="LANDMARK_ID")
+    ap.add_argument("--bench", type=int, default=0, metavar="N", help="time N resolves of every key")
+    args = ap.parse_args()
+
+    import migrations
+    migrations.ensure_current(args.db)
+    ix = get_index(args.db)
+
+    if args.alias:
+        if args.to is None:
+            ap.error("--alias needs --to LANDMARK_ID")
+        ok = add_alias(args.db, args.village, args.alias, args.to)
+        print(f"alias '{normalize(args.alias)}' -> {args.to}: {'added' if ok else 'already exists'}")
+
+    vi = ix.village(args.village)
+    if vi is None:
+        print("no index")
+        return
+
+    if args.list:
+        by_id: Dict[int, List[str]] = {}
+        for key, cid in vi.keys.items():
+            by_id.setdefault(cid, []).append(key)
+        for cid in sorted(vi.names):
+            print(f"{cid:>6}  {vi.names[cid]:<28} {', '.join(sorted(by_id.get(cid, [])))}")
+        print(f"{len(vi)} landmarks, {len(vi.keys)} keys")
+
+    if args.resolve is not None:
+        r = ix.lookup(args.village, args.resolve)
+        print(f"'{args.resolve}' -> id={r.id} name='{r.name}' norm='{r.norm}'")
+
+    if args.bench:
+        probes = [k[:-1] if i % 3 == 1 else k for i, k in enumerate(vi.keys)] or ["market gate"]
+        t0 = time.perf_counter()
+        n = 0
+        while n < args.bench:
+            for p in probes:
+                ix.lookup(args.village, p)
+                n += 1
+        dt = time.perf_counter() - t0
+        print(f"{n} lookups in {dt * 1000:.1f} ms ({dt / n * 1e6:.1f} us/lookup)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,641 @@
+#!/usr/bin/env python3
+"""
+migrations.py
+
+Versioned schema for bumala.db.
+
+- `schema_version` records which migrations ran
+- MIGRATIONS is the ordered list; append new steps, never edit old ones
+- ensure_current(db_path) migrates once per process, then is a set lookup
+
+Run at process start (app.py does) or from the CLI:
+    python migrations.py --db /opt/angelopp/data/bumala.db
+    python migrations.py --db /opt/angelopp/data/bumala.db --status
+"""
+
+import argparse
+import os
+import sqlite3
+import threading
+from typing import Callable, List, Tuple
+
+DEFAULT_DB = os.environ.get("ANGELOPP_DB", "/opt/angelopp/data/bumala.db")
+
+DEFAULT_SERVICES = [
+    ("Rider (Boda/Tuktuk)", "rider"),
+    ("Food / Restaurants", "business"),
+    ("Shop / Duka", "business"),
+    ("Plumber", "business"),
+    ("Carpenter", "business"),
+    ("Electrician", "business"),
+]
+
+
+# -------------------------
+# Helpers
+# -------------------------
+def _columns(cur: sqlite3.Cursor, table: str) -> List[str]:
+    cur.execute(f"PRAGMA table_info({table})")
+    return [r[1] for r in cur.fetchall()]
+
+def _add_column(cur: sqlite3.Cursor, table: str, column: str, decl: str) -> None:
+    # Older DBs were created by whichever module ran first; only add what is missing.
+    if column not in _columns(cur, table):
+        cur.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+
+
+# =========================
+# Migrations
+# =========================
+def _m001_baseline(cur: sqlite3.Cursor) -> None:
+    """
+    Everything the old per-request ensure_* helpers created
+    (angelopp_core, ussd, onboarding), merged into one shape.
+    """
+    # --- Directory (legacy) ---
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS riders (
+        phone TEXT PRIMARY KEY,
+        name TEXT NOT NULL,
+        village TEXT NOT NULL DEFAULT 'Bumala',
+        rider_type TEXT NOT NULL DEFAULT 'Rider',
+        sacco TEXT DEFAULT '',
+        location TEXT DEFAULT '',
+        created_at TEXT DEFAULT (datetime('now')),
+        updated_at TEXT DEFAULT (datetime('now'))
+    )
+    """)
+
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS customers (
+        phone TEXT PRIMARY KEY,
+        name TEXT DEFAULT '',
+        village TEXT DEFAULT '',
+        created_at TEXT DEFAULT (datetime('now')),
+        updated_at TEXT DEFAULT (datetime('now'))
+    )
+    """)
+
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS businesses (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        owner_phone TEXT NOT NULL,
+        name TEXT NOT NULL,
+        category TEXT NOT NULL,
+        village TEXT NOT NULL DEFAULT 'Bumala',
+        location TEXT DEFAULT '',
+        created_at TEXT DEFAULT (datetime('now')),
+        updated_at TEXT DEFAULT (datetime('now'))
+    )
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_businesses_village ON businesses(village)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_businesses_category ON businesses(category)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_businesses_owner ON businesses(owner_phone)")
+
+    # --- Roles + prefs ---
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS user_roles (
+        phone TEXT PRIMARY KEY,
+        role TEXT NOT NULL,
+        updated_at TEXT NOT NULL DEFAULT (datetime('now'))
+    )
+    """)
+    # app.py's cockpit creates user_roles with primary_role/sub_role instead
+    _add_column(cur, "user_roles", "role", "TEXT")
+
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS user_prefs (
+        phone TEXT PRIMARY KEY,
+        role TEXT,                 -- 'customer' or 'provider'
+        area_type TEXT,            -- 'village' | 'town' | 'airport'
+        landmark TEXT,
+        village TEXT NOT NULL DEFAULT 'Church',
+        created_at TEXT NOT NULL DEFAULT (datetime('now')),
+        updated_at TEXT NOT NULL DEFAULT (datetime('now'))
+    )
+    """)
+    _add_column(cur, "user_prefs", "area_type", "TEXT")
+    _add_column(cur, "user_prefs", "landmark", "TEXT")
+    _add_column(cur, "user_prefs", "village", "TEXT NOT NULL DEFAULT 'Church'")
+    cur.execute("""
+    CREATE TRIGGER IF NOT EXISTS user_prefs_updated
+    AFTER UPDATE ON user_prefs
+    FOR EACH ROW
+    BEGIN
+        UPDATE user_prefs SET updated_at = datetime('now') WHERE phone = OLD.phone;
+    END
+    """)
+
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS customer_prefs (
+        phone TEXT PRIMARY KEY,
+        village TEXT NOT NULL DEFAULT 'Bumala',
+        landmark TEXT NOT NULL DEFAULT '',
+        updated_at TEXT NOT NULL DEFAULT (datetime('now'))
+    )
+    """)
+
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS traveler_prefs (
+        phone TEXT PRIMARY KEY,
+        nairobi_region TEXT DEFAULT '1',
+        updated_at TEXT DEFAULT (datetime('now'))
+    )
+    """)
+
+    # --- Providers + services ---
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS providers (
+        phone TEXT PRIMARY KEY,
+        provider_type TEXT NOT NULL, -- 'rider' or 'business'
+        name TEXT NOT NULL,
+        village TEXT NOT NULL DEFAULT 'Bumala',
+        sacco TEXT DEFAULT '',
+        current_landmark TEXT DEFAULT '',
+        is_available INTEGER NOT NULL DEFAULT 1,
+        created_at TEXT NOT NULL DEFAULT (datetime('now')),
+        updated_at TEXT NOT NULL DEFAULT (datetime('now'))
+    )
+    """)
+    _add_column(cur, "providers", "is_available", "INTEGER NOT NULL DEFAULT 1")
+
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS services (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT NOT NULL UNIQUE,
+        kind TEXT NOT NULL DEFAULT 'any' -- 'rider','business','any'
+    )
+    """)
+
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS provider_services (
+        phone TEXT NOT NULL,
+        service_id INTEGER NOT NULL,
+        active INTEGER NOT NULL DEFAULT 1,
+        PRIMARY KEY (phone, service_id),
+        FOREIGN KEY (phone) REFERENCES providers(phone),
+        FOREIGN KEY (service_id) REFERENCES services(id)
+    )
+    """)
+
+    cur.execute("SELECT COUNT(*) FROM services")
+    if int(cur.fetchone()[0]) == 0:
+        for name, kind in DEFAULT_SERVICES:
+            cur.execute("INSERT OR IGNORE INTO services(name, kind) VALUES (?,?)", (name, kind))
+
+    # --- Landmarks (community map) ---
+    # angelopp_core writes added_by/description, ussd writes phone/description.
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS landmarks (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        village TEXT NOT NULL DEFAULT 'Bumala',
+        name TEXT NOT NULL,
+        description TEXT NOT NULL DEFAULT '',
+        added_by TEXT NOT NULL DEFAULT '',
+        phone TEXT NOT NULL DEFAULT '',
+        created_at TEXT NOT NULL DEFAULT (datetime('now'))
+    )
+    """)
+    _add_column(cur, "landmarks", "description", "TEXT NOT NULL DEFAULT ''")
+    _add_column(cur, "landmarks", "added_by", "TEXT NOT NULL DEFAULT ''")
+    _add_column(cur, "landmarks", "phone", "TEXT NOT NULL DEFAULT ''")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_landmarks_village ON landmarks(village)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_landmarks_added_by ON landmarks(added_by)")
+
+    # --- Requests, offers, assignments ---
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS service_requests (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        customer_phone TEXT NOT NULL,
+        service_id INTEGER NOT NULL,
+        village TEXT NOT NULL DEFAULT 'Bumala',
+        landmark TEXT NOT NULL DEFAULT '',
+        note TEXT NOT NULL DEFAULT '',
+        status TEXT NOT NULL DEFAULT 'NEW', -- NEW/OFFERED/ACCEPTED/CLOSED
+        created_at TEXT NOT NULL DEFAULT (datetime('now'))
+    )
+    """)
+
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS request_offers (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        request_id INTEGER NOT NULL,
+        provider_phone TEXT NOT NULL,
+        score REAL NOT NULL DEFAULT 0,
+        eta_minutes INTEGER NOT NULL DEFAULT 999,
+        status TEXT NOT NULL DEFAULT 'OFFERED', -- OFFERED/ACCEPTED/PASSED
+        created_at TEXT NOT NULL DEFAULT (datetime('now')),
+        UNIQUE(request_id, provider_phone)
+    )
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_offers_provider ON request_offers(provider_phone, status)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_offers_request ON request_offers(request_id, status)")
+
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS assignments (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        request_id INTEGER NOT NULL UNIQUE,
+        provider_phone TEXT NOT NULL,
+        assigned_at TEXT NOT NULL DEFAULT (datetime('now'))
+    )
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_assignments_provider_time ON assignments(provider_phone, assigned_at)")
+
+    # --- Deliveries ---
+    # column order matters: ussd.handle_provider_delivery_inbox reads rows by index
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS delivery_requests (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        source_type TEXT NOT NULL DEFAULT 'customer',
+        source_phone TEXT NOT NULL DEFAULT '',
+        pickup_village TEXT NOT NULL DEFAULT '',
+        pickup_landmark TEXT NOT NULL DEFAULT '',
+        dropoff_village TEXT NOT NULL DEFAULT '',
+        dropoff_landmark TEXT NOT NULL DEFAULT '',
+        note TEXT NOT NULL DEFAULT '',
+        status TEXT NOT NULL DEFAULT 'new',
+        assigned_rider_phone TEXT NOT NULL DEFAULT '',
+        created_at TEXT NOT NULL DEFAULT (datetime('now')),
+        updated_at TEXT NOT NULL DEFAULT (datetime('now'))
+    )
+    """)
+
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS callback_requests (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        session_id TEXT NOT NULL,
+        customer_phone TEXT NOT NULL,
+        target_phone TEXT NOT NULL,
+        target_kind TEXT NOT NULL,  -- 'rider' or 'business'
+        village TEXT NOT NULL,
+        status TEXT NOT NULL DEFAULT 'NEW',
+        created_at TEXT DEFAULT (datetime('now'))
+    )
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_callbacks_status ON callback_requests(status)")
+
+    # --- Channels + messages ---
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS channels (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        owner_phone TEXT NOT NULL,
+        name TEXT NOT NULL,
+        category TEXT NOT NULL DEFAULT 'Community',
+        is_active INTEGER NOT NULL DEFAULT 1,
+        created_at TEXT NOT NULL DEFAULT (datetime('now'))
+    )
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_channels_owner ON channels(owner_phone)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_channels_category ON channels(category)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_channels_owner_active ON channels(owner_phone, is_active)")
+
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS channel_messages (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        channel_id INTEGER NOT NULL,
+        text TEXT NOT NULL,
+        created_at TEXT NOT NULL DEFAULT (datetime('now')),
+        FOREIGN KEY(channel_id) REFERENCES channels(id)
+    )
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_channel_messages_channel ON channel_messages(channel_id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_channel_messages_created ON channel_messages(created_at)")
+
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS messages (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        channel_id INTEGER NOT NULL,
+        category TEXT NOT NULL DEFAULT '',
+        author_phone TEXT NOT NULL DEFAULT '',
+        text TEXT NOT NULL DEFAULT '',
+        created_at TEXT NOT NULL DEFAULT (datetime('now'))
+    )
+    """)
+    _add_column(cur, "messages", "text", "TEXT NOT NULL DEFAULT ''")
+    _add_column(cur, "messages", "category", "TEXT NOT NULL DEFAULT ''")
+
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS sacco_issues (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        phone TEXT NOT NULL,
+        issue TEXT NOT NULL,
+        created_at TEXT NOT NULL DEFAULT (datetime('now'))
+    )
+    """)
+
+    # --- Points / challenge ---
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS points (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        phone TEXT NOT NULL,
+        reason TEXT NOT NULL,
+        pts INTEGER NOT NULL,
+        created_at TEXT DEFAULT (datetime('now'))
+    )
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_points_phone ON points(phone)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_points_created_at ON points(created_at)")
+
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS daily_claims (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        phone TEXT NOT NULL,
+        claim_date TEXT NOT NULL,
+        created_at TEXT NOT NULL DEFAULT (datetime('now')),
+        UNIQUE(phone, claim_date)
+    )
+    """)
+
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS points_ledger (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        phone TEXT NOT NULL,
+        pts INTEGER NOT NULL,
+        reason TEXT NOT NULL,
+        amount INTEGER NOT NULL DEFAULT 0,
+        meta TEXT NOT NULL DEFAULT '',
+        created_at TEXT NOT NULL DEFAULT (datetime('now'))
+    )
+    """)
+    # award_points() writes amount/meta as well
+    _add_column(cur, "points_ledger", "amount", "INTEGER NOT NULL DEFAULT 0")
+    _add_column(cur, "points_ledger", "meta", "TEXT NOT NULL DEFAULT ''")
+
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS points_balance (
+        phone TEXT PRIMARY KEY,
+        balance INTEGER NOT NULL DEFAULT 0,
+        updated_at TEXT NOT NULL DEFAULT (datetime('now'))
+    )
+    """)
+
+
+def _m002_outixs_outbox(cur: sqlite3.Cursor) -> None:
+    # Anchors waiting to be sent to Outixs (drained by outixs_outbox.py)
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS outixs_outbox (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        internal_id TEXT NOT NULL UNIQUE,
+        request_id INTEGER,
+        rider_phone TEXT,
+        transition_type TEXT NOT NULL,
+        payload TEXT NOT NULL,
+        status TEXT NOT NULL DEFAULT 'PENDING',      -- PENDING / DONE / DEAD
+        attempts INTEGER NOT NULL DEFAULT 0,
+        next_attempt_at TEXT NOT NULL DEFAULT (datetime('now')),
+        last_error TEXT,
+        created_at TEXT NOT NULL DEFAULT (datetime('now')),
+        sent_at TEXT
+    )
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_outixs_outbox_due ON outixs_outbox(status, next_attempt_at)")
+
+
+def _m003_outixs_anchors(cur: sqlite3.Cursor) -> None:
+    # Early deployments wrote outixs_anchors with NOT NULL block hash/height
+    # columns; keep that data aside and start the clean table.
+    cur.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='outixs_anchors'")
+    if cur.fetchone():
+        cols = _columns(cur, "outixs_anchors")
+        if "outixs_block_hash" in cols and "outixs_height" in cols and "anchored_ok" not in cols:
+            cur.execute("ALTER TABLE outixs_anchors RENAME TO outixs_anchors_legacy")
+
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS outixs_anchors (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        request_id INTEGER,
+        internal_id TEXT NOT NULL UNIQUE,
+        rider_phone TEXT,
+        transition_type TEXT,
+        anchored_ok INTEGER NOT NULL DEFAULT 0,
+        anchored_at TEXT NOT NULL DEFAULT (datetime('now'))
+    )
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_outixs_anchors_request ON outixs_anchors(request_id)")
+
+
+def _m004_user_prefs_no_trigger(cur: sqlite3.Cursor) -> None:
+    # Writers set updated_at themselves (onboarding.update_prefs); the
+    # trigger re-updated the row after every write.
+    cur.execute("DROP TRIGGER IF EXISTS user_prefs_updated")
+
+
+def _m005_landmark_aliases(cur: sqlite3.Cursor) -> None:
+    # Extra spellings for a landmark (landmark_index.py); alias is stored normalized.
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS landmark_aliases (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        village TEXT NOT NULL,
+        alias TEXT NOT NULL,
+        landmark_id INTEGER NOT NULL,
+        created_at TEXT NOT NULL DEFAULT (datetime('now')),
+        UNIQUE(village, alias)
+    )
+    """)
+
+
+def _m006_travel_times(cur: sqlite3.Cursor) -> None:
+    # Inputs for travel_matrix.py: where the provider was at accept time and
+    # when the job was closed.
+    _add_column(cur, "assignments", "from_landmark", "TEXT")
+    _add_column(cur, "service_requests", "closed_at", "TEXT")
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS travel_times (
+        village TEXT NOT NULL,
+        from_id INTEGER NOT NULL,            -- canonical landmarks.id
+        to_id INTEGER NOT NULL,
+        source TEXT NOT NULL,                -- 'sacco' | 'learned'
+        minutes REAL NOT NULL,
+        samples INTEGER NOT NULL DEFAULT 0,
+        updated_at TEXT NOT NULL DEFAULT (datetime('now')),
+        PRIMARY KEY (village, from_id, to_id, source)
+    )
+    """)
+
+
+def _m007_providers_updated_index(cur: sqlite3.Cursor) -> None:
+    # provider_roster.py catches up with `updated_at >= ?`
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_providers_updated ON providers(updated_at)")
+
+
+def _m008_provider_changes(cur: sqlite3.Cursor) -> None:
+    # Change feed for provider_roster.py caches (row per provider write)
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS provider_changes (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        phone TEXT NOT NULL,
+        kind TEXT NOT NULL,                  -- profile / landmark / availability / service / delete
+        changed_at TEXT NOT NULL DEFAULT (datetime('now'))
+    )
+    """)
+
+
+def _m009_hot_query_indexes(cur: sqlite3.Cursor) -> None:
+    # One index per hot query that still searched or sorted a whole table;
+    # query_plans.py keeps the list and fails on any new SCAN.
+    # pending offers: + created_at for the ORDER BY (replaces the 2-column index)
+    cur.execute("DROP INDEX IF EXISTS idx_offers_provider")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_offers_provider_created ON request_offers(provider_phone, status, created_at)")
+    # customer "Local requests"
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_requests_customer ON service_requests(customer_phone, created_at)")
+    # trust history / fairness window rebuild (time range over all providers)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_assignments_time ON assignments(assigned_at)")
+    # dashboard panels: latest riders / businesses (the roster reads providers by feed, not updated_at)
+    cur.execute("DROP INDEX IF EXISTS idx_providers_updated")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_providers_type_updated ON providers(provider_type, updated_at)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_providers_type_created ON providers(provider_type, created_at)")
+    # rider delivery inbox + open deliveries
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_deliveries_rider ON delivery_requests(assigned_rider_phone, status)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_deliveries_status ON delivery_requests(status)")
+    # landmark game: "already added one today?"
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_landmarks_phone ON landmarks(phone, created_at)")
+
+
+def _m010_offer_rounds(cur: sqlite3.Cursor) -> None:
+    # offer_scheduler.py: when to look at a request again, and how many
+    # re-offer rounds it already had. NULL reoffer_at = not scheduled.
+    # New status value EXPIRED for request_offers and service_requests.
+    _add_column(cur, "service_requests", "reoffer_at", "TEXT")
+    _add_column(cur, "service_requests", "offer_rounds", "INTEGER NOT NULL DEFAULT 0")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_requests_reoffer ON service_requests(status, reoffer_at)")
+
+
+def _m011_offer_archive(cur: sqlite3.Cursor) -> None:
+    # Provider inbox reads only this index (covering: id is the rowid);
+    # replaces the v9 index with the same prefix.
+    cur.execute("DROP INDEX IF EXISTS idx_offers_provider_created")
+    cur.execute("""
+    CREATE INDEX IF NOT EXISTS idx_offers_inbox
+    ON request_offers(provider_phone, status, created_at, request_id, eta_minutes)
+    """)
+    # Closed offers older than the retention window (offer_archive.py).
+    # Same columns and ids as request_offers; reports use request_offers_all.
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS request_offers_archive (
+        id INTEGER PRIMARY KEY,
+        request_id INTEGER NOT NULL,
+        provider_phone TEXT NOT NULL,
+        score REAL NOT NULL DEFAULT 0,
+        eta_minutes INTEGER NOT NULL DEFAULT 999,
+        status TEXT NOT NULL,
+        created_at TEXT NOT NULL,
+        archived_at TEXT NOT NULL DEFAULT (datetime('now'))
+    )
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_offers_archive_request ON request_offers_archive(request_id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_offers_archive_provider ON request_offers_archive(provider_phone, created_at)")
+    cur.execute("""
+    CREATE VIEW IF NOT EXISTS request_offers_all AS
+    SELECT id, request_id, provider_phone, score, eta_minutes, status, created_at FROM request_offers
+    UNION ALL
+    SELECT id, request_id, provider_phone, score, eta_minutes, status, created_at FROM request_offers_archive
+    """)
+
+
+Migration = Tuple[int, str, Callable[[sqlite3.Cursor], None]]
+
+MIGRATIONS: List[Migration] = [
+    (1, "baseline", _m001_baseline),
+    (2, "outixs_outbox", _m002_outixs_outbox),
+    (3, "outixs_anchors", _m003_outixs_anchors),
+    (4, "user_prefs_no_trigger", _m004_user_prefs_no_trigger),
+    (5, "landmark_aliases", _m005_landmark_aliases),
+    (6, "travel_times", _m006_travel_times),
+    (7, "providers_updated_index", _m007_providers_updated_index),
+    (8, "provider_changes", _m008_provider_changes),
+    (9, "hot_query_indexes", _m009_hot_query_indexes),
+    (10, "offer_rounds", _m010_offer_rounds),
+    (11, "offer_archive", _m011_offer_archive),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+# =========================
+# Runner
+# =========================
+def _ensure_version_table(cur: sqlite3.Cursor) -> None:
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS schema_version (
+        version INTEGER PRIMARY KEY,
+        name TEXT NOT NULL,
+        applied_at TEXT NOT NULL DEFAULT (datetime('now'))
+    )
+    """)
+
+def current_version(conn: sqlite3.Connection) -> int:
+    cur = conn.cursor()
+    cur.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='schema_version'")
+    if not cur.fetchone():
+        return 0
+    cur.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version")
+    return int(cur.fetchone()[0] or 0)
+
+def migrate(db_path: str) -> List[int]:
+    """Apply pending migrations. Returns the versions applied (may be empty)."""
+    conn = sqlite3.connect(str(db_path), timeout=30, isolation_level=None)
+    try:
+        if current_version(conn) >= LATEST_VERSION:
+            return []
+
+        cur = conn.cursor()
+        # One writer at a time: other workers wait here, then see the new version.
+        cur.execute("BEGIN IMMEDIATE")
+        try:
+            _ensure_version_table(cur)
+            have = current_version(conn)
+            applied = []
+            for version, name, fn in MIGRATIONS:
+                if version <= have:
+                    continue
+                fn(cur)
+                cur.execute("INSERT INTO schema_version(version, name) VALUES (?, ?)", (version, name))
+                applied.append(version)
+            cur.execute("COMMIT")
+            return applied
+        except Exception:
+            cur.execute("ROLLBACK")
+            raise
+    finally:
+        conn.close()
+
+
+_CURRENT = set()
+_LOCK = threading.Lock()
+
+def ensure_current(db_path) -> None:
+    """
+    Fast path for request handling: after the first successful call
+    for a db_path this is a set lookup (no DDL, no PRAGMA, no connection).
+    """
+    key = str(db_path)
+    if key in _CURRENT:
+        return
+    with _LOCK:
+        if key in _CURRENT:
+            return
+        migrate(key)
+        _CURRENT.add(key)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Apply Angelopp schema migrations")
+    ap.add_argument("--db", default=DEFAULT_DB)
+    ap.add_argument("--status", action="store_true", help="only print current/latest version")
+    args = ap.parse_args()
+
+    if args.status:
+        conn = sqlite3.connect(args.db)
+        v = current_version(conn)
+        conn.close()
+        print(f"{args.db}: schema v{v} (latest v{LATEST_VERSION})")
+        return
+
+    applied = migrate(args.db)
+    if applied:
+        print(f"{args.db}: applied {', '.join('v' + str(v) for v in applied)}")
+    else:
+        print(f"{args.db}: up to date (v{LATEST_VERSION})")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""
+offer_archive.py
+
+Moves closed offers out of request_offers, so the table the USSD hot path
+reads (provider inbox, claim/pass, re-offer) only holds recent rows.
+
+- closed = ACCEPTED / PASSED / EXPIRED, created more than RETENTION_DAYS ago
+- OFFERED rows that old are stale (offer_scheduler expires open offers
+  within minutes; these predate it): archived as EXPIRED
+- rows move to request_offers_archive (same ids) in batches of BATCH_SIZE,
+  one BEGIN IMMEDIATE transaction per batch, so USSD writers only wait
+  for one batch at a time
+- batches walk request_offers by id (rowid range), one pass over the table
+- reports read both tables through the request_offers_all view
+
+CLI (cron, e.g. nightly):
+    python offer_archive.py --db /opt/angelopp/data/bumala.db
+    python offer_archive.py --db ... --days 7
+    python offer_archive.py --db ... --status
+"""
+
+import argparse
+import os
+import time
+from typing import Dict
+
+import dbpool
+import migrations
+
+DEFAULT_DB = os.environ.get("ANGELOPP_DB", "/opt/angelopp/data/bumala.db")
+RETENTION_DAYS = int(os.environ.get("ANGELOPP_OFFER_ARCHIVE_DAYS", "30"))
+BATCH_SIZE = int(os.environ.get("ANGELOPP_OFFER_ARCHIVE_BATCH", "5000"))
+
+_SELECT_BATCH = """
+SELECT id, status FROM request_offers
+WHERE id > ? AND created_at < datetime('now', ?)
+  AND status IN ('ACCEPTED', 'PASSED', 'EXPIRED', 'OFFERED')
+ORDER BY id
+LIMIT ?
+"""
+
+
+def cutoff_modifier(days: int) -> str:
+    """datetime('now', ?) argument for the retention cutoff."""
+    return f"-{int(days)} days"
+
+
+def _move(conn, after_id: int, days: int, limit: int) -> Dict[str, int]:
+    """Archive one batch of offers with id > after_id."""
+    cur = conn.cursor()
+    cur.execute("BEGIN IMMEDIATE")
+    try:
+        cur.execute(_SELECT_BATCH, (int(after_id), cutoff_modifier(days), int(limit)))
+        rows = cur.fetchall()
+        if not rows:
+            conn.commit()
+            return {"moved": 0, "stale": 0, "last_id": after_id}
+        ids = [int(r[0]) for r in rows]
+        stale = sum(1 for r in rows if r[1] == "OFFERED")
+        marks = ",".join("?" * len(ids))
+        cur.execute(f"""
+        INSERT OR REPLACE INTO request_offers_archive(id, request_id, provider_phone, score, eta_minutes, status, created_at)
+        SELECT id, request_id, provider_phone, score, eta_minutes,
+               CASE status WHEN 'OFFERED' THEN 'EXPIRED' ELSE status END, created_at
+        FROM request_offers
+        WHERE id IN ({marks})
+        """, ids)
+        cur.execute(f"DELETE FROM request_offers WHERE id IN ({marks})", ids)
+        moved = int(cur.rowcount or 0)
+        conn.commit()
+        return {"moved": moved, "stale": stale, "last_id": ids[-1]}
+    except Exception:
+        conn.rollback()
+        raise
+
+
+def archive(db_path, days: int = RETENTION_DAYS, batch_size: int = BATCH_SIZE,
+            max_batches: int = 0, pause: float = 0.0) -> Dict[str, int]:
+    """
+    Archive all offers older than `days` days. max_batches=0: until done.
+    pause: seconds between batches, to leave room for USSD writers.
+    """
+    migrations.ensure_current(db_path)
+    total = {"moved": 0, "stale": 0, "batches": 0}
+    last_id = 0
+    conn = dbpool.connect(db_path)
+    try:
+        while True:
+            res = _move(conn, last_id, days, batch_size)
+            if not res["moved"]:
+                break
+            last_id = res["last_id"]
+            total["moved"] += res["moved"]
+            total["stale"] += res["stale"]
+            total["batches"] += 1
+            if max_batches and total["batches"] >= max_batches:
+                break
+            if pause:
+                time.sleep(pause)
+    finally:
+        conn.close()
+    return total
+
+
+def counts(db_path) -> Dict[str, Dict[str, int]]:
+    migrations.ensure_current(db_path)
+    conn = dbpool.connect(db_path)
+    hot = conn.execute("SELECT status, COUNT(*) FROM request_offers GROUP BY status").fetchall()
+    cold = conn.execute("SELECT status, COUNT(*) FROM request_offers_archive GROUP BY status").fetchall()
+    conn.close()
+    return {"hot": {r[0]: int(r[1]) for r in hot}, "archive": {r[0]: int(r[1]) for r in cold}}
+
+
+# =========================
+# CLI
+# =========================
+def main():
+    ap = argparse.ArgumentParser(description="Move closed offers older than N days to request_offers_archive")
+    ap.add_argument("--db", default=DEFAULT_DB)
+    ap.add_argument("--days", type=int, default=RETENTION_DAYS)
+    ap.add_argument("--batch", type=int, default=BATCH_SIZE)
+    ap.add_argument("--max-batches", type=int, default=0, help="0 = until done")
+    ap.add_argument("--pause", type=float, default=0.05, help="seconds between batches")
+    ap.add_argument("--status", action="store_true", help="only print hot / archive counts")
+    args = ap.parse_args()
+
+    if args.status:
+        print(f"{args.db}: {counts(args.db)}")
+        return
+
+    t0 = time.perf_counter()
+    res = archive(args.db, days=args.days, batch_size=args.batch, max_batches=args.max_batches, pause=args.pause)
+    print(f"moved={res['moved']} stale_offered={res['stale']} batches={res['batches']} "
+          f"days={args.days} ms={(time.perf_counter() - t0) * 1000.0:.0f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+"""
+offer_scheduler.py
+
+Offer expiry + cascade re-offer, so a request does not die when its
+first riders do not answer.
+
+- build_offers() sets service_requests.reoffer_at = now + OFFER_TTL_SECONDS
+  (create_request too: a request nobody could be offered is retried)
+- tick() claims due requests (status NEW/OFFERED, reoffer_at <= now) in one
+  BEGIN IMMEDIATE transaction, like the outixs outbox lease:
+  - their OFFERED offers become EXPIRED (claim_offer then answers GONE)
+  - offer_rounds += 1 and reoffer_at moves on by the TTL
+  - after MAX_ROUNDS re-offers the request itself becomes EXPIRED
+- then build_offers(exclude=everyone already offered) for the claimed
+  requests: the next-best batch
+- pass_offer() makes a request due right away when its last open offer
+  is passed
+- a daemon thread per process (started by kick()) runs tick() every
+  POLL_SECONDS; several gunicorn workers or the CLI can run side by side
+
+CLI (cron / manual):
+    python offer_scheduler.py --db /opt/angelopp/data/bumala.db
+    python offer_scheduler.py --db ... --status
+"""
+
+import argparse
+import os
+import threading
+from typing import Dict, List, Set, Tuple
+
+import dbpool
+import migrations
+
+DEFAULT_DB = os.environ.get("ANGELOPP_DB", "/opt/angelopp/data/bumala.db")
+OFFER_TTL_SECONDS = int(os.environ.get("ANGELOPP_OFFER_TTL", "180"))
+MAX_ROUNDS = int(os.environ.get("ANGELOPP_OFFER_MAX_ROUNDS", "5"))
+BATCH_SIZE = int(os.environ.get("ANGELOPP_OFFER_BATCH", "50"))       # requests per tick
+OFFERS_PER_ROUND = int(os.environ.get("ANGELOPP_OFFERS_PER_ROUND", "5"))
+POLL_SECONDS = float(os.environ.get("ANGELOPP_OFFER_POLL", "15"))
+
+
+def ttl_modifier() -> str:
+    """datetime('now', ?) argument for the next look at a request."""
+    return f"+{int(OFFER_TTL_SECONDS)} seconds"
+
+
+# =========================
+# Tick
+# =========================
+_DUE_SQL = """
+SELECT id, offer_rounds
+FROM service_requests
+WHERE status IN ('NEW', 'OFFERED') AND reoffer_at <= datetime('now')
+ORDER BY reoffer_at
+LIMIT ?
+"""
+
+_EXPIRE_OFFERS_SQL = "UPDATE request_offers SET status='EXPIRED' WHERE request_id=? AND status='OFFERED'"
+
+def _claim(conn, limit: int) -> Tuple[List[int], Dict[str, int]]:
+    """Expire due offers; return request ids that get a new round."""
+    out = {"due": 0, "expired_offers": 0, "expired_requests": 0}
+    cur = conn.cursor()
+    cur.execute("BEGIN IMMEDIATE")
+    try:
+        cur.execute(_DUE_SQL, (int(limit),))
+        rows = cur.fetchall()
+        out["due"] = len(rows)
+        again = []
+        for r in rows:
+            cur.execute(_EXPIRE_OFFERS_SQL, (r["id"],))
+            out["expired_offers"] += int(cur.rowcount or 0)
+            if int(r["offer_rounds"]) >= MAX_ROUNDS:
+                cur.execute("UPDATE service_requests SET status='EXPIRED', reoffer_at=NULL WHERE id=?", (r["id"],))
+                out["expired_requests"] += 1
+                continue
+            # lease: if we crash before build_offers, the request is due again after the TTL
+            cur.execute("""
+            UPDATE service_requests
+            SET offer_rounds=offer_rounds+1, reoffer_at=datetime('now', ?)
+            WHERE id=?
+            """, (ttl_modifier(), r["id"]))
+            again.append(int(r["id"]))
+        conn.commit()
+        return again, out
+    except Exception:
+        conn.rollback()
+        raise
+
+
+_OFFERED_PHONES_SQL = "SELECT provider_phone FROM request_offers WHERE request_id=?"
+
+def offered_phones(conn, request_id: int) -> Set[str]:
+    rows = conn.execute(_OFFERED_PHONES_SQL, (int(request_id),)).fetchall()
+    return {r[0] for r in rows}
+
+
+def tick(db_path, limit: int = BATCH_SIZE) -> Dict[str, int]:
+    """One pass: expire, then re-offer to the next batch. Returns counts."""
+    import angelopp_core as core   # core imports this module (kick); import late
+
+    migrations.ensure_current(db_path)
+    conn = dbpool.connect(db_path)
+    try:
+        again, out = _claim(conn, limit)
+        skip = {rid: offered_phones(conn, rid) for rid in again}
+    finally:
+        conn.close()
+
+    out["reoffered"] = out["new_offers"] = 0
+    for rid in again:
+        try:
+            n = core.build_offers(rid, max_offers=OFFERS_PER_ROUND, exclude=skip[rid])
+        except Exception as e:
+            print("offer_scheduler: re-offer failed for request", rid, e)
+            continue
+        if n:
+            out["reoffered"] += 1
+            out["new_offers"] += n
+    return out
+
+
+def offer_counts(db_path) -> Dict[str, Dict[str, int]]:
+    conn = dbpool.connect(db_path)
+    offers = conn.execute("SELECT status, COUNT(*) FROM request_offers GROUP BY status").fetchall()
+    requests = conn.execute("SELECT status, COUNT(*) FROM service_requests GROUP BY status").fetchall()
+    conn.close()
+    return {"offers": {r[0]: int(r[1]) for r in offers}, "requests": {r[0]: int(r[1]) for r in requests}}
+
+
+# =========================
+# Background worker
+# =========================
+class _Worker:
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self.wake = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="offer-scheduler", daemon=True)
+        self.thread.start()
+
+    def _run(self) -> None:
+        while True:
+            try:
+                res = tick(self.db_path)
+                if res["due"] >= BATCH_SIZE:
+                    continue   # backlog: keep going
+            except Exception as e:
+                print("offer_scheduler tick failed:", e)
+            self.wake.wait(POLL_SECONDS)
+            self.wake.clear()
+
+
+_WORKERS: Dict[Tuple[int, str], _Worker] = {}
+_WORKERS_LOCK = threading.Lock()
+
+def kick(db_path) -> None:
+    """Wake (or start) this process's scheduler thread for db_path."""
+    key = (os.getpid(), str(db_path))
+    w = _WORKERS.get(key)
+    if w is None:
+        with _WORKERS_LOCK:
+            w = _WORKERS.get(key)
+            if w is None:
+                w = _WORKERS[key] = _Worker(str(db_path))
+    w.wake.set()
+
+
+# =========================
+# CLI
+# =========================
+def main():
+    ap = argparse.ArgumentParser(description="Expire unanswered offers and re-offer to the next riders")
+    ap.add_argument("--db", default=DEFAULT_DB)
+    ap.add_argument("--status", action="store_true", help="only print offer / request counts")
+    ap.add_argument("--max-batches", type=int, default=100)
+    args = ap.parse_args()
+
+    import angelopp_core as core
+    core.DB_PATH = args.db          # build_offers works on core.DB_PATH
+    migrations.ensure_current(args.db)
+    if args.status:
+        print(f"{args.db}: {offer_counts(args.db)}")
+        return
+
+    total = {"due": 0, "expired_offers": 0, "expired_requests": 0, "reoffered": 0, "new_offers": 0}
+    for _ in range(max(1, args.max_batches)):
+        res = tick(args.db)
+        for k, v in res.items():
+            total[k] += v
+        if res["due"] < BATCH_SIZE:
+            break
+    print(f"due={total['due']} expired_offers={total['expired_offers']} reoffered={total['reoffered']} "
+          f"new_offers={total['new_offers']} expired_requests={total['expired_requests']}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""
+outixs_anchors.py
+
+Local record of Outixs anchors (table `outixs_anchors`, created by
+migrations.py v3). Menus read anchor status from here.
+
+- upsert(): one prepared statement, runs in the caller's transaction
+- get_last_status(): by internal_id (UNIQUE index)
+- status_by_request_ids(): bulk read for list screens (request_id index)
+"""
+
+import sqlite3
+from typing import Dict, Iterable, Optional, Tuple
+
+import dbpool
+
+SQL_IN_CHUNK = 500
+
+_UPSERT_SQL = (
+    "INSERT INTO outixs_anchors (request_id, internal_id, rider_phone, transition_type, anchored_ok, anchored_at) "
+    "VALUES (?,?,?,?,?, datetime('now')) "
+    "ON CONFLICT(internal_id) DO UPDATE SET "
+    "request_id=excluded.request_id, rider_phone=excluded.rider_phone, transition_type=excluded.transition_type, "
+    "anchored_ok=excluded.anchored_ok, anchored_at=datetime('now')"
+)
+
+
+def upsert(cur: sqlite3.Cursor, request_id: Optional[int], internal_id: str,
+           rider_phone: Optional[str], transition_type: str, anchored_ok: bool) -> None:
+    cur.execute(_UPSERT_SQL, (
+        None if request_id is None else int(request_id),
+        str(internal_id),
+        rider_phone,
+        transition_type,
+        1 if anchored_ok else 0,
+    ))
+
+
+def get_last_status(db_path, internal_id: str) -> Tuple[Optional[bool], Optional[str]]:
+    """Return (anchored_ok: bool|None, anchored_at: str|None); (None, None) if unknown."""
+    try:
+        conn = dbpool.connect(db_path)
+        row = conn.execute(
+            "SELECT anchored_ok, anchored_at FROM outixs_anchors WHERE internal_id=?",
+            (str(internal_id),)
+        ).fetchone()
+        conn.close()
+    except Exception:
+        return (None, None)
+    if not row:
+        return (None, None)
+    return (None if row[0] is None else bool(int(row[0])), row[1])
+
+
+def status_by_request_ids(db_path, request_ids: Iterable[int]) -> Dict[int, bool]:
+    """{request_id: anchored_ok} for the ids that have an anchor row."""
+    ids = sorted({int(i) for i in request_ids if i is not None})
+    out: Dict[int, bool] = {}
+    if not ids:
+        return out
+    try:
+        conn = dbpool.connect(db_path)
+        for i in range(0, len(ids), SQL_IN_CHUNK):
+            chunk = ids[i:i + SQL_IN_CHUNK]
+            marks = ",".join("?" * len(chunk))
+            rows = conn.execute(
+                f"SELECT request_id, MAX(anchored_ok) FROM outixs_anchors "
+                f"WHERE request_id IN ({marks}) GROUP BY request_id",
+                chunk
+            ).fetchall()
+            for r in rows:
+                out[int(r[0])] = bool(int(r[1] or 0))
+        conn.close()
+    except Exception:
+        return {}
+    return out
@@ -0,0 +1,408 @@
+#!/usr/bin/env python3
+"""
+outixs_outbox.py
+
+Outbox for Outixs anchors, so job completion never waits on HTTP.
+
+- enqueue(): one INSERT in the caller's transaction, idempotent by internal_id
+- a daemon worker thread (started by kick()) drains due rows in batches
+- a batch goes out as ONE POST to /transitions/batch over a keep-alive
+  requests.Session; if Outixs does not have that endpoint, the items are
+  posted one by one over the same session
+- the first ack after an outage pulls backed-off rows forward (fast catch-up)
+- failures back off exponentially; after MAX_ATTEMPTS a row goes DEAD
+- rows are leased while in flight, so several gunicorn workers (or the
+  CLI) can drain the same table without double-sending
+- on ack/DEAD the result is written to outixs_anchors.anchored_ok
+
+CLI (cron / manual catch-up):
+    python outixs_outbox.py --db /opt/angelopp/data/bumala.db
+    python outixs_outbox.py --db /opt/angelopp/data/bumala.db --status
+"""
+
+import argparse
+import json
+import os
+import random
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import requests
+
+import dbpool
+import migrations
+import outixs_anchors
+
+DEFAULT_DB = os.environ.get("ANGELOPP_DB", "/opt/angelopp/data/bumala.db")
+OUTIXS_URL = os.environ.get("OUTIXS_URL", "http://127.0.0.1:8080")
+
+HTTP_TIMEOUT = float(os.environ.get("ANGELOPP_OUTIXS_TIMEOUT", "5"))
+BATCH_SIZE = int(os.environ.get("ANGELOPP_OUTIXS_BATCH", "100"))
+BATCH_PATH = os.environ.get("ANGELOPP_OUTIXS_BATCH_PATH", "/transitions/batch")
+BATCH_REPROBE_SECONDS = float(os.environ.get("ANGELOPP_OUTIXS_BATCH_REPROBE", "600"))
+MAX_ATTEMPTS = int(os.environ.get("ANGELOPP_OUTIXS_MAX_ATTEMPTS", "12"))
+BACKOFF_BASE = float(os.environ.get("ANGELOPP_OUTIXS_BACKOFF_BASE", "5"))      # seconds
+BACKOFF_MAX = float(os.environ.get("ANGELOPP_OUTIXS_BACKOFF_MAX", "3600"))     # seconds
+LEASE_SECONDS = int(os.environ.get("ANGELOPP_OUTIXS_LEASE", "60"))
+POLL_SECONDS = float(os.environ.get("ANGELOPP_OUTIXS_POLL", "10"))
+
+# HTTP codes that mean "Outixs has it" (409 = already anchored: idempotent replay)
+ACK_CODES = (200, 201, 409)
+
+
+# =========================
+# Payloads
+# =========================
+def ride_completed_payload(internal_id: str, rider_phone: Optional[str] = None) -> Dict[str, Any]:
+    """Minimal anchor: only store that a job was completed."""
+    return {
+        "recognized": True,
+        "non_trivial": True,
+        "transition_type": "RIDE_COMPLETED",
+        "transition": {
+            "kind": "ride_completed",
+            "internal_id": str(internal_id),
+            "rider_phone": str(rider_phone) if rider_phone else None
+        },
+        "context": {
+            "source": "angelopp",
+            "channel": "ussd"
+        }
+    }
+
+
+Result = Tuple[bool, bool, str]   # (acked, retryable, error)
+
+_http = threading.local()
+
+def _session() -> requests.Session:
+    # requests.Session is not shared between threads; one keep-alive session each
+    sess = getattr(_http, "session", None)
+    if sess is None or getattr(_http, "pid", None) != os.getpid():
+        sess = requests.Session()
+        sess.headers.update({"Content-Type": "application/json"})
+        _http.session = sess
+        _http.pid = os.getpid()
+    return sess
+
+
+def _classify(code: int) -> Result:
+    if code in ACK_CODES:
+        return (True, False, "")
+    # 4xx (except timeout / rate limit) will not get better by retrying
+    retryable = not (400 <= code < 500) or code in (408, 429)
+    return (False, retryable, f"HTTP {code}")
+
+
+def post_transition(payload: Dict[str, Any]) -> Result:
+    """
+    POST one transition. Returns (acked, retryable, error).
+    Never raises: Outixs being down is a normal state.
+    """
+    try:
+        r = _session().post(f"{OUTIXS_URL}/transition", json=payload, timeout=HTTP_TIMEOUT)
+        return _classify(int(getattr(r, "status_code", 0)))
+    except Exception as e:
+        return (False, True, str(e)[:200])
+
+
+# Does this Outixs have the batch endpoint? None = not probed yet.
+_batch = {"supported": None, "checked_at": 0.0}
+
+def _batch_enabled() -> bool:
+    if _batch["supported"] is False:
+        # re-probe now and then (Outixs may have been upgraded)
+        return time.time() - _batch["checked_at"] >= BATCH_REPROBE_SECONDS
+    return True
+
+
+def _batch_results(body: Any, payloads: List[Dict[str, Any]]) -> List[Result]:
+    """
+    Map a batch response to one Result per payload.
+    Expected: {"results": [{"internal_id": "...", "status": 201, "error": "..."}]}
+    matched by internal_id, falling back to position.
+    """
+    items = body.get("results") if isinstance(body, dict) else body
+    items = items if isinstance(items, list) else []
+
+    by_id = {}
+    for it in items:
+        if isinstance(it, dict) and it.get("internal_id") is not None:
+            by_id[str(it["internal_id"])] = it
+
+    out: List[Result] = []
+    for i, p in enumerate(payloads):
+        iid = str(((p.get("transition") or {}).get("internal_id")) or "")
+        it = by_id.get(iid)
+        if it is None and i < len(items) and isinstance(items[i], dict) and "internal_id" not in items[i]:
+            it = items[i]
+        if it is None:
+            out.append((False, True, "no result in batch response"))
+            continue
+        if "status" in it:
+            acked, retryable, error = _classify(int(it.get("status") or 0))
+        else:
+            acked, retryable, error = bool(it.get("ok")), True, ""
+        if not acked and it.get("error"):
+            error = str(it["error"])[:200]
+        out.append((acked, retryable, error or ("" if acked else "rejected")))
+    return out
+
+
+def post_transitions(payloads: List[Dict[str, Any]]) -> List[Result]:
+    """
+    Send many transitions. One POST to BATCH_PATH when Outixs supports it,
+    otherwise one keep-alive POST per item. Returns one Result per payload.
+    """
+    if not payloads:
+        return []
+
+    if _batch_enabled():
+        try:
+            r = _session().post(f"{OUTIXS_URL}{BATCH_PATH}", json={"transitions": payloads}, timeout=HTTP_TIMEOUT)
+            code = int(getattr(r, "status_code", 0))
+        except Exception as e:
+            # Outixs unreachable: every item stays queued
+            return [(False, True, str(e)[:200])] * len(payloads)
+
+        _batch["checked_at"] = time.time()
+        if code in (404, 405, 501):
+            _batch["supported"] = False
+        else:
+            _batch["supported"] = True
+            if code in (200, 207):
+                try:
+                    return _batch_results(r.json(), payloads)
+                except Exception as e:
+                    return [(False, True, "bad batch response: " + str(e)[:150])] * len(payloads)
+            # whole batch refused (5xx, 413, ...): keep every item queued
+            return [(False, True, f"HTTP {code}")] * len(payloads)
+
+    # Fallback: pipelined single posts over the same connection
+    out: List[Result] = []
+    for p in payloads:
+        res = post_transition(p)
+        out.append(res)
+        if not res[0] and res[1] and not res[2].startswith("HTTP"):
+            # connection-level failure: do not wait a timeout per remaining item
+            out.extend([res] * (len(payloads) - len(out)))
+            break
+    return out
+
+
+# =========================
+# Enqueue
+# =========================
+def enqueue(cur: sqlite3.Cursor, internal_id: str, payload: Dict[str, Any],
+            request_id: Optional[int] = None, rider_phone: Optional[str] = None) -> None:
+    """
+    Add an anchor to the outbox using the caller's cursor (same transaction).
+    Re-enqueueing the same internal_id is a no-op.
+    """
+    cur.execute("""
+    INSERT INTO outixs_outbox (internal_id, request_id, rider_phone, transition_type, payload)
+    VALUES (?,?,?,?,?)
+    ON CONFLICT(internal_id) DO NOTHING
+    """, (
+        str(internal_id),
+        None if request_id is None else int(request_id),
+        rider_phone,
+        str(payload.get("transition_type") or ""),
+        json.dumps(payload, separators=(",", ":")),
+    ))
+
+
+def get_status(db_path, internal_id: str) -> Optional[str]:
+    """PENDING / DONE / DEAD, or None if never enqueued."""
+    try:
+        conn = dbpool.connect(db_path)
+        row = conn.execute(
+            "SELECT status FROM outixs_outbox WHERE internal_id=?", (str(internal_id),)
+        ).fetchone()
+        conn.close()
+        return row[0] if row else None
+    except Exception:
+        return None
+
+
+# =========================
+# Drain
+# =========================
+def _backoff_seconds(attempts: int) -> int:
+    delay = min(BACKOFF_MAX, BACKOFF_BASE * (2 ** max(0, attempts - 1)))
+    # jitter so a recovered Outixs is not hit by every row at the same second
+    return int(delay * random.uniform(0.8, 1.2)) + 1
+
+
+_DUE_SQL = """
+SELECT id, internal_id, request_id, rider_phone, transition_type, payload, attempts
+FROM outixs_outbox
+WHERE status='PENDING' AND next_attempt_at <= datetime('now')
+ORDER BY next_attempt_at, id
+LIMIT ?
+"""
+
+def _claim(conn, limit: int) -> List[sqlite3.Row]:
+    cur = conn.cursor()
+    cur.execute("BEGIN IMMEDIATE")
+    try:
+        cur.execute(_DUE_SQL, (int(limit),))
+        rows = cur.fetchall()
+        if rows:
+            # lease: if we crash mid-send, the rows become due again later
+            cur.executemany(
+                "UPDATE outixs_outbox SET next_attempt_at=datetime('now', ?) WHERE id=?",
+                [(f"+{LEASE_SECONDS} seconds", r["id"]) for r in rows]
+            )
+        conn.commit()
+        return rows
+    except Exception:
+        conn.rollback()
+        raise
+
+
+def _finish(cur: sqlite3.Cursor, row: sqlite3.Row, acked: bool, retryable: bool, error: str) -> str:
+    attempts = int(row["attempts"]) + 1
+    if acked:
+        status = "DONE"
+        cur.execute("""
+        UPDATE outixs_outbox
+        SET status='DONE', attempts=?, last_error=NULL, sent_at=datetime('now')
+        WHERE id=?
+        """, (attempts, row["id"]))
+    elif retryable and attempts < MAX_ATTEMPTS:
+        status = "PENDING"
+        cur.execute("""
+        UPDATE outixs_outbox
+        SET attempts=?, last_error=?, next_attempt_at=datetime('now', ?)
+        WHERE id=?
+        """, (attempts, error, f"+{_backoff_seconds(attempts)} seconds", row["id"]))
+    else:
+        status = "DEAD"
+        cur.execute("""
+        UPDATE outixs_outbox
+        SET status='DEAD', attempts=?, last_error=?
+        WHERE id=?
+        """, (attempts, error, row["id"]))
+
+    if status != "PENDING":
+        outixs_anchors.upsert(cur, row["request_id"], row["internal_id"], row["rider_phone"],
+                              row["transition_type"], acked)
+    return status
+
+
+def _fast_forward(cur: sqlite3.Cursor) -> int:
+    """Outixs answers again: make backed-off rows due now instead of in an hour."""
+    cur.execute("""
+    UPDATE outixs_outbox
+    SET next_attempt_at=datetime('now')
+    WHERE status='PENDING' AND attempts > 0 AND next_attempt_at > datetime('now', ?)
+    """, (f"+{LEASE_SECONDS} seconds",))
+    return int(cur.rowcount or 0)
+
+
+def drain_once(db_path, limit: int = BATCH_SIZE) -> Dict[str, int]:
+    """Send one batch of due anchors. Returns counts per outcome."""
+    migrations.ensure_current(db_path)
+    conn = dbpool.connect(db_path)
+    out = {"claimed": 0, "DONE": 0, "PENDING": 0, "DEAD": 0}
+    try:
+        rows = _claim(conn, limit)
+        out["claimed"] = len(rows)
+        if not rows:
+            return out
+
+        sendable, payloads, results = [], [], {}
+        for r in rows:
+            try:
+                payloads.append(json.loads(r["payload"]))
+                sendable.append(r)
+            except Exception:
+                results[r["id"]] = (False, False, "bad payload")
+        for r, res in zip(sendable, post_transitions(payloads)):
+            results[r["id"]] = res
+
+        # all per-item outcomes in one transaction
+        cur = conn.cursor()
+        for r in rows:
+            out[_finish(cur, r, *results[r["id"]])] += 1
+        if out["DONE"]:
+            _fast_forward(cur)
+        conn.commit()
+    finally:
+        conn.close()
+    return out
+
+
+def outbox_counts(db_path) -> Dict[str, int]:
+    conn = dbpool.connect(db_path)
+    rows = conn.execute("SELECT status, COUNT(*) FROM outixs_outbox GROUP BY status").fetchall()
+    conn.close()
+    return {r[0]: int(r[1]) for r in rows}
+
+
+# =========================
+# Background worker
+# =========================
+class _Worker:
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self.wake = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="outixs-outbox", daemon=True)
+        self.thread.start()
+
+    def _run(self) -> None:
+        while True:
+            try:
+                res = drain_once(self.db_path)
+                if res["claimed"] >= BATCH_SIZE:
+                    continue   # more due rows waiting: keep going
+            except Exception as e:
+                print("Outixs outbox drain failed:", e)
+            self.wake.wait(POLL_SECONDS)
+            self.wake.clear()
+
+
+_WORKERS: Dict[Tuple[int, str], _Worker] = {}
+_WORKERS_LOCK = threading.Lock()
+
+def kick(db_path) -> None:
+    """Wake (or start) this process's drain thread for db_path."""
+    key = (os.getpid(), str(db_path))
+    w = _WORKERS.get(key)
+    if w is None:
+        with _WORKERS_LOCK:
+            w = _WORKERS.get(key)
+            if w is None:
+                w = _WORKERS[key] = _Worker(str(db_path))
+    w.wake.set()
+
+
+# =========================
+# CLI
+# =========================
+def main():
+    ap = argparse.ArgumentParser(description="Drain the Outixs anchor outbox")
+    ap.add_argument("--db", default=DEFAULT_DB)
+    ap.add_argument("--status", action="store_true", help="only print outbox counts")
+    ap.add_argument("--max-batches", type=int, default=1000)
+    args = ap.parse_args()
+
+    migrations.ensure_current(args.db)
+    if args.status:
+        print(f"{args.db}: {outbox_counts(args.db)}")
+        return
+
+    total = {"claimed": 0, "DONE": 0, "PENDING": 0, "DEAD": 0}
+    for _ in range(max(1, args.max_batches)):
+        res = drain_once(args.db)
+        for k, v in res.items():
+            total[k] += v
+        if res["claimed"] < BATCH_SIZE:
+            break
+    print(f"Drained: sent={total['claimed']} done={total['DONE']} retry={total['PENDING']} dead={total['DEAD']}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+from __future__ import annotations
+
+from typing import List, Sequence
+
+try:
+    from scipy.optimize import linear_sum_assignment  # optional: faster for big windows
+except Exception:
+    linear_sum_assignment = None
+
+
+def min_cost_assignment(cost: Sequence[Sequence[float]], use_scipy: bool = True) -> List[int]:
+    """
+    Rectangular assignment problem: pick one column per row (each column at
+    most once) with the lowest total cost. Returns the column per row, or -1
+    for rows left over when there are more rows than columns.
+
+    Hungarian algorithm with potentials, O(n^2 m) for n <= m; scipy's
+    linear_sum_assignment when installed (same optimum, ties may differ).
+    Costs must be finite: use a large number for "not allowed".
+    """
+    n = len(cost)
+    if n == 0:
+        return []
+    m = len(cost[0])
+    if m == 0:
+        return [-1] * n
+
+    if use_scipy and linear_sum_assignment is not None:
+        rows, cols = linear_sum_assignment([list(r) for r in cost])
+        out = [-1] * n
+        for i, j in zip(rows, cols):
+            out[int(i)] = int(j)
+        return out
+
+    if n > m:
+        # solve the transpose: one row per column
+        by_col = min_cost_assignment([[cost[i][j] for i in range(n)] for j in range(m)], use_scipy=False)
+        out = [-1] * n
+        for j, i in enumerate(by_col):
+            if i >= 0:
+                out[i] = j
+        return out
+
+    inf = float("inf")
+    u = [0.0] * (n + 1)
+    v = [0.0] * (m + 1)
+    p = [0] * (m + 1)          # p[j]: row (1-based) holding column j
+    way = [0] * (m + 1)
+    for i in range(1, n + 1):
+        p[0] = i
+        j0 = 0
+        minv = [inf] * (m + 1)
+        used = [False] * (m + 1)
+        while True:
+            used[j0] = True
+            i0 = p[j0]
+            row = cost[i0 - 1]
+            ui0 = u[i0]
+            delta = inf
+            j1 = 0
+            for j in range(1, m + 1):
+                if not used[j]:
+                    cur = row[j - 1] - ui0 - v[j]
+                    if cur < minv[j]:
+                        minv[j] = cur
+                        way[j] = j0
+                    if minv[j] < delta:
+                        delta = minv[j]
+                        j1 = j
+            for j in range(m + 1):
+                if used[j]:
+                    u[p[j]] += delta
+                    v[j] -= delta
+                else:
+                    minv[j] -= delta
+            j0 = j1
+            if p[j0] == 0:
+                break
+        while True:
+            j1 = way[j0]
+            p[j0] = p[j1]
+            j0 = j1
+            if j0 == 0:
+                break
+
+    out = [-1] * n
+    for j in range(1, m + 1):
+        if p[j]:
+            out[p[j] - 1] = j - 1
+    return out
@@ -1,6 +1,15 @@
 from __future__ import annotations
-from dataclasses import dataclass
-from typing import Dict, List, Optional
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Sequence
+
+from .topk import top_k_indices
+
+try:
+    import numpy as np  # optional: batched scoring over whole rosters
+except Exception:
+    np = None
+
+COMPONENTS = ("eta", "trust", "fairness", "income")
 
 
 @dataclass
@@ -43,9 +52,18 @@ def score_candidate(c: Candidate, w: PolicyWeights) -> float:
     )
 
 
-def rank_candidates(candidates: List[Candidate], weights: Optional[PolicyWeights] = None) -> List[Candidate]:
-    w = weights or PolicyWeights()
-    return sorted(candidates, key=lambda c: score_candidate(c, w), reverse=True)
+def rank_candidates(candidates: List[Candidate], weights: Optional[PolicyWeights] = None,
+                    k: Optional[int] = None) -> List[Candidate]:
+    """Best first; only the top k when k is given."""
+    b = score_batch(
+        [c.eta_minutes for c in candidates],
+        [c.trust_score for c in candidates],
+        [c.recent_jobs for c in candidates],
+        [c.expected_income for c in candidates],
+        weights,
+        k=k,
+    )
+    return [candidates[i] for i in b.order]
 
 
 def explain_score(c: Candidate, w: Optional[PolicyWeights] = None) -> Dict[str, float]:
@@ -57,3 +75,94 @@ def explain_score(c: Candidate, w: Optional[PolicyWeights] = None) -> Dict[str,
         "income": w.w_income * float(c.expected_income),
         "total": score_candidate(c, w),
     }
+
+
+# =========================
+# Batched scoring (column arrays)
+# =========================
+@dataclass
+class BatchScores:
+    scores: List[float]                     # per input row
+    order: List[int]                        # row indices, best first (ties keep input order); top k only
+    ranks: List[int]                        # per input row, 1 = best, 0 = outside the top k
+    components: Dict[str, List[float]] = field(default_factory=dict)  # weighted, per COMPONENTS
+
+    def explain(self, i: int) -> Dict[str, float]:
+        """Same shape as explain_score() for row i."""
+        out = {k: float(self.components[k][i]) for k in COMPONENTS}
+        out["total"] = float(self.scores[i])
+        return out
+
+
+def _batch_numpy(eta, trust, recent, income, w: PolicyWeights, k: Optional[int]):
+    e = np.array([np.nan if x is None else float(x) for x in eta], dtype=np.float64)
+    e = np.where(np.isnan(e), 0.0, np.maximum(0.0, 1.0 - (e / 30.0)))
+    r = np.asarray(recent, dtype=np.int64)
+    f = np.maximum(0.0, 1.0 - np.minimum(r, 10) / 10.0)
+    comps = {
+        "eta": w.w_eta * e,
+        "trust": w.w_trust * np.asarray(trust, dtype=np.float64),
+        "fairness": w.w_fairness * f,
+        "income": w.w_income * np.asarray(income, dtype=np.float64),
+    }
+    total = comps["eta"] + comps["trust"] + comps["fairness"] + comps["income"]
+    neg = -total
+    if k is not None and k < len(neg):
+        # rows at least as good as the k-th, in input order, then a stable sort
+        kth = np.partition(neg, k - 1)[k - 1] if k > 0 else -np.inf
+        cand = np.nonzero(neg <= kth)[0]
+        order = cand[np.argsort(neg[cand], kind="stable")][:max(k, 0)]
+    else:
+        order = np.argsort(neg, kind="stable")
+    ranks = np.zeros(len(neg), dtype=np.int64)
+    ranks[order] = np.arange(1, len(order) + 1)
+    return (total.tolist(), order.tolist(), ranks.tolist(), {k: v.tolist() for k, v in comps.items()})
+
+
+def _batch_python(eta, trust, recent, income, w: PolicyWeights, k: Optional[int]):
+    comps = {
+        "eta": [w.w_eta * _eta_score(x) for x in eta],
+        "trust": [w.w_trust * float(x) for x in trust],
+        "fairness": [w.w_fairness * _fairness_score(int(x)) for x in recent],
+        "income": [w.w_income * float(x) for x in income],
+    }
+    total = [a + b + c + d for a, b, c, d in zip(comps["eta"], comps["trust"], comps["fairness"], comps["income"])]
+    order = top_k_indices(total, k, reverse=True)
+    ranks = [0] * len(total)
+    for pos, i in enumerate(order, 1):
+        ranks[i] = pos
+    return (total, order, ranks, comps)
+
+
+def score_batch(
+    eta_minutes: Sequence[Optional[float]],
+    trust_score: Sequence[float],
+    recent_jobs: Sequence[int],
+    expected_income: Optional[Sequence[float]] = None,
+    weights: Optional[PolicyWeights] = None,
+    use_numpy: Optional[bool] = None,
+    k: Optional[int] = None,
+) -> BatchScores:
+    """
+    Score a whole roster in one pass: one value per rider in each column.
+    Same numbers as score_candidate(); NumPy when installed (or use_numpy),
+    otherwise plain Python. With k, only the k best are ordered (top-k
+    selection, no full sort); scores/components still cover every row.
+    """
+    w = weights or PolicyWeights()
+    n = len(eta_minutes)
+    income = expected_income if expected_income is not None else [0.0] * n
+    if not (len(trust_score) == len(recent_jobs) == len(income) == n):
+        raise ValueError("score_batch: columns must have the same length")
+    if n == 0:
+        return BatchScores([], [], [], {k: [] for k in COMPONENTS})
+
+    vectorized = (np is not None) if use_numpy is None else (bool(use_numpy) and np is not None)
+    fn = _batch_numpy if vectorized else _batch_python
+    total, order, ranks, comps = fn(eta_minutes, trust_score, recent_jobs, income, w, k)
+    return BatchScores(total, order, ranks, comps)
+
+
+def short_explanation(expl: Dict[str, float]) -> str:
+    """Compact form for a USSD line: total score."""
+    return f"{expl.get('total', 0.0):.1f}"
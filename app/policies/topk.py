@@ -0,0 +1,28 @@
+from __future__ import annotations
+
+import heapq
+from typing import Any, Callable, Iterable, List, Optional, Sequence, TypeVar
+
+T = TypeVar("T")
+
+
+def top_k(items: Iterable[T], k: Optional[int], key: Optional[Callable[[T], Any]] = None,
+          reverse: bool = False) -> List[T]:
+    """
+    The k best items in O(n log k), lowest key first (reverse=True: highest).
+    Same result as sorted(items, key=key, reverse=reverse)[:k]: ties keep
+    their input order, so the outcome is deterministic. k=None means all.
+    """
+    if k is None:
+        return sorted(items, key=key, reverse=reverse)
+    if k <= 0:
+        return []
+    # heapq.nsmallest/nlargest decorate with the input position: stable
+    if reverse:
+        return heapq.nlargest(k, items, key=key)
+    return heapq.nsmallest(k, items, key=key)
+
+
+def top_k_indices(values: Sequence[Any], k: Optional[int], reverse: bool = False) -> List[int]:
+    """Positions of the k best values (ties: lower position first)."""
+    return top_k(range(len(values)), k, key=values.__getitem__, reverse=reverse)
@@ -0,0 +1,463 @@
+#!/usr/bin/env python3
+"""
+provider_roster.py
+
+In-memory roster of providers (+ their active services) for matching
+and "nearest available riders".
+
+- loaded once from `providers` / `provider_services` per process, then kept
+  fresh through the `provider_changes` feed (migrations.py v8):
+  - writers call record_change(cur, phone, kind) in their own transaction
+    (upsert_provider, set_provider_landmark, set_provider_available,
+    provider_set_service) and touch(phone) after commit
+  - other workers replay `provider_changes WHERE id > last seen`, at most
+    every SYNC_SECONDS (one indexed read when nothing changed)
+- candidates(village, service_id) replaces get_candidate_providers' SQL:
+  memoized per (village, service) and dropped when a provider of that
+  village changes; hit/miss counters in stats()
+- available providers are bucketed per village and per canonical landmark
+  (landmark_index), so a query computes one ETA per landmark bucket
+  (travel_matrix) instead of one per rider
+- real fairness inputs per rider: recent jobs (fairness_state window) and a
+  trust score from job completion (last TRUST_DAYS) + SACCO membership
+
+    riders = provider_roster.get_roster(DB_PATH).nearest("Bumala", "Mkt Gate", limit=3)
+
+CLI (benchmark / inspection):
+    python provider_roster.py --db /opt/angelopp/data/bumala.db --village Bumala --landmark "Market Gate"
+    python provider_roster.py --db /tmp/bench.db --seed 5000 --village Bumala --landmark "Market Gate"
+"""
+
+import argparse
+import os
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+import dbpool
+import fairness_state
+import landmark_index
+import travel_matrix
+from policies.topk import top_k
+
+DEFAULT_DB = os.environ.get("ANGELOPP_DB", "/opt/angelopp/data/bumala.db")
+SYNC_SECONDS = float(os.environ.get("ANGELOPP_ROSTER_SYNC_SECONDS", "2"))
+TRUST_SECONDS = float(os.environ.get("ANGELOPP_ROSTER_TRUST_SECONDS", "300"))
+TRUST_DAYS = 30
+
+_COLS = "phone, provider_type, name, village, sacco, current_landmark, is_available, updated_at"
+SQL_IN_CHUNK = 500
+PRUNE_EVERY = 1000          # record_change(): trim the feed every N changes
+FEED_KEEP_HOURS = 24
+FEED_REPLAY_SECONDS = (FEED_KEEP_HOURS - 1) * 3600     # idle longer: full reload (1 h under the prune cutoff)
+
+# SQL (query_plans.py checks these); {marks}: one ? per phone
+_FULL_LOAD_SQL = f"SELECT {_COLS} FROM providers"
+_FULL_SERVICES_SQL = "SELECT phone, service_id FROM provider_services WHERE active=1"
+_BY_PHONE_SQL = f"SELECT {_COLS} FROM providers WHERE phone IN ({{marks}})"
+_SERVICES_BY_PHONE_SQL = "SELECT phone, service_id FROM provider_services WHERE active=1 AND phone IN ({marks})"
+_FEED_SQL = "SELECT id, phone FROM provider_changes WHERE id > ? ORDER BY id"
+_TRUST_SQL = """
+SELECT a.provider_phone, COUNT(*), SUM(CASE WHEN sr.status='CLOSED' THEN 1 ELSE 0 END)
+FROM assignments a
+JOIN service_requests sr ON sr.id = a.request_id
+WHERE a.assigned_at >= datetime('now', ?)
+  AND a.assigned_at < datetime('now', '-1 hour')
+GROUP BY a.provider_phone
+"""
+_PRUNE_FEED_SQL = "DELETE FROM provider_changes WHERE changed_at < datetime('now', ?)"
+
+
+@dataclass
+class Provider:
+    phone: str
+    provider_type: str
+    name: str
+    village: str
+    sacco: str
+    landmark: str
+    available: bool
+    bucket: Tuple[str, object]      # (village, landmark id or normalized text)
+    trust: float = 0.5
+    updated_at: str = ""
+    row: Optional[Dict[str, object]] = None     # candidates() shape, built once per change
+
+
+@dataclass
+class RiderMatch:
+    """PersonLocation-shaped (phone / village / landmark / eta_minutes) plus fairness inputs."""
+    phone: str
+    village: str
+    landmark: Optional[str]
+    eta_minutes: int
+    name: str = ""
+    sacco: str = ""
+    trust_score: float = 0.5
+    recent_jobs: int = 0
+
+
+def trust_from_history(assigned: int, closed: int, sacco: str) -> float:
+    # Smoothed completion rate (new riders start at 0.5), SACCO members +0.2
+    rate = (closed + 1.0) / (assigned + 2.0)
+    return round(min(1.0, 0.25 + 0.5 * rate + (0.2 if (sacco or "").strip() else 0.0)), 3)
+
+
+class ProviderRoster:
+    def __init__(self, db_path: str, sync_seconds: float = SYNC_SECONDS):
+        self.db_path = str(db_path)
+        self.sync_seconds = float(sync_seconds)
+
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()      # one DB read + apply at a time (_refresh, touch)
+        self._providers: Dict[str, Provider] = {}
+        self._buckets: Dict[str, Dict[object, Set[str]]] = {}       # village -> bucket key -> phones
+        self._bucket_lm: Dict[Tuple[str, object], landmark_index.Resolved] = {}
+        self._history: Dict[str, Tuple[int, int]] = {}               # phone -> (assigned, closed)
+        self._services: Dict[str, Set[int]] = {}                     # phone -> active service ids
+        self._by_village: Dict[str, Set[str]] = {}                   # village -> phones (any availability)
+        self._village_version: Dict[str, int] = {}
+        self._memo: Dict[Tuple[str, int], Tuple[int, List[Dict[str, object]]]] = {}
+        self._hits = 0
+        self._misses = 0
+        self._last_change_id = 0
+        self._last_sync = 0.0
+        self._last_trust = 0.0
+        self._built = False
+
+    # -------------------------
+    # Reads
+    # -------------------------
+    def nearest(self, village: str, landmark: Optional[str], limit: int = 3,
+                provider_type: str = "rider", exclude: Iterable[str] = ()) -> List[RiderMatch]:
+        """Available providers in `village`, lowest ETA first (ties: more trusted, then phone)."""
+        village = (village or "").strip()
+        self._refresh()
+        ix = landmark_index.get_index(self.db_path)
+        to = ix.lookup(village, landmark)
+        skip = set(exclude or ())
+
+        with self._lock:
+            keys = list(self._buckets.get(village, {}))
+            reps = [self._bucket_lm.get((village, k)) or landmark_index.Resolved(None, "", "") for k in keys]
+
+        # one ETA per landmark bucket, then walk buckets nearest first and stop
+        # once `limit` riders are in hand and the next bucket is slower
+        etas = sorted(
+            (travel_matrix.eta_between(self.db_path, village, rep, to), i) for i, rep in enumerate(reps)
+        )
+        picked: List[Tuple[int, float, str, int]] = []
+        with self._lock:
+            buckets = self._buckets.get(village, {})
+            for eta, i in etas:
+                if len(picked) >= limit and eta > picked[-1][0]:
+                    break
+                for ph in buckets.get(keys[i], ()):
+                    p = self._providers.get(ph)
+                    if p is None or ph in skip or (provider_type and p.provider_type != provider_type):
+                        continue
+                    picked.append((eta, -p.trust, ph, i))
+            best = top_k(picked, limit)
+            out = []
+            for eta, neg_trust, ph, i in best:
+                p = self._providers[ph]
+                out.append(RiderMatch(
+                    phone=ph, village=p.village, landmark=(reps[i].name or p.landmark or None), eta_minutes=eta,
+                    name=p.name, sacco=p.sacco, trust_score=-neg_trust,
+                ))
+
+        recent = fairness_state.get_window(self.db_path).counts([m.phone for m in out])
+        for m in out:
+            m.recent_jobs = int(recent.get(m.phone, 0))
+        return out
+
+    def candidates(self, village: str, service_id: int) -> List[Dict[str, object]]:
+        """
+        Providers in `village` offering `service_id`, newest update first:
+        same rows/order as the old providers JOIN provider_services query.
+        Row dicts are shared with the cache: read them, do not modify.
+        """
+        village = (village or "").strip()
+        key = (village, int(service_id))
+        self._refresh()
+        with self._lock:
+            version = self._village_version.get(village, 0)
+            hit = self._memo.get(key)
+            if hit is not None and hit[0] == version:
+                self._hits += 1
+                return list(hit[1])
+            self._misses += 1
+            rows = [
+                self._providers[ph] for ph in self._by_village.get(village, ())
+                if key[1] in self._services.get(ph, ())
+            ]
+            rows.sort(key=lambda p: p.updated_at, reverse=True)
+            out = [p.row for p in rows]
+            self._memo[key] = (version, out)
+            return list(out)
+
+    def riders_panel(self, village: str, limit: int = 10) -> List[Dict[str, object]]:
+        """Available riders for the cockpit: with a landmark first, then by phone."""
+        village = (village or "").strip()
+        self._refresh()
+        with self._lock:
+            rows = [self._providers[ph] for ph in self._by_village.get(village, ())]
+            rows = [p for p in rows if p.available and p.provider_type == "rider"]
+        rows = top_k(rows, limit, key=lambda p: (0 if p.landmark else 99, p.phone))
+        return [{"phone": p.phone, "name": p.name, "current_landmark": p.landmark, "is_available": 1} for p in rows]
+
+    def trust(self, phone: str) -> float:
+        p = self._providers.get(phone)
+        return p.trust if p is not None else 0.5
+
+    def stats(self) -> Dict[str, int]:
+        self._refresh()
+        with self._lock:
+            return {
+                "providers": len(self._providers),
+                "available": sum(1 for p in self._providers.values() if p.available),
+                "villages": len(self._buckets),
+                "buckets": sum(len(b) for b in self._buckets.values()),
+                "last_change_id": self._last_change_id,
+                "memo_hits": self._hits,
+                "memo_misses": self._misses,
+                "memo_hit_rate": round(self._hits / (self._hits + self._misses), 4) if (self._hits + self._misses) else 0.0,
+            }
+
+    # -------------------------
+    # Writes
+    # -------------------------
+    def touch(self, phone: str) -> None:
+        """Re-read one provider right after a local write (no wait for the next sync)."""
+        # under the refresh lock: a refresh that read a newer row is never overwritten by ours
+        with self._refresh_lock:
+            try:
+                conn = dbpool.connect(self.db_path)
+                try:
+                    rows, services = self._read_phones(conn, [phone])
+                finally:
+                    conn.close()
+            except Exception as e:
+                print("provider_roster touch failed:", e)
+                return
+            with self._lock:
+                self._apply_phones([phone], rows, services)
+
+    # -------------------------
+    # Internals
+    # -------------------------
+    def _bucket_for(self, village: str, landmark: str) -> Tuple[str, object]:
+        r = landmark_index.get_index(self.db_path).lookup(village, landmark)
+        key = r.id if r.id is not None else r.norm
+        self._bucket_lm.setdefault((village, key), r)
+        return (village, key)
+
+    def _bump(self, village: str) -> None:
+        self._village_version[village] = self._village_version.get(village, 0) + 1
+
+    def _remove(self, phone: str) -> None:
+        old = self._providers.pop(phone, None)
+        if old is not None:
+            self._bump(old.village)
+            self._by_village.get(old.village, set()).discard(phone)
+            v, key = old.bucket
+            phones = self._buckets.get(v, {}).get(key)
+            if phones is not None:
+                phones.discard(phone)
+                if not phones:
+                    del self._buckets[v][key]
+
+    def _apply(self, row) -> None:
+        phone = row[0]
+        village = (row[3] or "").strip()
+        landmark = (row[5] or "").strip()
+        self._remove(phone)
+        p = Provider(
+            phone=phone,
+            provider_type=(row[1] or "").strip().lower(),
+            name=row[2] or "",
+            village=village,
+            sacco=row[4] or "",
+            landmark=landmark,
+            available=bool(1 if row[6] is None else int(row[6])),
+            bucket=self._bucket_for(village, landmark),
+            updated_at=row[7] or "",
+        )
+        p.trust = trust_from_history(*self._history.get(phone, (0, 0)), p.sacco)
+        p.row = {
+            "phone": p.phone, "provider_type": p.provider_type, "name": p.name,
+            "village": p.village, "sacco": p.sacco, "current_landmark": p.landmark,
+        }
+        self._providers[phone] = p
+        self._by_village.setdefault(village, set()).add(phone)
+        self._bump(village)
+        if p.available:
+            self._buckets.setdefault(village, {}).setdefault(p.bucket[1], set()).add(phone)
+
+    def _apply_phones(self, phones, rows, services: Dict[str, Set[int]]) -> None:
+        # phones that changed: replace their row + services (gone from the DB -> removed)
+        by_phone = {r[0]: r for r in rows}
+        for ph in phones:
+            row = by_phone.get(ph)
+            if row is None:
+                self._remove(ph)
+                self._services.pop(ph, None)
+            else:
+                self._services[ph] = services.get(ph, set())
+                self._apply(row)
+
+    def _read_phones(self, conn, phones) -> Tuple[list, Dict[str, Set[int]]]:
+        phones = list(phones)
+        rows: list = []
+        services: Dict[str, Set[int]] = {}
+        for i in range(0, len(phones), SQL_IN_CHUNK):
+            chunk = phones[i:i + SQL_IN_CHUNK]
+            marks = ",".join("?" * len(chunk))
+            rows.extend(conn.execute(_BY_PHONE_SQL.format(marks=marks), chunk).fetchall())
+            for ph, sid in conn.execute(_SERVICES_BY_PHONE_SQL.format(marks=marks), chunk).fetchall():
+                services.setdefault(ph, set()).add(int(sid))
+        return rows, services
+
+    def _refresh(self) -> None:
+        if self._built and time.time() - self._last_sync < self.sync_seconds:
+            return
+        # one refresh at a time, so feed reads apply in order; once built,
+        # callers that find a refresh running read the current roster instead of waiting
+        if not self._refresh_lock.acquire(blocking=not self._built):
+            return
+        try:
+            self._refresh_locked()
+        finally:
+            self._refresh_lock.release()
+
+    def _refresh_locked(self) -> None:
+        now = time.time()
+        if self._built and now - self._last_sync < self.sync_seconds:
+            return      # another caller synced while we waited
+        try:
+            conn = dbpool.connect(self.db_path)
+            try:
+                changed = None
+                # idle longer than the feed is kept: the replay could have gaps
+                stale = now - self._last_sync > FEED_REPLAY_SECONDS
+                if not self._built or stale:
+                    # feed position first: anything committed after it is replayed later
+                    last_id = int(conn.execute("SELECT COALESCE(MAX(id), 0) FROM provider_changes").fetchone()[0])
+                    rows = conn.execute(_FULL_LOAD_SQL).fetchall()
+                    services: Dict[str, Set[int]] = {}
+                    for ph, sid in conn.execute(_FULL_SERVICES_SQL).fetchall():
+                        services.setdefault(ph, set()).add(int(sid))
+                else:
+                    feed = conn.execute(_FEED_SQL, (self._last_change_id,)).fetchall()
+                    last_id = int(feed[-1][0]) if feed else self._last_change_id
+                    changed = list(dict.fromkeys(r[1] for r in feed))
+                    rows, services = self._read_phones(conn, changed) if changed else ([], {})
+                history = None
+                if now - self._last_trust >= TRUST_SECONDS:
+                    history = conn.execute(_TRUST_SQL, (f"-{int(TRUST_DAYS)} days",)).fetchall()
+            finally:
+                conn.close()
+        except Exception as e:
+            print("provider_roster refresh failed:", e)
+            self._last_sync = now
+            return
+
+        with self._lock:
+            if history is not None:
+                self._history = {r[0]: (int(r[1] or 0), int(r[2] or 0)) for r in history}
+                self._last_trust = now
+                for p in self._providers.values():
+                    p.trust = trust_from_history(*self._history.get(p.phone, (0, 0)), p.sacco)
+            if changed is None:
+                self._providers.clear()
+                self._buckets.clear()
+                self._by_village.clear()
+                self._memo.clear()
+                self._services = services
+                for r in rows:
+                    self._apply(r)
+            else:
+                self._apply_phones(changed, rows, services)
+            self._last_change_id = last_id
+            self._built = True
+            self._last_sync = now
+
+
+_ROSTERS: Dict[str, ProviderRoster] = {}
+_ROSTERS_LOCK = threading.Lock()
+
+def get_roster(db_path) -> ProviderRoster:
+    key = str(db_path)
+    r = _ROSTERS.get(key)
+    if r is None:
+        with _ROSTERS_LOCK:
+            r = _ROSTERS.get(key)
+            if r is None:
+                r = _ROSTERS[key] = ProviderRoster(key)
+    return r
+
+
+def touch(db_path, phone: str) -> None:
+    get_roster(db_path).touch(phone)
+
+
+def record_change(cur, phone: str, kind: str) -> None:
+    """Append to the provider change feed; call inside the writer's transaction."""
+    cur.execute("INSERT INTO provider_changes(phone, kind) VALUES (?, ?)", (phone, kind))
+    if cur.lastrowid and int(cur.lastrowid) % PRUNE_EVERY == 0:
+        cur.execute(_PRUNE_FEED_SQL, (f"-{int(FEED_KEEP_HOURS)} hours",))
+
+
+def _seed(db_path: str, village: str, n: int) -> None:
+    import random
+    rnd = random.Random(11)
+    names = ["Market Gate", "Water Pump", "Police Station", "Bumala Primary School", "Stage",
+             "Hospital", "Church", "Posta", "Junction", "Chief's Camp"]
+    conn = dbpool.connect(db_path)
+    try:
+        for nm in names:
+            conn.execute("INSERT INTO landmarks(village, name) VALUES (?, ?)", (village, nm))
+        conn.executemany(
+            "INSERT OR REPLACE INTO providers(phone, provider_type, name, village, sacco, current_landmark, is_available) "
+            "VALUES (?, 'rider', ?, ?, ?, ?, ?)",
+            [(f"+2547{i:08d}", f"Rider {i}", village, rnd.choice(["", "SACCO-A"]),
+              rnd.choice(names + ["mkt gate", "water pmp", ""]), 1 if rnd.random() < 0.7 else 0)
+             for i in range(n)]
+        )
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Nearest available riders (provider roster)")
+    ap.add_argument("--db", default=DEFAULT_DB)
+    ap.add_argument("--village", required=True)
+    ap.add_argument("--landmark", default="")
+    ap.add_argument("--limit", type=int, default=3)
+    ap.add_argument("--seed", type=int, default=0, metavar="N", help="insert N synthetic riders first (test DBs only)")
+    ap.add_argument("--repeat", type=int, default=200)
+    args = ap.parse_args()
+
+    import migrations
+    migrations.ensure_current(args.db)
+    if args.seed:
+        _seed(args.db, args.village, args.seed)
+
+    roster = get_roster(args.db)
+    t0 = time.perf_counter()
+    roster.stats()
+    print(f"load: {(time.perf_counter() - t0) * 1000:.1f} ms  {roster.stats()}")
+
+    res = roster.nearest(args.village, args.landmark, limit=args.limit)
+    for m in res:
+        print(f"{m.phone} ~{m.eta_minutes} min ({m.landmark or 'Unknown'}) trust={m.trust_score} recent={m.recent_jobs}")
+
+    t0 = time.perf_counter()
+    for _ in range(args.repeat):
+        roster.nearest(args.village, args.landmark, limit=args.limit)
+    dt = (time.perf_counter() - t0) / max(1, args.repeat)
+    print(f"nearest(): {dt * 1000:.2f} ms/query")
+
+if __name__ == "__main__":
+    main()
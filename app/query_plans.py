@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+"""
+query_plans.py
+
+EXPLAIN QUERY PLAN regression check for the hot queries on bumala.db
+(matching, offers, jobs, rider inbox, dashboard panels).
+
+- QUERIES is the registry: the module-level SQL constant each hot path
+  runs (imported from its module, so the check cannot drift from the code),
+  with sample params and where it runs. app.py's constants are read with
+  ast: importing app.py migrates ANGELOPP_DB and starts workers
+- a plan step "SCAN <table>" (whole table, or a whole index) fails the
+  check, unless the query allows it for that table with a reason
+- "USE TEMP B-TREE" (sort without an index) is reported, not failed
+- indexes for these queries: migrations.py v9 and v11
+
+CLI (exit 1 when a query scans; run after schema or query changes):
+    python query_plans.py --fresh
+    python query_plans.py --db /opt/angelopp/data/bumala.db --verbose
+"""
+
+import argparse
+import ast
+import os
+import re
+import sqlite3
+import sys
+import tempfile
+from typing import Dict, List, NamedTuple, Tuple
+
+import angelopp_core
+import cold_archive
+import fairness_state
+import migrations
+import offer_archive
+import offer_scheduler
+import outixs_outbox
+import provider_roster
+import user_context
+import ussd
+
+DEFAULT_DB = os.environ.get("ANGELOPP_DB", "/opt/angelopp/data/bumala.db")
+
+
+class HotQuery(NamedTuple):
+    name: str
+    where: str                          # module.function running it
+    sql: str
+    params: tuple = ()
+    allow_scan: Dict[str, str] = {}     # table/alias -> why a scan is fine
+
+
+def _app_sql(name: str) -> str:
+    """A module-level SQL constant of app.py, read without importing it (import runs migrations, starts workers)."""
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "app.py")
+    with open(path, encoding="utf-8") as f:
+        tree = ast.parse(f.read())
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and any(isinstance(t, ast.Name) and t.id == name for t in node.targets):
+            return ast.literal_eval(node.value)
+    raise KeyError(f"app.py has no {name}")
+
+
+PHONE, PHONE2, PHONE3 = "+254700000001", "+254700000002", "+254700000003"
+
+QUERIES: List[HotQuery] = [
+    # --- matching / offers (angelopp_core) ---
+    HotQuery("pending_offers", "angelopp_core.provider_pending_offers", angelopp_core._PENDING_OFFERS_SQL, (PHONE, 5)),
+    HotQuery("claim_offer", "angelopp_core.claim_offer", angelopp_core._CLAIM_OFFER_SQL, (1, PHONE)),
+    HotQuery("claim_assign", "angelopp_core.claim_offer", angelopp_core._CLAIM_ASSIGN_SQL, (1, PHONE, PHONE)),
+    HotQuery("pass_other_offers", "angelopp_core.claim_offer", angelopp_core._PASS_OTHER_OFFERS_SQL, (1, 2)),
+    HotQuery("pass_offer", "angelopp_core.pass_offer", angelopp_core._PASS_OFFER_SQL, (1, PHONE)),
+    HotQuery("provider_services", "angelopp_core.provider_services", angelopp_core._PROVIDER_SERVICES_SQL, (PHONE,)),
+    HotQuery("active_jobs", "angelopp_core.provider_active_jobs", angelopp_core._ACTIVE_JOBS_SQL, (PHONE, 8)),
+    HotQuery("complete_job", "angelopp_core.complete_job", angelopp_core._COMPLETE_JOB_SQL, (1, 1, PHONE)),
+    HotQuery("customer_requests", "angelopp_core.handle_customer_my_requests",
+             angelopp_core._CUSTOMER_REQUESTS_SQL, (PHONE,)),
+    HotQuery("village_landmarks", "angelopp_core.list_landmarks", angelopp_core._LANDMARKS_SQL, ("Bumala", 8)),
+
+    HotQuery("reoffer_due", "offer_scheduler._claim", offer_scheduler._DUE_SQL, (50,)),
+    HotQuery("expire_offers", "offer_scheduler._claim", offer_scheduler._EXPIRE_OFFERS_SQL, (1,)),
+    HotQuery("offered_phones", "offer_scheduler.offered_phones", offer_scheduler._OFFERED_PHONES_SQL, (1,)),
+    HotQuery("archive_batch", "offer_archive._move", offer_archive._SELECT_BATCH, (0, "-30 days", 5000)),
+] + [
+    HotQuery(f"cold_batch_{t.table}", "cold_archive._move", cold_archive.batch_sql(t),
+             {"after": 0, "cutoff": "-90 days", "limit": 2000})
+    for t in cold_archive.COLD_TABLES
+] + [
+    # --- caches (provider_roster, fairness_state) ---
+    HotQuery("roster_full_load", "provider_roster.ProviderRoster._refresh", provider_roster._FULL_LOAD_SQL,
+             allow_scan={"providers": "once per process (and after a long idle), then the change feed"}),
+    HotQuery("roster_full_services", "provider_roster.ProviderRoster._refresh", provider_roster._FULL_SERVICES_SQL,
+             allow_scan={"provider_services": "once per process, with roster_full_load"}),
+    HotQuery("roster_by_phone", "provider_roster.ProviderRoster._read_phones",
+             provider_roster._BY_PHONE_SQL.format(marks="?,?"), (PHONE, PHONE2)),
+    HotQuery("roster_services_by_phone", "provider_roster.ProviderRoster._read_phones",
+             provider_roster._SERVICES_BY_PHONE_SQL.format(marks="?,?"), (PHONE, PHONE2)),
+    HotQuery("roster_feed", "provider_roster.ProviderRoster._refresh", provider_roster._FEED_SQL, (0,)),
+    HotQuery("roster_trust", "provider_roster.ProviderRoster._refresh", provider_roster._TRUST_SQL,
+             (f"-{provider_roster.TRUST_DAYS} days",)),
+    HotQuery("feed_prune", "provider_roster.record_change", provider_roster._PRUNE_FEED_SQL,
+             (f"-{provider_roster.FEED_KEEP_HOURS} hours",),
+             allow_scan={"provider_changes": "every 1000 feed rows; the feed stays small"}),
+    HotQuery("fairness_rebuild", "fairness_state.AssignmentWindow._rebuild", fairness_state._REBUILD_SQL,
+             ("-86400 seconds", 100)),
+    HotQuery("fairness_sync", "fairness_state.AssignmentWindow._sync", fairness_state._SYNC_SQL, (0,)),
+
+    # --- outbox / user context ---
+    HotQuery("outbox_due", "outixs_outbox._claim", outixs_outbox._DUE_SQL, (50,)),
+    HotQuery("user_context", "user_context.load", user_context._SQL,
+             (PHONE, "254700000001", "0700000001", PHONE, "254700000001", PHONE)),
+
+    # --- rider deliveries / landmark game (ussd) ---
+    HotQuery("offered_deliveries", "ussd.list_offered_deliveries_for_rider", ussd._OFFERED_DELIVERIES_SQL, (PHONE, 5)),
+    HotQuery("my_active_deliveries", "ussd.list_my_active_deliveries", ussd._MY_ACTIVE_DELIVERIES_SQL, (PHONE, 5)),
+    HotQuery("open_deliveries", "ussd.list_open_deliveries", ussd._OPEN_DELIVERIES_SQL, (8,)),
+    HotQuery("landmark_added_today", "ussd._added_landmark_today", ussd._LANDMARK_ADDED_TODAY_SQL, (PHONE,)),
+    HotQuery("landmark_names", "ussd.handle_set_location", ussd._LANDMARK_NAMES_SQL, ("Bumala",)),
+
+    # --- dashboard polling (app.py) ---
+    HotQuery("state_riders", "app.api_state", _app_sql("_STATE_RIDERS_SQL")),
+    HotQuery("panel_businesses", "app.api_panels", _app_sql("_PANEL_BUSINESSES_SQL")),
+    HotQuery("panel_latest_deliveries", "app.api_panels", _app_sql("_PANEL_LATEST_DELIVERIES_SQL"),
+             allow_scan={"delivery_requests": "newest-first rowid walk, stops after LIMIT"}),
+    HotQuery("panel_open_deliveries", "app.api_panels", _app_sql("_PANEL_OPEN_DELIVERIES_SQL")),
+]
+
+
+_SCAN = re.compile(r"^SCAN (\S+)")
+_SUBQUERY = re.compile(r"^(?:CO-ROUTINE|MATERIALIZE) (\S+)")
+
+def plan(conn: sqlite3.Connection, sql: str, params: tuple = ()) -> List[str]:
+    return [r[3] for r in conn.execute("EXPLAIN QUERY PLAN " + sql, params).fetchall()]
+
+def scans(steps: List[str], allow: Dict[str, str]) -> List[str]:
+    """Plan steps that read a whole table (or index) and are not allowed."""
+    subqueries = {m.group(1) for m in map(_SUBQUERY.match, steps) if m}
+    bad = []
+    for s in steps:
+        m = _SCAN.match(s)
+        if not m or s.startswith("SCAN CONSTANT ROW"):
+            continue
+        name = m.group(1)
+        if name in subqueries or name in allow:
+            continue
+        bad.append(s)
+    return bad
+
+
+def check(db_path: str) -> List[Tuple[HotQuery, List[str], List[str]]]:
+    """(query, plan steps, failures) per registered query; failures may hold an error."""
+    conn = sqlite3.connect(str(db_path))
+    cold_archive.create_keep_tables(conn)       # TEMP tables the cold batches read
+    results = []
+    try:
+        for q in QUERIES:
+            try:
+                steps = plan(conn, q.sql, q.params)
+            except sqlite3.Error as e:
+                results.append((q, [], [f"ERROR {e}"]))
+                continue
+            results.append((q, steps, scans(steps, q.allow_scan)))
+    finally:
+        conn.close()
+    return results
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Fail when a hot query does a full table scan")
+    ap.add_argument("--db", default=DEFAULT_DB)
+    ap.add_argument("--fresh", action="store_true", help="check a new temp DB at the latest migration")
+    ap.add_argument("--verbose", action="store_true", help="print every plan")
+    args = ap.parse_args()
+
+    if args.fresh:
+        db_path = os.path.join(tempfile.mkdtemp(prefix="query_plans_"), "plans.db")
+        migrations.migrate(db_path)
+    else:
+        db_path = args.db
+        conn = sqlite3.connect(db_path)
+        v = migrations.current_version(conn)
+        conn.close()
+        if v < migrations.LATEST_VERSION:
+            print(f"note: {db_path} is at schema v{v} (latest v{migrations.LATEST_VERSION})")
+
+    results = check(db_path)
+    failed = 0
+    for q, steps, bad in results:
+        sort = any("USE TEMP B-TREE" in s for s in steps)
+        status = "FAIL" if bad else "ok  "
+        print(f"{status} {q.name:<24} {q.where}{'  (sorts in temp b-tree)' if sort and not bad else ''}")
+        for s in bad:
+            print(f"       {s}")
+        if args.verbose:
+            for s in steps:
+                print(f"       | {s}")
+            for table, why in q.allow_scan.items():
+                print(f"       scan of {table} allowed: {why}")
+        failed += bool(bad)
+
+    print(f"{len(results)} queries, {failed} with a full scan")
+    if failed:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,232 @@
+"""
+session_state.py
+
+Per-USSD-session state, so each step only does its incremental work.
+
+Africa's Talking resends the whole path (`1*2*3`) on every step; handlers
+still parse it (the path stays the source of truth), but resolved lists
+and lookups are cached under the sessionId:
+
+    services = session_state.memo(session_id, "services", load_services)
+
+Stores (ANGELOPP_SESSION_STORE):
+- "memory" (default): in-process LRU with TTL. A step that lands on another
+  gunicorn worker simply misses and recomputes.
+- "sqlite": small shared file (ANGELOPP_SESSION_DB) so all workers on the
+  box see the same session state. Values must be JSON-serialisable.
+
+Numbered menus store the exact list they rendered (snapshot_put, ids or
+short keys only) and resolve the user's choice from it (snapshot_pick):
+no second query, and numbering cannot shift under concurrent inserts.
+
+Sessions are dropped on END (end()) or after TTL_SECONDS.
+"""
+
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import dbpool
+
+STORE = os.environ.get("ANGELOPP_SESSION_STORE", "memory").strip().lower()
+SESSION_DB = os.environ.get("ANGELOPP_SESSION_DB", "/tmp/angelopp_sessions.db")
+TTL_SECONDS = float(os.environ.get("ANGELOPP_SESSION_TTL", "300"))   # AT sessions are <= 180s
+MAX_SESSIONS = int(os.environ.get("ANGELOPP_SESSION_MAX", "5000"))
+
+_MISSING = object()
+
+
+class MemoryStore:
+    """LRU of sessions; each session is a small dict with a shared expiry."""
+
+    def __init__(self, ttl: float = TTL_SECONDS, max_sessions: int = MAX_SESSIONS):
+        self.ttl = float(ttl)
+        self.max_sessions = int(max_sessions)
+        self._lock = threading.Lock()
+        self._data: "OrderedDict[str, tuple]" = OrderedDict()   # sid -> (expires_at, {key: value})
+
+    def _session(self, sid: str, create: bool) -> Optional[Dict[str, Any]]:
+        now = time.time()
+        item = self._data.get(sid)
+        if item is not None and item[0] < now:
+            del self._data[sid]
+            item = None
+        if item is None:
+            if not create:
+                return None
+            item = (now + self.ttl, {})
+            self._data[sid] = item
+            while len(self._data) > self.max_sessions:
+                self._data.popitem(last=False)
+        else:
+            self._data.move_to_end(sid)
+        return item[1]
+
+    def get(self, sid: str, key: str, default: Any = None) -> Any:
+        with self._lock:
+            s = self._session(sid, create=False)
+            return default if s is None else s.get(key, default)
+
+    def put(self, sid: str, key: str, value: Any) -> None:
+        with self._lock:
+            self._session(sid, create=True)[key] = value
+
+    def drop(self, sid: str, key: Optional[str] = None) -> None:
+        with self._lock:
+            if key is None:
+                self._data.pop(sid, None)
+            else:
+                s = self._session(sid, create=False)
+                if s is not None:
+                    s.pop(key, None)
+
+
+class SqliteStore:
+    """Shared across processes on one box (own file, not bumala.db)."""
+
+    def __init__(self, path: str = SESSION_DB, ttl: float = TTL_SECONDS):
+        self.path = str(path)
+        self.ttl = float(ttl)
+        self._ready = False
+        self._puts = 0
+
+    def _conn(self):
+        conn = dbpool.connect(self.path)
+        if not self._ready:
+            conn.execute("""
+            CREATE TABLE IF NOT EXISTS session_state (
+                session_id TEXT NOT NULL,
+                key TEXT NOT NULL,
+                value TEXT NOT NULL,
+                expires_at REAL NOT NULL,
+                PRIMARY KEY (session_id, key)
+            ) WITHOUT ROWID
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_session_state_exp ON session_state(expires_at)")
+            conn.commit()
+            self._ready = True
+        return conn
+
+    def get(self, sid: str, key: str, default: Any = None) -> Any:
+        conn = self._conn()
+        row = conn.execute(
+            "SELECT value FROM session_state WHERE session_id=? AND key=? AND expires_at>=?",
+            (sid, key, time.time())
+        ).fetchone()
+        conn.close()
+        return default if row is None else json.loads(row[0])
+
+    def put(self, sid: str, key: str, value: Any) -> None:
+        now = time.time()
+        conn = self._conn()
+        conn.execute(
+            "INSERT OR REPLACE INTO session_state(session_id, key, value, expires_at) VALUES (?,?,?,?)",
+            (sid, key, json.dumps(value, separators=(",", ":")), now + self.ttl)
+        )
+        self._puts += 1
+        if self._puts % 500 == 0:
+            conn.execute("DELETE FROM session_state WHERE expires_at < ?", (now,))
+        conn.commit()
+        conn.close()
+
+    def drop(self, sid: str, key: Optional[str] = None) -> None:
+        conn = self._conn()
+        if key is None:
+            conn.execute("DELETE FROM session_state WHERE session_id=?", (sid,))
+        else:
+            conn.execute("DELETE FROM session_state WHERE session_id=? AND key=?", (sid, key))
+        conn.commit()
+        conn.close()
+
+
+_store = SqliteStore() if STORE == "sqlite" else MemoryStore()
+
+def set_store(store) -> None:
+    global _store
+    _store = store
+
+
+# =========================
+# API (sessionless calls are no-ops / cache misses)
+# =========================
+def get(session_id: Optional[str], key: str, default: Any = None) -> Any:
+    if not session_id:
+        return default
+    try:
+        return _store.get(session_id, key, default)
+    except Exception as e:
+        print("session_state get failed:", e)
+        return default
+
+
+def put(session_id: Optional[str], key: str, value: Any) -> None:
+    if not session_id:
+        return
+    try:
+        _store.put(session_id, key, value)
+    except Exception as e:
+        print("session_state put failed:", e)
+
+
+def drop(session_id: Optional[str], key: Optional[str] = None) -> None:
+    if not session_id:
+        return
+    try:
+        _store.drop(session_id, key)
+    except Exception as e:
+        print("session_state drop failed:", e)
+
+
+def memo(session_id: Optional[str], key: str, loader: Callable[[], Any]) -> Any:
+    """Cached value for this session, or loader() (stored for the next step)."""
+    value = get(session_id, key, _MISSING)
+    if value is not _MISSING:
+        return value
+    value = loader()
+    put(session_id, key, value)
+    return value
+
+
+# =========================
+# List snapshots for numbered menus
+# =========================
+def snapshot_put(session_id: Optional[str], menu: str, keys: List[Any]) -> None:
+    """Remember what menu `menu` showed: keys[i] is option i+1 (ids / short strings)."""
+    put(session_id, "snap:" + menu, list(keys))
+
+
+def snapshot_get(session_id: Optional[str], menu: str) -> Optional[List[Any]]:
+    """The rendered list, or None (no session, expired, or other worker's memory)."""
+    return get(session_id, "snap:" + menu)
+
+
+def snapshot_pick(session_id: Optional[str], menu: str, choice: Any) -> Tuple[bool, Any]:
+    """
+    Resolve a 1-based choice against the snapshot.
+    Returns (have_snapshot, key): key is None when the choice is out of range.
+    Callers re-query only when have_snapshot is False.
+    """
+    keys = snapshot_get(session_id, menu)
+    if keys is None:
+        return (False, None)
+    try:
+        n = int(str(choice).strip())
+    except Exception:
+        return (True, None)
+    if n < 1 or n > len(keys):
+        return (True, None)
+    return (True, keys[n - 1])
+
+
+def end(session_id: Optional[str], response: Any) -> Any:
+    """Pass-through for a handler's response; drops the session on END."""
+    try:
+        body = response[0] if isinstance(response, tuple) else response
+        if isinstance(body, str) and body.startswith("END"):
+            drop(session_id)
+    except Exception:
+        pass
+    return response
@@ -0,0 +1,311 @@
+#!/usr/bin/env python3
+"""
+travel_matrix.py
+
+Landmark-to-landmark travel minutes per village, between canonical
+landmark ids (landmark_index).
+
+Sources (table `travel_times`, migrations.py v6):
+- "sacco":   values entered by the SACCO (seed, --seed)
+- "learned": median job time from completed jobs: assignments.assigned_at
+             (provider at assignments.from_landmark) -> service_requests.closed_at
+             (customer landmark); needs MIN_SAMPLES jobs per pair
+
+build() writes one compact file per village:
+    header  b"ATM1" + uint32 n
+    ids     n x int32 (canonical landmark ids, sorted)
+    minutes n*n x uint16, row = from, col = to, 0xFFFF = unknown
+Readers mmap the file; minutes(from_id, to_id) is a dict lookup plus one
+array read. A rebuilt file is picked up via its mtime (os.replace keeps
+readers safe).
+
+CLI (cron, like outixs_outbox.py):
+    python travel_matrix.py --db /opt/angelopp/data/bumala.db --build
+    python travel_matrix.py --db ... --village Bumala --seed "Market Gate" "Water Pump" 6
+    python travel_matrix.py --db ... --village Bumala --show
+"""
+
+import argparse
+import mmap
+import os
+import re
+import statistics
+import struct
+import threading
+import time
+from array import array
+from typing import Dict, List, Optional, Tuple
+
+import dbpool
+import landmark_index
+
+DEFAULT_DB = os.environ.get("ANGELOPP_DB", "/opt/angelopp/data/bumala.db")
+MATRIX_DIR = os.environ.get("ANGELOPP_TRAVEL_DIR", "")   # default: <db dir>/travel
+MIN_SAMPLES = int(os.environ.get("ANGELOPP_TRAVEL_MIN_SAMPLES", "3"))
+MAX_MINUTES = 180           # longer "jobs" are forgotten closes, not travel
+RELOAD_SECONDS = 5.0
+
+MAGIC = b"ATM1"
+UNKNOWN = 0xFFFF
+_HEADER = struct.Struct("<4sI")
+
+
+def matrix_dir(db_path) -> str:
+    return MATRIX_DIR or os.path.join(os.path.dirname(os.path.abspath(str(db_path))), "travel")
+
+
+def matrix_path(db_path, village: str) -> str:
+    slug = re.sub(r"[^a-z0-9]+", "_", (village or "").strip().lower()).strip("_") or "default"
+    return os.path.join(matrix_dir(db_path), f"{slug}.tm")
+
+
+# =========================
+# Reader
+# =========================
+class TravelMatrix:
+    def __init__(self, path: str):
+        self.path = path
+        self.mtime = os.stat(path).st_mtime
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, n = _HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path}: not a travel matrix")
+        self.n = n
+        ids_at = _HEADER.size
+        cells_at = ids_at + 4 * n
+        ids = memoryview(self._mm)[ids_at:cells_at].cast("i")
+        self.index: Dict[int, int] = {int(lid): i for i, lid in enumerate(ids)}
+        ids.release()
+        self._cells = memoryview(self._mm)[cells_at:cells_at + 2 * n * n].cast("H")
+
+    def minutes(self, from_id: Optional[int], to_id: Optional[int]) -> Optional[int]:
+        i = self.index.get(from_id)
+        j = self.index.get(to_id)
+        if i is None or j is None:
+            return None
+        v = self._cells[i * self.n + j]
+        return None if v == UNKNOWN else int(v)
+
+    def close(self) -> None:
+        try:
+            self._cells.release()
+            self._mm.close()
+        except Exception:
+            pass
+
+
+_MATRICES: Dict[Tuple[str, str], Tuple[float, Optional[TravelMatrix]]] = {}
+_LOCK = threading.Lock()
+
+def get_matrix(db_path, village: Optional[str]) -> Optional[TravelMatrix]:
+    """Mapped matrix for this village, or None (not built yet)."""
+    v = (village or "").strip()
+    if not v:
+        return None
+    key = (str(db_path), v)
+    now = time.time()
+    item = _MATRICES.get(key)
+    if item is not None and now - item[0] < RELOAD_SECONDS:
+        return item[1]
+    with _LOCK:
+        item = _MATRICES.get(key)
+        if item is not None and now - item[0] < RELOAD_SECONDS:
+            return item[1]
+        old = item[1] if item else None
+        path = matrix_path(db_path, v)
+        tm = old
+        try:
+            mtime = os.stat(path).st_mtime
+            if old is None or old.mtime != mtime:
+                tm = TravelMatrix(path)
+        except FileNotFoundError:
+            tm = None
+        except Exception as e:
+            print("travel_matrix load failed:", e)
+        # old mapping is left to GC: a reader may still hold it
+        _MATRICES[key] = (now, tm)
+        return tm
+
+
+def lookup(db_path, village: Optional[str], from_id: Optional[int], to_id: Optional[int]) -> Optional[int]:
+    if from_id is None or to_id is None:
+        return None
+    tm = get_matrix(db_path, village)
+    return tm.minutes(from_id, to_id) if tm is not None else None
+
+
+def eta_between(db_path, village: Optional[str], frm: landmark_index.Resolved,
+                to: landmark_index.Resolved) -> int:
+    """Travel minutes between two resolved landmarks: matrix, else the cheap heuristic."""
+    if not frm.norm or not to.norm:
+        return 12
+    known = lookup(db_path, village, frm.id, to.id)
+    if known is not None:
+        return known
+    if frm.same_place(to):
+        return 2
+    # same first word heuristic
+    if frm.norm.split(" ")[0] == to.norm.split(" ")[0]:
+        return 5
+    return 9
+
+
+def eta_minutes(db_path, village: Optional[str], from_landmark: Optional[str], to_landmark: Optional[str]) -> int:
+    ix = landmark_index.get_index(db_path)
+    return eta_between(db_path, village, ix.lookup(village, from_landmark), ix.lookup(village, to_landmark))
+
+
+# =========================
+# Builder
+# =========================
+def _learned(conn, vi: landmark_index.VillageIndex, village: str) -> Dict[Tuple[int, int], List[float]]:
+    rows = conn.execute("""
+    SELECT a.from_landmark, sr.landmark,
+           (julianday(sr.closed_at) - julianday(a.assigned_at)) * 1440.0 AS minutes
+    FROM service_requests sr
+    JOIN assignments a ON a.request_id = sr.id
+    WHERE sr.village=? AND sr.status='CLOSED' AND sr.closed_at IS NOT NULL
+      AND a.from_landmark IS NOT NULL AND a.from_landmark != '' AND sr.landmark != ''
+    """, (village,)).fetchall()
+    out: Dict[Tuple[int, int], List[float]] = {}
+    for frm, to, minutes in rows:
+        if minutes is None or minutes <= 0 or minutes > MAX_MINUTES:
+            continue
+        a, b = vi.resolve(frm), vi.resolve(to)
+        if a is None or b is None:
+            continue
+        out.setdefault((a, b), []).append(float(minutes))
+    return out
+
+
+def build(db_path, village: str) -> Dict[str, int]:
+    """Refresh learned rows for `village`, then write its matrix file."""
+    village = (village or "").strip()
+    vi = landmark_index.get_index(db_path).village(village)
+    if vi is None:
+        return {"landmarks": 0, "pairs": 0, "learned": 0}
+
+    conn = dbpool.connect(db_path)
+    try:
+        learned = _learned(conn, vi, village)
+        conn.execute("DELETE FROM travel_times WHERE village=? AND source='learned'", (village,))
+        conn.executemany(
+            "INSERT INTO travel_times(village, from_id, to_id, source, minutes, samples) "
+            "VALUES (?,?,?,'learned',?,?)",
+            [(village, a, b, statistics.median(v), len(v))
+             for (a, b), v in learned.items() if len(v) >= MIN_SAMPLES]
+        )
+        conn.commit()
+        rows = conn.execute(
+            "SELECT from_id, to_id, source, minutes FROM travel_times WHERE village=?", (village,)
+        ).fetchall()
+    finally:
+        conn.close()
+
+    # learned beats sacco; canonicalize ids (landmarks may have merged since)
+    cells: Dict[Tuple[int, int], Tuple[int, float]] = {}
+    for frm, to, source, minutes in rows:
+        a, b = vi.canonical.get(int(frm)), vi.canonical.get(int(to))
+        if a is None or b is None:
+            continue
+        rank = 1 if source == "learned" else 0
+        if (a, b) not in cells or rank > cells[(a, b)][0]:
+            cells[(a, b)] = (rank, float(minutes))
+
+    ids = sorted(vi.names)
+    pos = {lid: i for i, lid in enumerate(ids)}
+    n = len(ids)
+    grid = array("H", [UNKNOWN]) * (n * n)
+    for (a, b), (_, minutes) in cells.items():
+        m = max(1, min(int(round(minutes)), UNKNOWN - 1))
+        grid[pos[a] * n + pos[b]] = m
+        if (b, a) not in cells:
+            grid[pos[b] * n + pos[a]] = m      # roads go both ways unless measured
+
+    path = matrix_path(db_path, village)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(_HEADER.pack(MAGIC, n))
+        f.write(array("i", ids).tobytes())
+        f.write(grid.tobytes())
+    os.replace(tmp, path)
+    with _LOCK:
+        _MATRICES.pop((str(db_path), village), None)
+    return {"landmarks": n, "pairs": len(cells),
+            "learned": sum(1 for v in learned.values() if len(v) >= MIN_SAMPLES)}
+
+
+def build_all(db_path) -> Dict[str, Dict[str, int]]:
+    conn = dbpool.connect(db_path)
+    try:
+        villages = [r[0] for r in conn.execute(
+            "SELECT DISTINCT village FROM landmarks WHERE village IS NOT NULL AND village != ''"
+        ).fetchall()]
+    finally:
+        conn.close()
+    return {v: build(db_path, v) for v in villages}
+
+
+def seed(db_path, village: str, from_landmark: str, to_landmark: str, minutes: float) -> Tuple[int, int]:
+    """SACCO-entered travel time between two known landmarks."""
+    vi = landmark_index.get_index(db_path).village(village)
+    a = vi.resolve(from_landmark) if vi is not None else None
+    b = vi.resolve(to_landmark) if vi is not None else None
+    if a is None or b is None:
+        raise ValueError(f"unknown landmark in {village}: {from_landmark if a is None else to_landmark}")
+    conn = dbpool.connect(db_path)
+    try:
+        conn.execute(
+            "INSERT INTO travel_times(village, from_id, to_id, source, minutes, samples) "
+            "VALUES (?,?,?,'sacco',?,0) "
+            "ON CONFLICT(village, from_id, to_id, source) DO UPDATE SET "
+            "minutes=excluded.minutes, updated_at=datetime('now')",
+            ((village or "").strip(), a, b, float(minutes))
+        )
+        conn.commit()
+    finally:
+        conn.close()
+    return (a, b)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Build / seed / show landmark travel-time matrices")
+    ap.add_argument("--db", default=DEFAULT_DB)
+    ap.add_argument("--village", help="default for --build: all villages")
+    ap.add_argument("--build", action="store_true")
+    ap.add_argument("--seed", nargs=3, metavar=("FROM", "TO", "MINUTES"))
+    ap.add_argument("--show", action="store_true")
+    args = ap.parse_args()
+
+    import migrations
+    migrations.ensure_current(args.db)
+
+    if args.seed:
+        if not args.village:
+            ap.error("--seed needs --village")
+        a, b = seed(args.db, args.village, args.seed[0], args.seed[1], float(args.seed[2]))
+        print(f"seeded {args.village}: {a} -> {b} = {args.seed[2]} min")
+
+    if args.build:
+        results = {args.village: build(args.db, args.village)} if args.village else build_all(args.db)
+        for v, r in results.items():
+            print(f"{v}: {r['landmarks']} landmarks, {r['pairs']} pairs ({r['learned']} learned) -> {matrix_path(args.db, v)}")
+
+    if args.show:
+        if not args.village:
+            ap.error("--show needs --village")
+        tm = get_matrix(args.db, args.village)
+        vi = landmark_index.get_index(args.db).village(args.village)
+        if tm is None or vi is None:
+            print("no matrix (run --build)")
+            return
+        for a in sorted(tm.index):
+            for b in sorted(tm.index):
+                m = tm.minutes(a, b)
+                if m is not None:
+                    print(f"{vi.names.get(a, a)} -> {vi.names.get(b, b)}: {m} min")
+
+if __name__ == "__main__":
+    main()
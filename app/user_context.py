@@ -0,0 +1,140 @@
+"""
+user_context.py
+
+Everything the USSD entry point needs to know about the caller, in ONE
+query: user_prefs (role / area / landmark / village), user_roles (any
+phone variant) and the providers row.
+
+    ctx = user_context.for_session(DB_PATH, session_id, phone)
+    ctx.onboarded, ctx.prefs, ctx.effective_role(), ctx.village_or("Church")
+
+Onboarded contexts are cached per session (session_state). Code that
+changes prefs/role in a session calls invalidate(session_id).
+"""
+
+from dataclasses import asdict, dataclass
+from typing import Any, Dict, List, Optional
+
+import dbpool
+import session_state
+
+_KEY = "user_ctx"
+ROLES = ("provider", "customer", "traveler")
+
+_SQL = """
+SELECT
+    up.phone     AS prefs_phone,
+    up.role      AS role,
+    up.area_type AS area_type,
+    up.landmark  AS landmark,
+    up.village   AS village,
+    (SELECT ur.role FROM user_roles ur
+     WHERE ur.phone IN (?, ?, ?)
+     ORDER BY CASE ur.phone WHEN ? THEN 0 WHEN ? THEN 1 ELSE 2 END
+     LIMIT 1)    AS db_role,
+    pr.phone            AS provider_phone,
+    pr.provider_type    AS provider_type,
+    pr.name             AS provider_name,
+    pr.village          AS provider_village,
+    pr.current_landmark AS provider_landmark,
+    pr.is_available     AS provider_available
+FROM (SELECT ? AS phone) me
+LEFT JOIN user_prefs up ON up.phone = me.phone
+LEFT JOIN providers pr ON pr.phone = me.phone
+"""
+
+
+@dataclass
+class UserContext:
+    phone: str
+    role: Optional[str] = None          # user_prefs.role (onboarding)
+    area_type: Optional[str] = None
+    landmark: Optional[str] = None
+    village: Optional[str] = None
+    db_role: Optional[str] = None       # user_roles.role
+    provider: Optional[Dict[str, Any]] = None
+    has_prefs: bool = False
+
+    @property
+    def onboarded(self) -> bool:
+        return bool(self.role and self.area_type and self.landmark)
+
+    @property
+    def prefs(self) -> Dict[str, Any]:
+        """Same shape as onboarding.get_prefs()."""
+        return {
+            "phone": self.phone,
+            "role": self.role,
+            "area_type": self.area_type,
+            "landmark": self.landmark,
+            "village": self.village,
+        }
+
+    def effective_role(self, default: str = "customer") -> str:
+        # user_roles wins over prefs (cockpit / role switch write it)
+        rdb = (self.db_role or "").strip().lower()
+        if rdb in ROLES:
+            return rdb
+        return (self.role or default).strip().lower()
+
+    def village_or(self, fallback: str = "Church") -> str:
+        return (self.village or "").strip() or fallback
+
+
+def _variants(phone: str) -> List[str]:
+    p = (phone or "").strip()
+    d = p.lstrip("+")
+    out = []
+    for x in [p, d, ("+" + d if d else "")]:
+        if x and x not in out:
+            out.append(x)
+    while len(out) < 3:
+        out.append(out[-1] if out else "")
+    return out
+
+
+def load(db_path, phone: str) -> UserContext:
+    v = _variants(phone)
+    conn = dbpool.connect(db_path)
+    try:
+        row = conn.execute(_SQL, (v[0], v[1], v[2], v[0], v[1], phone)).fetchone()
+    finally:
+        conn.close()
+
+    ctx = UserContext(phone=phone)
+    if row is None:
+        return ctx
+    ctx.has_prefs = row["prefs_phone"] is not None
+    ctx.role = row["role"]
+    ctx.area_type = row["area_type"]
+    ctx.landmark = row["landmark"]
+    ctx.village = row["village"]
+    ctx.db_role = row["db_role"]
+    if row["provider_phone"] is not None:
+        ctx.provider = {
+            "phone": row["provider_phone"],
+            "provider_type": row["provider_type"],
+            "name": row["provider_name"],
+            "village": row["provider_village"],
+            "current_landmark": row["provider_landmark"],
+            "is_available": row["provider_available"],
+        }
+    return ctx
+
+
+def for_session(db_path, session_id: Optional[str], phone: str) -> UserContext:
+    """Cached context for this session (only once onboarded), else a fresh load."""
+    cached = session_state.get(session_id, _KEY)
+    if isinstance(cached, dict) and cached.get("phone") == phone:
+        try:
+            return UserContext(**cached)
+        except TypeError:
+            pass
+    ctx = load(db_path, phone)
+    if ctx.onboarded:
+        session_state.put(session_id, _KEY, asdict(ctx))
+    return ctx
+
+
+def invalidate(session_id: Optional[str]) -> None:
+    session_state.drop(session_id, _KEY)
@@ -1,7 +1,5 @@
 from __future__ import annotations
 from pathlib import Path
-# --- Relative distance engine ---
-from relative_distance import PersonLocation, rank_drivers
 
 
 
@@ -52,11 +50,13 @@ MAX_LIST = 10
 # FAIRNESS_INTEGRATION_V1 (safe, optional)
 # ============================================================
 try:
-    from policies.fairness import Candidate, PolicyWeights, rank_candidates
+    from policies.fairness import Candidate, PolicyWeights, rank_candidates, score_batch, short_explanation
 except Exception:
     Candidate = None
     PolicyWeights = None
     rank_candidates = None
+    score_batch = None
+    short_explanation = None
 
 try:
     from adapters.payments_adapter import DummyPaymentsAdapter
@@ -204,8 +204,7 @@ def _rank_riders_if_possible(riders):
     return out
 
 def save_landmark(phone: str, name: str, description: str):
-    import sqlite3
-    db = sqlite3.connect(DB_PATH)
+    db = dbpool.connect(DB_PATH)
     cur = db.cursor()
     cur.execute(
         "INSERT INTO landmarks (phone, name, description) VALUES (?, ?, ?)",
@@ -224,13 +223,7 @@ def connect_db():
     Compatibility helper used by newer features (delivery/public).
     Always connects to the single DB_PATH used by the whole app.
     """
-    import sqlite3
-    conn = sqlite3.connect(DB_PATH)
-    try:
-        conn.row_factory = sqlite3.Row
-    except Exception:
-        pass
-    return conn
+    return dbpool.connect(DB_PATH)
 
 
 ### DELIVERY_STATUS_HELPERS_V1 ###
@@ -247,38 +240,42 @@ def set_delivery_offer(delivery_id: int, rider_phone: str) -> None:
     con.commit()
     con.close()
 
+_OFFERED_DELIVERIES_SQL = """
+SELECT id, source_type, source_phone,
+       pickup_village, pickup_landmark,
+       dropoff_village, dropoff_landmark,
+       note, status, created_at
+FROM delivery_requests
+WHERE status='offered'
+  AND assigned_rider_phone=?
+ORDER BY id DESC
+LIMIT ?
+"""
+
 def list_offered_deliveries_for_rider(rider_phone: str, limit: int = 5):
     con = connect_db()
     cur = con.cursor()
-    cur.execute("""
-        SELECT id, source_type, source_phone,
-               pickup_village, pickup_landmark,
-               dropoff_village, dropoff_landmark,
-               note, status, created_at
-        FROM delivery_requests
-        WHERE status='offered'
-          AND assigned_rider_phone=?
-        ORDER BY id DESC
-        LIMIT ?
-    """, (rider_phone or "", int(limit)))
+    cur.execute(_OFFERED_DELIVERIES_SQL, (rider_phone or "", int(limit)))
     rows = cur.fetchall()
     con.close()
     return rows
 
+_MY_ACTIVE_DELIVERIES_SQL = """
+SELECT id, source_type, source_phone,
+       pickup_village, pickup_landmark,
+       dropoff_village, dropoff_landmark,
+       note, status, created_at
+FROM delivery_requests
+WHERE assigned_rider_phone=?
+  AND status IN ('accepted','picked_up')
+ORDER BY id DESC
+LIMIT ?
+"""
+
 def list_my_active_deliveries(rider_phone: str, limit: int = 5):
     con = connect_db()
     cur = con.cursor()
-    cur.execute("""
-        SELECT id, source_type, source_phone,
-               pickup_village, pickup_landmark,
-               dropoff_village, dropoff_landmark,
-               note, status, created_at
-        FROM delivery_requests
-        WHERE assigned_rider_phone=?
-          AND status IN ('accepted','picked_up')
-        ORDER BY id DESC
-        LIMIT ?
-    """, (rider_phone or "", int(limit)))
+    cur.execute(_MY_ACTIVE_DELIVERIES_SQL, (rider_phone or "", int(limit)))
     rows = cur.fetchall()
     con.close()
     return rows
@@ -322,11 +319,9 @@ def get_delivery(delivery_id: int):
 ### DELIVERY_REQUEST_HELPERS_V1 ###
 def _db_connect():
     # Prefer environment DB if present, else fall back to DB_PATH
-    import os, sqlite3
+    import os
     dbp = os.environ.get("ANGELOPP_DB", "") or DB_PATH
-    con = sqlite3.connect(dbp)
-    con.row_factory = sqlite3.Row
-    return con
+    return dbpool.connect(dbp)
 
 def create_delivery_request(source_type: str, source_phone: str,
                             pickup_village: str, pickup_landmark: str,
@@ -410,6 +405,14 @@ import re
 
 # Onboarding gate (role -> area -> landmark)
 import onboarding
+import dbpool
+import fairness_state
+import landmark_index
+import migrations
+import provider_roster
+import session_state
+import user_context
+import ussd_router
 
 import os
 DB_PATH = os.environ.get("ANGELOPP_DB", "/opt/angelopp/data/bumala.db")
@@ -447,15 +450,16 @@ def create_delivery_request(source_type: str, source_phone: str,
     rid = _db_query("SELECT last_insert_rowid() AS id")[0]["id"]
     return int(rid)
 
+_OPEN_DELIVERIES_SQL = """
+SELECT id, source_type, pickup_landmark, dropoff_landmark, note, created_at
+FROM delivery_requests
+WHERE status IN ('new','offered')
+ORDER BY id DESC
+LIMIT ?
+"""
+
 def list_open_deliveries(limit: int=8):
-    return _db_query(
-        """SELECT id, source_type, pickup_landmark, dropoff_landmark, note, created_at
-            FROM delivery_requests
-            WHERE status IN ('new','offered')
-            ORDER BY id DESC
-            LIMIT ?""",
-        (int(limit),)
-    )
+    return _db_query(_OPEN_DELIVERIES_SQL, (int(limit),))
 
 def accept_delivery(delivery_id: int, rider_phone: str):
     _db_exec(
@@ -481,30 +485,8 @@ def mask_phone_public(phone: str) -> str:
 # ============================================================
 
 def ensure_user_prefs(conn: sqlite3.Connection) -> None:
-    cur = conn.cursor()
-    cur.execute("""
-    CREATE TABLE IF NOT EXISTS user_prefs (
-        phone TEXT PRIMARY KEY,
-        role TEXT NOT NULL DEFAULT 'customer',
-        village TEXT NOT NULL DEFAULT 'Church',
-        created_at TEXT NOT NULL DEFAULT (datetime('now')),
-        updated_at TEXT NOT NULL DEFAULT (datetime('now'))
-    );
-    """)
-    # migration: add missing columns safely (older DBs)
-    try:
-        cur.execute("ALTER TABLE user_prefs ADD COLUMN village TEXT NOT NULL DEFAULT 'Church';")
-    except Exception:
-        pass
-    try:
-        cur.execute("ALTER TABLE user_prefs ADD COLUMN created_at TEXT NOT NULL DEFAULT (datetime('now'));")
-    except Exception:
-        pass
-    try:
-        cur.execute("ALTER TABLE user_prefs ADD COLUMN updated_at TEXT NOT NULL DEFAULT (datetime('now'));")
-    except Exception:
-        pass
-    conn.commit()
+    # user_prefs (+ village column for older DBs) lives in migrations.py
+    migrations.ensure_current(DB_PATH)
 
 def provider_home_menu() -> str:
     lines = [
@@ -552,70 +534,16 @@ def _clean_text(s: str, max_len: int) -> str:
     return s[:max_len].strip()
 
 def ensure_challenge_schema():
-    conn = db()
-    cur = conn.cursor()
-
-    cur.execute("""
-    CREATE TABLE IF NOT EXISTS daily_claims (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        phone TEXT NOT NULL,
-        claim_date TEXT NOT NULL,
-        created_at TEXT NOT NULL DEFAULT (datetime('now')),
-        UNIQUE(phone, claim_date)
-    )
-    """)
-
-    cur.execute("""
-    CREATE TABLE IF NOT EXISTS landmarks (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        phone TEXT NOT NULL,
-        village TEXT NOT NULL DEFAULT 'Bumala',
-        name TEXT NOT NULL,
-        description TEXT NOT NULL,
-        created_at TEXT NOT NULL DEFAULT (datetime('now'))
-    )
-    """)
-
-    cur.execute("""
-    CREATE TABLE IF NOT EXISTS points_ledger (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        phone TEXT NOT NULL,
-        pts INTEGER NOT NULL,
-        reason TEXT NOT NULL,
-        created_at TEXT NOT NULL DEFAULT (datetime('now'))
-    )
-    """)
-
-    conn.commit()
-    conn.close()
+    migrations.ensure_current(DB_PATH)
 
 
 
 def ensure_messages(conn: sqlite3.Connection) -> None:
     """
-    Ensure messages table exists with a 'text' column.
-    Safe migrations: if table exists but text missing, add it.
+    messages table (with 'text' + 'category') is created by migrations.py;
+    this is a no-op after the first call in this process.
     """
-    cur = conn.cursor()
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS messages (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            channel_id INTEGER NOT NULL,
-            category TEXT NOT NULL DEFAULT '',
-            author_phone TEXT NOT NULL DEFAULT '',
-            text TEXT NOT NULL DEFAULT '',
-            created_at TEXT NOT NULL DEFAULT (datetime('now'))
-        );
-    """)
-    cur.execute("PRAGMA table_info(messages);")
-    cols = [r[1] for r in cur.fetchall()]
-    if "text" not in cols:
-        try: cur.execute("ALTER TABLE messages ADD COLUMN text TEXT NOT NULL DEFAULT '';")
-        except Exception: pass
-    if "category" not in cols:
-        try: cur.execute("ALTER TABLE messages ADD COLUMN category TEXT NOT NULL DEFAULT '';")
-        except Exception: pass
-    conn.commit()
+    migrations.ensure_current(DB_PATH)
 
 def _add_points(phone: str, pts: int, reason: str):
     conn = db()
@@ -642,24 +570,22 @@ def _mark_claim_today(phone: str) -> bool:
     conn.close()
     return ok
 
+_LANDMARK_ADDED_TODAY_SQL = """
+SELECT 1
+FROM landmarks
+WHERE phone = ?
+  AND date(created_at) = date('now')
+LIMIT 1
+"""
+
 def _added_landmark_today(phone: str) -> bool:
     """Return True if this phone already added a landmark today.
     Uses absolute DB path to avoid 'wrong working directory' surprises.
     """
-    import sqlite3
-    db = sqlite3.connect(DB_PATH)
+    db = dbpool.connect(DB_PATH)
     try:
         cur = db.cursor()
-        cur.execute(
-            """
-            SELECT 1
-            FROM landmarks
-            WHERE phone = ?
-              AND date(created_at) = date('now')
-            LIMIT 1
-            """,
-            (phone,)
-        )
+        cur.execute(_LANDMARK_ADDED_TODAY_SQL, (phone,))
         return cur.fetchone() is not None
     finally:
         db.close()
@@ -670,9 +596,7 @@ DB_PATH = DB_PATH
 
 
 def db() -> sqlite3.Connection:
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    return conn
+    return dbpool.connect(DB_PATH)
 
 
 
@@ -716,156 +640,8 @@ def get_customer_context(phone: str):
 
     return ("Bumala", "Church")
 def ensure_schema() -> None:
-    conn = db()
-    cur = conn.cursor()
-
-    # Riders directory
-    cur.execute("""
-    CREATE TABLE IF NOT EXISTS riders (
-        phone TEXT PRIMARY KEY,
-        name TEXT NOT NULL,
-        village TEXT NOT NULL,
-        rider_type TEXT NOT NULL,
-        sacco TEXT DEFAULT '',
-        location TEXT DEFAULT '',
-        created_at TEXT DEFAULT (datetime('now')),
-        updated_at TEXT DEFAULT (datetime('now'))
-    )
-    """)
-
-    # Customers (optional)
-    cur.execute("""
-    CREATE TABLE IF NOT EXISTS customers (
-        phone TEXT PRIMARY KEY,
-        name TEXT DEFAULT '',
-        village TEXT DEFAULT '',
-        created_at TEXT DEFAULT (datetime('now')),
-        updated_at TEXT DEFAULT (datetime('now'))
-    )
-    """)
-
-    # Businesses directory (Yellow Pages)
-    cur.execute("""
-    CREATE TABLE IF NOT EXISTS businesses (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        owner_phone TEXT NOT NULL,
-        name TEXT NOT NULL,
-        category TEXT NOT NULL,
-        village TEXT NOT NULL,
-        location TEXT DEFAULT '',
-        created_at TEXT DEFAULT (datetime('now')),
-        updated_at TEXT DEFAULT (datetime('now'))
-    )
-    """)
-
-    cur.execute("CREATE INDEX IF NOT EXISTS idx_businesses_village ON businesses(village)")
-    cur.execute("CREATE INDEX IF NOT EXISTS idx_businesses_category ON businesses(category)")
-    cur.execute("CREATE INDEX IF NOT EXISTS idx_businesses_owner ON businesses(owner_phone)")
-
-    # Landmarks (community map)
-    cur.execute("""
-    CREATE TABLE IF NOT EXISTS landmarks (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        village TEXT NOT NULL,
-        name TEXT NOT NULL,
-        added_by TEXT NOT NULL,
-        created_at TEXT DEFAULT (datetime('now'))
-    )
-    """)
-    # Landmarks indexes
-    cur.execute("CREATE INDEX IF NOT EXISTS idx_landmarks_village ON landmarks(village)")
-    cur.execute("CREATE INDEX IF NOT EXISTS idx_landmarks_added_by ON landmarks(added_by)")
-
-
-    # =========================================================
-    # Channels (community micro-radio) — MVP
-    # =========================================================
-    cur.execute("""
-    CREATE TABLE IF NOT EXISTS channels (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        owner_phone TEXT NOT NULL,
-        name TEXT NOT NULL,
-        category TEXT NOT NULL DEFAULT 'Community',
-        is_active INTEGER NOT NULL DEFAULT 1,
-        created_at TEXT NOT NULL DEFAULT (datetime('now'))
-    )
-    """)
-    cur.execute("CREATE INDEX IF NOT EXISTS idx_channels_owner ON channels(owner_phone)")
-    cur.execute("CREATE INDEX IF NOT EXISTS idx_channels_category ON channels(category)")
-
-    cur.execute("""
-    CREATE TABLE IF NOT EXISTS channel_messages (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        channel_id INTEGER NOT NULL,
-        text TEXT NOT NULL,
-        created_at TEXT NOT NULL DEFAULT (datetime('now')),
-        FOREIGN KEY(channel_id) REFERENCES channels(id)
-    )
-    """)
-    cur.execute("CREATE INDEX IF NOT EXISTS idx_channel_messages_channel ON channel_messages(channel_id)")
-    cur.execute("CREATE INDEX IF NOT EXISTS idx_channel_messages_created ON channel_messages(created_at)")
-
-
-    # -----------------------------
-    # Channels (text-only micro radio)
-    # -----------------------------
-    cur.execute("""
-    CREATE TABLE IF NOT EXISTS channels (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        owner_phone TEXT NOT NULL,
-        name TEXT NOT NULL,
-        category TEXT NOT NULL DEFAULT 'Community',
-        is_active INTEGER NOT NULL DEFAULT 1,
-        created_at TEXT NOT NULL DEFAULT (datetime('now'))
-    )
-    """)
-
-    cur.execute("CREATE INDEX IF NOT EXISTS idx_channels_owner_active ON channels(owner_phone, is_active)")
-
-    cur.execute("""
-    CREATE TABLE IF NOT EXISTS channel_messages (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        channel_id INTEGER NOT NULL,
-        sender_phone TEXT NOT NULL,
-        message TEXT NOT NULL,
-        created_at TEXT NOT NULL DEFAULT (datetime('now')),
-        FOREIGN KEY(channel_id) REFERENCES channels(id)
-    )
-    """)
-
-    cur.execute("CREATE INDEX IF NOT EXISTS idx_channel_messages_channel ON channel_messages(channel_id, created_at)")
-
-
-    # Points / Challenge rewards
-    cur.execute("""
-    CREATE TABLE IF NOT EXISTS points (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        phone TEXT NOT NULL,
-        reason TEXT NOT NULL,
-        pts INTEGER NOT NULL,
-        created_at TEXT DEFAULT (datetime('now'))
-    )
-    """)
-    cur.execute("CREATE INDEX IF NOT EXISTS idx_points_phone ON points(phone)")
-    cur.execute("CREATE INDEX IF NOT EXISTS idx_points_created_at ON points(created_at)")
-
-    # Callback requests (future AT voice callback / or manual SACCO-assisted)
-    cur.execute("""
-    CREATE TABLE IF NOT EXISTS callback_requests (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        session_id TEXT NOT NULL,
-        customer_phone TEXT NOT NULL,
-        target_phone TEXT NOT NULL,
-        target_kind TEXT NOT NULL,  -- 'rider' or 'business'
-        village TEXT NOT NULL,
-        status TEXT NOT NULL DEFAULT 'NEW',
-        created_at TEXT DEFAULT (datetime('now'))
-    )
-    """)
-    cur.execute("CREATE INDEX IF NOT EXISTS idx_callbacks_status ON callback_requests(status)")
-
-    conn.commit()
-    conn.close()
+    # Directory, channels, points, callbacks: see migrations.py (runs once per process)
+    migrations.ensure_current(DB_PATH)
 
 
 # =========================
@@ -1064,15 +840,6 @@ def award_points(phone: str, pts: int, reason: str, meta: str = "") -> None:
         conn = db()
         cur = conn.cursor()
 
-        # Ensure balance table exists (single row per phone)
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS points_balance (
-                phone TEXT PRIMARY KEY,
-                balance INTEGER NOT NULL DEFAULT 0,
-                updated_at TEXT NOT NULL DEFAULT (datetime('now'))
-            )
-        """)
-
         pts = int(pts)
 
         # Ledger: use pts column (canonical) + also fill amount for older queries
@@ -1303,6 +1070,14 @@ def handle_register_business(parts: List[str], session_id: str, phone: str) -> T
     ), 200
 
 
+_LANDMARK_NAMES_SQL = """
+SELECT name FROM landmarks
+WHERE village = ? AND name IS NOT NULL AND name != ''
+GROUP BY name
+ORDER BY name ASC
+LIMIT 20
+"""
+
 def handle_set_location(parts: List[str], session_id: str, phone: str) -> Tuple[str, int]:
     """
     Simple 2-step picker:
@@ -1339,15 +1114,13 @@ def handle_set_location(parts: List[str], session_id: str, phone: str) -> Tuple[
         conn = db()
         try:
             cur = conn.cursor()
-            cur.execute(
-                "SELECT name FROM landmarks WHERE village = ? AND name IS NOT NULL AND name != '' GROUP BY name ORDER BY name ASC LIMIT 20",
-                (village,),
-            )
+            cur.execute(_LANDMARK_NAMES_SQL, (village,))
             rows = cur.fetchall() or []
         finally:
             try: conn.close()
             except Exception: pass
 
+        session_state.snapshot_put(session_id, f"set_location:{village}", [r[0] for r in rows])
         lines = [f"CON Location: {village}", "Choose landmark:"]
         idx = 1
         for r in rows:
@@ -1369,18 +1142,18 @@ def handle_set_location(parts: List[str], session_id: str, phone: str) -> Tuple[
         if sel == "0":
             return ussd_response(main_menu()), 200
 
-        # fetch list again (same as step 2) so numbering matches
-        conn = db()
-        try:
-            cur = conn.cursor()
-            cur.execute(
-                "SELECT name FROM landmarks WHERE village = ? AND name IS NOT NULL AND name != '' GROUP BY name ORDER BY name ASC LIMIT 20",
-                (village,),
-            )
-            rows = cur.fetchall() or []
-        finally:
-            try: conn.close()
-            except Exception: pass
+        # the list shown at step 2; fetch again (same query) only without a snapshot
+        names = session_state.snapshot_get(session_id, f"set_location:{village}")
+        if names is None:
+            conn = db()
+            try:
+                cur = conn.cursor()
+                cur.execute(_LANDMARK_NAMES_SQL, (village,))
+                names = [r[0] for r in (cur.fetchall() or [])]
+            finally:
+                try: conn.close()
+                except Exception: pass
+        rows = [(name,) for name in names]
 
         add_new_index = len(rows) + 1
 
@@ -1421,6 +1194,7 @@ def handle_set_location(parts: List[str], session_id: str, phone: str) -> Tuple[
                 (phone, village, landmark, "Set via menu"),
             )
             conn.commit()
+            landmark_index.invalidate(DB_PATH, village)
         finally:
             try: conn.close()
             except Exception: pass
@@ -1454,6 +1228,7 @@ def handle_set_location(parts: List[str], session_id: str, phone: str) -> Tuple[
                 (phone, village, landmark, "Added via Set my location"),
             )
             conn.commit()
+            landmark_index.invalidate(DB_PATH, village)
         finally:
             try: conn.close()
             except Exception: pass
@@ -1550,6 +1325,7 @@ def nearest_drivers_screen(phone: str, village: str, landmark: str, limit: int =
 
     score_by_phone = {}
     try:
+        window = fairness_state.get_window(DB_PATH)
         tmp = []
         for r in drivers:
             phone_ = ""
@@ -1578,17 +1354,13 @@ def nearest_drivers_screen(phone: str, village: str, landmark: str, limit: int =
             else:
                 phone_, eta_, lm_ = str(r), 999, ""
 
-            # DEMO inputs (so you SEE reordering) — replace later with real trust/fairness
-            digits = "".join(ch for ch in str(phone_) if ch.isdigit())
-            last = int(digits[-1]) if digits else 0
-            trust = 0.50
-            recent = 1
-            if last == 3:
-                trust, recent = 0.95, 0
-            elif last == 2:
-                trust, recent = 0.25, 3
-            elif last == 4:
-                trust, recent = 0.60, 1
+            # Fairness inputs: roster matches carry them (completion-based trust,
+            # rolling-window jobs); other shapes fall back to the window
+            trust = getattr(r, "trust_score", None)
+            trust = 0.5 if trust is None else trust
+            recent = getattr(r, "recent_jobs", None)
+            if recent is None:
+                recent = window.count(normalize_phone(phone_)) if phone_ else 0
 
             d = {
                 "phone": phone_,
@@ -1601,23 +1373,26 @@ def nearest_drivers_screen(phone: str, village: str, landmark: str, limit: int =
             }
             tmp.append(d)
 
-        tmp = _rank_riders_if_possible(tmp)
+        # One batched pass: order + per-rider explanation
+        order = list(range(len(tmp)))
+        batch = None
+        if score_batch is not None and tmp:
+            batch = score_batch(
+                [d["eta_minutes"] for d in tmp],
+                [d["trust_score"] for d in tmp],
+                [d["recent_jobs"] for d in tmp],
+                [d["expected_income"] for d in tmp],
+                PolicyWeights(),
+            )
+            order = batch.order
 
         ranked_drivers = []
-        for d in tmp:
+        for i in order:
+            d = tmp[i]
             ph = d.get("phone", "")
             ranked_drivers.append((ph, int(d.get("eta_minutes", 999)), d.get("landmark", "")))
-
-            try:
-                score_by_phone[ph] = explain_score(Candidate(
-                    phone=ph,
-                    eta_minutes=float(d.get("eta_minutes", 999)),
-                    trust_score=float(d.get("trust_score", 0.5)),
-                    recent_jobs=int(d.get("recent_jobs", 0)),
-                    expected_income=float(d.get("expected_income", 0)),
-                ))
-            except Exception:
-                pass
+            if batch is not None:
+                score_by_phone[ph] = short_explanation(batch.explain(i))
 
         drivers = ranked_drivers
 
@@ -1625,6 +1400,8 @@ def nearest_drivers_screen(phone: str, village: str, landmark: str, limit: int =
         score_by_phone = {}
 
     lines = ["CON Nearest riders"]
+    if not drivers:
+        lines.append("No riders available right now.")
     i = 1
     for (ph, eta, lm) in drivers:
         suffix = ""
@@ -1667,8 +1444,9 @@ def handle_ussd_core(session_id: str, phone_number: str, text: str) -> Tuple[str
             cur = conn.cursor()
             # ensure prefs row exists
             ensure_user_prefs(conn)
-            cur.execute("UPDATE user_prefs SET village=? WHERE phone=?", (v, phone))
+            cur.execute("UPDATE user_prefs SET village=?, updated_at=datetime('now') WHERE phone=?", (v, phone))
             conn.commit()
+            user_context.invalidate(session_id)
         except Exception:
             pass
             return ussd_response(f"CON Location set ✓\nVillage: {v}\n0. Back"), 200
@@ -1811,24 +1589,12 @@ def handle_ussd_core(session_id: str, phone_number: str, text: str) -> Tuple[str
 
 def get_nearest_drivers(phone: str, village: str, landmark: str | None = None, limit: int = 3):
     """
-    Returns nearest drivers based on relative distance logic
+    Nearest available riders in the village (provider_roster): in-memory
+    buckets per canonical landmark, ETA from travel_matrix. Returns
+    PersonLocation-shaped RiderMatch objects with trust_score / recent_jobs.
     """
-
-    customer = PersonLocation(
-        phone=phone,
-        village=village,
-        landmark=landmark
-    )
-
-    # TODO: replace with real DB query
-    drivers = [
-        PersonLocation(phone="+254700000002", village=village, landmark="Market Gate", eta_minutes=2),
-        PersonLocation(phone="+254700000003", village=village, landmark="Water Pump", eta_minutes=5),
-        PersonLocation(phone="+254700000004", village="Busia", landmark=None, eta_minutes=15),
-    ]
-
-    ranked = rank_drivers(customer, drivers)
-    return ranked[:limit]
+    roster = provider_roster.get_roster(DB_PATH)
+    return roster.nearest(village, landmark, limit=limit, exclude=[normalize_phone(phone)] if phone else ())
 
 
 
@@ -1841,7 +1607,7 @@ CHANNEL_CATEGORIES = ["Community", "Business", "Sacco", "Education", "Entertainm
 
 def _db():
     # Always use ONE DB file (DB_PATH) for the whole app
-    return sqlite3.connect(DB_PATH)
+    return dbpool.connect(DB_PATH)
 def get_my_channel(phone: str):
     conn = _db()
     cur = conn.cursor()
@@ -2022,15 +1788,6 @@ def handle_sacco_updates(raw: str, phone: str):
             if "db" in globals():
                 conn = db()
                 cur = conn.cursor()
-                # create table if it doesn't exist (lightweight)
-                cur.execute("""
-                    CREATE TABLE IF NOT EXISTS sacco_issues (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        phone TEXT NOT NULL,
-                        issue TEXT NOT NULL,
-                        created_at TEXT NOT NULL DEFAULT (datetime('now'))
-                    )
-                """)
                 cur.execute("INSERT INTO sacco_issues(phone, issue) VALUES(?,?)", (phone, issue))
                 conn.commit()
         except Exception:
@@ -2327,13 +2084,10 @@ def handle_businesses_v2(db_path=None, phone=None, text=None, village="Bumala",
     Expected DB schema:
       businesses(id, owner_phone, name, category, village, location, ...)
     """
-    import sqlite3
-
     # normalize village
     village = (village or "").strip() or "Bumala"
 
-    con = sqlite3.connect(db_path)
-    con.row_factory = sqlite3.Row
+    con = dbpool.connect(db_path)
     cur = con.cursor()
 
     # Pull a few businesses for that village
@@ -2371,203 +2125,47 @@ def handle_ussd(session_id: str, phone_number: str, text: str):
     phone_number = (phone_number or '').strip()
     text = (text or '').strip()
     # Normalize phone early (avoid leading spaces / missing '+')
-    if "normalize_phone" in globals():
-        phone = normalize_phone(phone_number)
-    else:
-        phone = (phone_number or "").strip()
+    phone = normalize_phone(phone_number)
     raw = (text or "").strip()
 
-    
-
-
-    # Always have parts/last available (prevents crashes)
-    parts = raw.split("*") if raw else []
-    last = (parts[-1] if parts else "").strip()
+    # Schema is migrated once per process; afterwards this is a set lookup.
+    migrations.ensure_current(DB_PATH)
 
-    parts = raw.split("*") if raw else []
-    last = (parts[-1] if parts else "").strip()
+    # Paths that mean "start over" (before onboarding, like an empty text)
+    raw = ROUTE_ALIASES.get(raw, raw)
 
-### EARLY_CHOOSE_SERVICE_INTERCEPT_V1 ###
-    # Hard-safe intercept for option 1 (Choose service) BEFORE any deeper logic.
-    # This prevents crashes if later branches assume state that isn't set yet.
-### /EARLY_CHOOSE_SERVICE_INTERCEPT_V1 ###
+    # Prefs, role (user_roles wins), village, landmark, provider row: one query,
+    # cached for the session once onboarded
+    ctx = user_context.for_session(onboarding.DB_PATH, session_id, phone)
 
-    # BIZ_BACK_TO_ROOT_V1: ensure businesses back-to-root never hits legacy directory
-    if raw == "2*0":
-        try:
-            return handle_ussd(session_id=session_id, phone_number=phone, text="")
-        except Exception:
-            # last resort: behave like top-level root
-            return handle_ussd(session_id=session_id, phone_number=phone, text="")
-# 1) If onboarding not complete, return onboarding screens
-    resp = onboarding.onboarding_response(session_id=session_id, phone=phone, text=raw)
+    # 1) If onboarding not complete, return onboarding screens
+    resp = onboarding.onboarding_response(session_id=session_id, phone=phone, text=raw, prefs=ctx.prefs)
     if resp is not None:
         return (resp, 200)
+    if not ctx.onboarded:
+        # onboarding just finished on this step: pick up what it wrote
+        ctx = user_context.for_session(onboarding.DB_PATH, session_id, phone)
 
-    # 2) Onboarded: show new "Role Home" when user starts (empty text)
-    try:
-        prefs = onboarding.get_prefs(phone)
-    except Exception:
-        prefs = {"role": "customer", "area_type": "village", "landmark": "Church"}
-
-    role = (prefs.get("role") or "customer").strip().lower()
-    # If role wasn't stored in prefs (or prefs fallback), derive from user_roles
-    rdb = (_get_user_role_db(phone) or '').strip().lower()
-    if rdb in ('provider','customer','traveler'):
-        role = rdb
-    area = (prefs.get("area_type") or "village").strip()
-    village = get_pref_village(phone, fallback="Church")
-    landmark = (prefs.get("landmark") or "").strip()
-
-
-### FORCE_ROLE_HOME_AND_SERVICE_1 ###
-
-### CUSTOMER_DELIVERY_OFFER_WIRING_V1 ###
-    # --- Customer Delivery: selecting a rider from nearest list (demo mapping for now) ---
-    # After customer did 1*2 (Delivery), they see nearest riders list.
-    # Here we accept: 1*2*<n> to OFFER the latest 'new' delivery request to that rider.
-    if role == "customer" and raw.startswith("1*2*"):
-        parts = raw.split("*")
-        last = (parts[-1] if parts else "").strip()
-        # 1*2*<n>
-        if len(parts) >= 3:
-            sel = parts[2].strip()
-            if sel == "0":
-                return handle_ussd(session_id=session_id, phone_number=phone, text="")
-            if sel.isdigit():
-                n = int(sel)
-                demo_riders = {1:"+254700000003", 2:"+254700000004", 3:"+254700000002"}
-                rider_phone = demo_riders.get(n, "")
-                if not rider_phone:
-                    return ("END Invalid rider selection.", 200)
-
-                # find latest delivery request by this customer that is still 'new'
-                con = connect_db()
-                cur = con.cursor()
-                cur.execute("""
-                    SELECT id FROM delivery_requests
-                    WHERE source_type='customer'
-                      AND source_phone=?
-                      AND status='new'
-                    ORDER BY id DESC
-                    LIMIT 1
-                """, (phone,))
-                row = cur.fetchone()
-                con.close()
-                if not row:
-                    return ("END No active delivery request found.", 200)
-
-                did = int(row[0])
-                set_delivery_offer(did, rider_phone)
-                return (f"END Delivery offered to rider {rider_phone}.", 200)
-
-    # Role Home + Customer option 1 (Choose service) MUST be handled here.
-    # This block runs after prefs/role/village/landmark are known.
-
-    if raw == "":
-
-        title = "Customer" if role == "customer" else "Service Provider"
-
-        menu = (
-
-            title + " (village: " + str(village) + ")\n"
-
-            + "1. Find a Rider ->\n"
-
-            + "2. Local Businesses\n"
-
-            + "3. Register (Rider / Business)\n"
+    # 2) Onboarded: dispatch on the routing trie
+    prefs = ctx.prefs
+    role = ctx.effective_role()
 
-            + "4. Change my place\n"
-
-            + "5. Sacco Line ->\n"
-
-            + "6. Listen (channels)\n"
-
-            + "7. My channel\n"
-
-            + "8. Travel ->\n"
-
-            + "9. Switch role\n"
-
-            + "0. Exit"
-
-        )
-
-        return ("CON " + menu, 200)
-### DELIVERY_WIRING_CUSTOMER_OPTION1 ###
-
-### PROVIDER_INCOMING_REQUESTS_WIRING_V1 ###
-    # Provider Incoming requests (option 4)
-    if role == "provider" and (raw == "4" or raw.startswith("4*")):
-        if raw == "4":
-            return ("CON Incoming requests\n1. Rider requests\n2. Delivery requests\n0. Back", 200)
-        if raw == "4*0" or raw.startswith("4*0*"):
-            return handle_ussd(session_id=session_id, phone_number=phone, text="")
-        if raw == "4*2" or raw.startswith("4*2*"):
-            return handle_provider_delivery_inbox(raw=raw, session_id=session_id, phone=phone, village=village)
-        if raw == "4*1" or raw.startswith("4*1*"):
-            return ("CON Rider requests\n(soon)\n0. Back", 200)
-        return ("CON Incoming requests\n1. Rider requests\n2. Delivery requests\n0. Back", 200)
-    # Customer option 1 now shows "Choose service" (Ride / Delivery)
-    if role == "customer" and (raw == "1" or raw.startswith("1*")):
-        return handle_customer_service_1(raw=raw, phone=phone, session_id=session_id)
-# Intercepts (before core)
-
-    
-# Channels (6/7) — handled here so core routes remain unchanged
-    # Listen (channels)
-    # Sacco Line (option 5)
-    # Sacco Line (option 5) — handled here so core remains unchanged
-    if raw == "5" or raw.startswith("5*"):
-        # Back-to-root behavior: 5*0 should return the real root (text="")
-        if raw == "5*0" or raw.startswith("5*0*"):
-            return handle_ussd(session_id=session_id, phone_number=phone, text="")
-        return (handle_sacco_updates(raw, phone), 200)
-
-    if raw == "6" or raw.startswith("6*"):
-        return (handle_listen_channels(raw), 200)
-
-    # My channel
-    if raw == "7" or raw.startswith("7*"):
-        return (handle_my_channel(raw, phone), 200)
-
-    # BUSINESSES_ROUTER_V3: force businesses flow through handle_businesses_v2 (never 500)
-    if raw == "2" or raw.startswith("2*"):
-        parts = (raw or "").split("*")
-        return (handle_businesses_v2(parts, session_id=session_id, phone=phone), 200)
-
-    if last == "0":
-        return ("END Bye.", 200)
-
-    if last == "4":
-        # Keep role, reset place => onboarding will ask area/landmark again
-        try:
-            onboarding.clear_location(phone)
-        except Exception:
-            pass
-        # Ask area again
-        r2 = onboarding.onboarding_response(session_id=session_id, phone=phone, text="")
-        return ((r2 or """CON Choose your area:
-1. Village
-2. Town/City
-3. Airport
-0. Back"""), 200)
-
-    if last == "9":
-        # Reset everything => onboarding will ask role again
-        try:
-            onboarding.clear_role(phone)
-        except Exception:
-            pass
-        r2 = onboarding.onboarding_response(session_id=session_id, phone=phone, text="")
-        return ((r2 or """CON Angelopp
-1. I am a Customer
-2. I am a Service Provider
-0. Exit"""), 200)
-
-    # 3) Otherwise: run the original logic
-    return handle_ussd_core(session_id=session_id, phone_number=phone_number, text=raw)
+    parts = raw.split("*") if raw else []
+    req = ussd_router.UssdRequest(
+        session_id=session_id,
+        phone=phone,
+        phone_number=phone_number,
+        raw=raw,
+        parts=parts,
+        last=(parts[-1] if parts else "").strip(),
+        role=role,
+        village=ctx.village_or("Church"),
+        landmark=(prefs.get("landmark") or "").strip(),
+        area=(prefs.get("area_type") or "village").strip(),
+        prefs=prefs,
+        user=ctx,
+    )
+    return ROUTER.dispatch(req)
 
 
 ### PROVIDER_DELIVERY_INBOX_V1 ###
@@ -2660,6 +2258,7 @@ def handle_provider_delivery_inbox(raw: str, session_id: str, phone: str, villag
             print("[DELIVERY][EXC] inbox list failed", {"phone": phone, "village": v, "err": str(e)}, flush=True)
             return _resp("Delivery requests\nSystem error\n0. Back")
 
+        session_state.snapshot_put(session_id, "delivery_inbox", [int(r[0]) for r in rows])
         if not rows:
             return _resp("Delivery requests\nNo open deliveries\n0. Back")
 
@@ -2686,10 +2285,14 @@ def handle_provider_delivery_inbox(raw: str, session_id: str, phone: str, villag
         return _resp("Delivery requests\nInvalid choice\n0. Back")
 
     try:
-        rows = _inbox_rows(limit=9)
-        if n < 1 or n > len(rows):
+        # resolve against the list this session was shown; re-query only without one
+        have, delivery_id = session_state.snapshot_pick(session_id, "delivery_inbox", n)
+        if not have:
+            rows = _inbox_rows(limit=9)
+            delivery_id = int(rows[n - 1][0]) if 1 <= n <= len(rows) else None
+        if delivery_id is None:
             return _resp("Delivery requests\nInvalid choice\n0. Back")
-        delivery_id = int(rows[n - 1][0])
+        delivery_id = int(delivery_id)
         row = _get_by_id(delivery_id)
         if not row:
             return _resp("Delivery not found\n0. Back")
@@ -2716,6 +2319,7 @@ def handle_provider_delivery_inbox(raw: str, session_id: str, phone: str, villag
             rows = get_open_delivery_requests(village=village, limit=9)
         except Exception:
             rows = []
+        session_state.snapshot_put(session_id, "delivery_inbox", [int(r[0]) for r in rows])
         if not rows:
             return _resp("Delivery requests\nNo open deliveries\n0. Back")
         lines = ["Delivery requests"]
@@ -2820,6 +2424,157 @@ def get_open_delivery_requests(village: str, limit: int = 5):
 
 # Monkey-patch the public name used by app.py
 
+# =========================
+# USSD routes (compiled once at import; see ussd_router.py)
+# =========================
+# BIZ_BACK_TO_ROOT_V1: businesses back-to-root never hits the legacy directory
+ROUTE_ALIASES = {"2*0": ""}
+
+
+def _route_home(req):
+    # Role Home (empty text, and every "back to root")
+    title = "Customer" if req.role == "customer" else "Service Provider"
+    menu = (
+        title + " (village: " + str(req.village) + ")\n"
+        + "1. Find a Rider ->\n"
+        + "2. Local Businesses\n"
+        + "3. Register (Rider / Business)\n"
+        + "4. Change my place\n"
+        + "5. Sacco Line ->\n"
+        + "6. Listen (channels)\n"
+        + "7. My channel\n"
+        + "8. Travel ->\n"
+        + "9. Switch role\n"
+        + "0. Exit"
+    )
+    return ("CON " + menu, 200)
+
+
+def _route_customer_delivery_offer(req):
+    # CUSTOMER_DELIVERY_OFFER_WIRING_V1
+    # After customer did 1*2 (Delivery), they see nearest riders list.
+    # Here we accept: 1*2*<n> to OFFER the latest 'new' delivery request to that rider.
+    if len(req.parts) < 3:
+        return None
+    sel = req.parts[2].strip()
+    if sel == "0":
+        return _route_home(req)
+    if not sel.isdigit():
+        return None
+    n = int(sel)
+    demo_riders = {1:"+254700000003", 2:"+254700000004", 3:"+254700000002"}
+    rider_phone = demo_riders.get(n, "")
+    if not rider_phone:
+        return ("END Invalid rider selection.", 200)
+
+    # find latest delivery request by this customer that is still 'new'
+    con = connect_db()
+    cur = con.cursor()
+    cur.execute("""
+        SELECT id FROM delivery_requests
+        WHERE source_type='customer'
+          AND source_phone=?
+          AND status='new'
+        ORDER BY id DESC
+        LIMIT 1
+    """, (req.phone,))
+    row = cur.fetchone()
+    con.close()
+    if not row:
+        return ("END No active delivery request found.", 200)
+
+    did = int(row[0])
+    set_delivery_offer(did, rider_phone)
+    return (f"END Delivery offered to rider {rider_phone}.", 200)
+
+
+def _route_customer_service(req):
+    # Customer option 1 shows "Choose service" (Ride / Delivery)
+    return handle_customer_service_1(raw=req.raw, phone=req.phone, session_id=req.session_id)
+
+
+_PROVIDER_INCOMING_MENU = ("CON Incoming requests\n1. Rider requests\n2. Delivery requests\n0. Back", 200)
+
+def _route_provider_incoming(req):
+    # PROVIDER_INCOMING_REQUESTS_WIRING_V1 (4, and anything under 4* not routed below)
+    return _PROVIDER_INCOMING_MENU
+
+def _route_provider_delivery_inbox(req):
+    return handle_provider_delivery_inbox(raw=req.raw, session_id=req.session_id, phone=req.phone, village=req.village)
+
+def _route_provider_rider_requests(req):
+    return ("CON Rider requests\n(soon)\n0. Back", 200)
+
+
+def _route_sacco(req):
+    return (handle_sacco_updates(req.raw, req.phone), 200)
+
+def _route_listen(req):
+    return (handle_listen_channels(req.raw), 200)
+
+def _route_my_channel(req):
+    return (handle_my_channel(req.raw, req.phone), 200)
+
+def _route_businesses(req):
+    # BUSINESSES_ROUTER_V3: businesses flow through handle_businesses_v2 (never 500)
+    return (handle_businesses_v2(req.parts, session_id=req.session_id, phone=req.phone), 200)
+
+
+def _fallback_last_token(req):
+    if req.last == "0":
+        return ("END Bye.", 200)
+
+    if req.last == "4":
+        # Keep role, reset place => onboarding will ask area/landmark again
+        try:
+            onboarding.clear_location(req.phone)
+        except Exception:
+            pass
+        user_context.invalidate(req.session_id)
+        r2 = onboarding.onboarding_response(session_id=req.session_id, phone=req.phone, text="")
+        return ((r2 or """CON Choose your area:
+1. Village
+2. Town/City
+3. Airport
+0. Back"""), 200)
+
+    if req.last == "9":
+        # Reset everything => onboarding will ask role again
+        try:
+            onboarding.clear_role(req.phone)
+        except Exception:
+            pass
+        user_context.invalidate(req.session_id)
+        r2 = onboarding.onboarding_response(session_id=req.session_id, phone=req.phone, text="")
+        return ((r2 or """CON Angelopp
+1. I am a Customer
+2. I am a Service Provider
+0. Exit"""), 200)
+
+    return None
+
+def _fallback_core(req):
+    # Otherwise: run the original logic
+    return handle_ussd_core(session_id=req.session_id, phone_number=req.phone_number, text=req.raw)
+
+
+ROUTER = ussd_router.Router()
+ROUTER.add("", _route_home, exact=True, name="home")
+ROUTER.add("1", _route_customer_service, roles=("customer",), name="customer.service")
+ROUTER.add("1*2", _route_customer_delivery_offer, roles=("customer",), name="customer.delivery_offer")
+ROUTER.add("2", _route_businesses, name="businesses")
+ROUTER.add("4", _route_provider_incoming, roles=("provider",), name="provider.incoming")
+ROUTER.add("4*0", _route_home, roles=("provider",), name="provider.incoming.back")
+ROUTER.add("4*1", _route_provider_rider_requests, roles=("provider",), name="provider.rider_requests")
+ROUTER.add("4*2", _route_provider_delivery_inbox, roles=("provider",), name="provider.delivery_inbox")
+ROUTER.add("5", _route_sacco, name="sacco")
+ROUTER.add("5*0", _route_home, name="sacco.back")
+ROUTER.add("6", _route_listen, name="channels.listen")
+ROUTER.add("7", _route_my_channel, name="channels.mine")
+ROUTER.fallback(_fallback_last_token, name="last_token")
+ROUTER.fallback(_fallback_core, name="core")
+
+
 # ------------------------------------------------------------
 # Safety wrapper (restored): never crash the Flask endpoint
 # ------------------------------------------------------------
@@ -2837,7 +2592,7 @@ def _angelopp_safe_handle_ussd(session_id: str, phone_number: str, text: str):
         if rv is None:
             print("[USSD][BUG] handle_ussd returned None", {"session": session_id, "phone": phone_number, "text": raw}, flush=True)
             return ("END System error. Please try again.", 200)
-        return rv
+        return session_state.end(session_id, rv)
     except Exception as e:
         print("[USSD][EXC] exception in handle_ussd", {"session": session_id, "phone": phone_number, "text": raw, "err": str(e)}, flush=True)
         return ("END System error. Please try again.", 200)
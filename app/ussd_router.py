@@ -0,0 +1,159 @@
+"""
+ussd_router.py
+
+Routing trie for USSD paths, keyed on menu path prefix + role.
+
+    router = Router()
+    router.add("4*2", handle_inbox, roles=("provider",))
+    router.add("", home, exact=True)
+    router.fallback(last_token_rules)
+    router.fallback(core)
+    body, code = router.dispatch(req)
+
+- routes are registered once at import; dispatch walks the trie once
+  (O(depth)), then tries the matched routes deepest-first
+- a handler returning None falls through to the next (shorter) match,
+  then to the fallbacks, in registration order
+- per-route hit counts and latency: stats()
+"""
+
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+Handler = Callable[["UssdRequest"], Optional[Tuple[str, int]]]
+
+
+@dataclass
+class UssdRequest:
+    session_id: str
+    phone: str              # normalized
+    phone_number: str       # as received (core normalizes itself)
+    raw: str
+    parts: List[str]
+    last: str
+    role: str = "customer"
+    village: str = ""
+    landmark: str = ""
+    area: str = "village"
+    prefs: Dict[str, Any] = field(default_factory=dict)
+    user: Any = None        # user_context.UserContext (prefs, roles, provider row)
+
+
+@dataclass
+class Route:
+    name: str
+    handler: Handler
+    roles: Optional[frozenset]
+    exact: bool
+
+
+class _Node:
+    __slots__ = ("children", "routes")
+
+    def __init__(self):
+        self.children: Dict[str, "_Node"] = {}
+        self.routes: List[Route] = []
+
+
+def _tokens(path: str) -> List[str]:
+    return path.split("*") if path else []
+
+
+class Router:
+    def __init__(self):
+        self._root = _Node()
+        self._fallbacks: List[Route] = []
+        self._lock = threading.Lock()
+        self._stats: Dict[str, Dict[str, float]] = {}
+
+    # -------------------------
+    # Registration
+    # -------------------------
+    def add(self, path: str, handler: Handler, roles: Optional[Sequence[str]] = None,
+            exact: bool = False, name: Optional[str] = None) -> None:
+        """path "4*2" matches "4*2" and "4*2*..." (only "4*2" when exact)."""
+        node = self._root
+        for tok in _tokens(path):
+            node = node.children.setdefault(tok, _Node())
+        label = name or ((path or "<root>") + (f"[{','.join(roles)}]" if roles else ""))
+        node.routes.append(Route(label, handler, frozenset(roles) if roles else None, bool(exact)))
+
+    def fallback(self, handler: Handler, name: Optional[str] = None) -> None:
+        self._fallbacks.append(Route(name or handler.__name__, handler, None, False))
+
+    # -------------------------
+    # Dispatch
+    # -------------------------
+    def match(self, req: UssdRequest) -> List[Route]:
+        """Candidate routes for req, deepest prefix first, then fallbacks."""
+        levels = [self._root.routes]
+        node = self._root
+        for tok in req.parts:
+            node = node.children.get(tok)
+            if node is None:
+                break
+            levels.append(node.routes)
+
+        depth = len(req.parts)
+        out: List[Route] = []
+        for d in range(len(levels) - 1, -1, -1):
+            for r in levels[d]:
+                if r.exact and d != depth:
+                    continue
+                if r.roles is not None and req.role not in r.roles:
+                    continue
+                out.append(r)
+        return out + self._fallbacks
+
+    def dispatch(self, req: UssdRequest) -> Optional[Tuple[str, int]]:
+        for route in self.match(req):
+            t0 = time.perf_counter()
+            try:
+                rv = route.handler(req)
+            finally:
+                self._record(route.name, time.perf_counter() - t0)
+            if rv is not None:
+                return rv
+        return None
+
+    # -------------------------
+    # Stats
+    # -------------------------
+    def _record(self, name: str, seconds: float) -> None:
+        ms = seconds * 1000.0
+        with self._lock:
+            s = self._stats.get(name)
+            if s is None:
+                s = self._stats[name] = {"hits": 0, "total_ms": 0.0, "max_ms": 0.0}
+            s["hits"] += 1
+            s["total_ms"] += ms
+            if ms > s["max_ms"]:
+                s["max_ms"] = ms
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            out = {}
+            for name, s in self._stats.items():
+                out[name] = {
+                    "hits": int(s["hits"]),
+                    "avg_ms": round(s["total_ms"] / s["hits"], 3) if s["hits"] else 0.0,
+                    "max_ms": round(s["max_ms"], 3),
+                    "total_ms": round(s["total_ms"], 3),
+                }
+            return out
+
+    def reset_stats(self) -> None:
+        with self._lock:
+            self._stats.clear()
+
+    def routes(self) -> List[str]:
+        """Registered route names (trie order), then fallbacks."""
+        names: List[str] = []
+        stack = [self._root]
+        while stack:
+            node = stack.pop()
+            names.extend(r.name for r in node.routes)
+            stack.extend(reversed(list(node.children.values())))
+        return names + [r.name for r in self._fallbacks]
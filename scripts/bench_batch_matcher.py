@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+"""
+bench_batch_matcher.py
+
+Greedy build_offers (one request at a time, in arrival order) vs the
+batched min-cost matcher (batch_matcher.match_requests over the whole
+window) on a synthetic bus arrival: many requests in one village within
+seconds, most of them at the bus stage.
+
+Both runs start from the same DB (riders, landmarks, a seeded travel
+matrix). Reported per run:
+- top slot: ETA of the first-ranked offer per request, how many riders got
+  a top slot, the most top slots one rider got
+- served: riders take one job each; every request goes to the first rider
+  in its offer list who is still free (arrival order)
+- solve_ms: batch_matcher's cost lookup + assignment (runs in the web worker)
+
+--solve-only times batch_matcher.assign() alone on random costs (the
+worst case: little overlap between the requests' best riders) for window
+sizes x village sizes, against the old one-column-per-rider solve.
+
+Usage:
+    python scripts/bench_batch_matcher.py --riders 1000 --requests 50
+    python scripts/bench_batch_matcher.py --solve-only
+"""
+
+import argparse
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from collections import Counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+
+import angelopp_core as core  # noqa: E402
+import batch_matcher  # noqa: E402
+import dbpool  # noqa: E402
+import migrations  # noqa: E402
+import travel_matrix  # noqa: E402
+
+VILLAGE = "Busia"
+STAGE = "Bus Stage"
+LANDMARKS = [STAGE, "Market Gate", "Water Pump", "Police Station", "Hospital", "Church",
+             "Posta", "Junction", "Border Post", "Primary School", "Petrol Station", "Chief's Camp"]
+
+
+def seed(db_path: str, riders: int, rnd: random.Random) -> None:
+    conn = dbpool.connect(db_path)
+    for nm in LANDMARKS:
+        conn.execute("INSERT INTO landmarks(village, name) VALUES (?, ?)", (VILLAGE, nm))
+    conn.commit()
+    conn.close()
+    for i, a in enumerate(LANDMARKS):
+        for b in LANDMARKS[i:]:
+            travel_matrix.seed(db_path, VILLAGE, a, b, 2 if a == b else rnd.randint(3, 25))
+    travel_matrix.build(db_path, VILLAGE)
+    for i in range(riders):
+        ph = f"+2547{i:08d}"
+        core.upsert_provider(ph, "rider", f"Rider {i}", VILLAGE)
+        core.set_provider_landmark(ph, rnd.choice(LANDMARKS))
+        core.provider_set_service(ph, 1, 1)
+
+
+def copy_db(src: str, dst: str) -> None:
+    a, b = sqlite3.connect(src), sqlite3.connect(dst)
+    a.backup(b)
+    a.close()
+    b.close()
+
+
+def measure(db_path: str, ids: list) -> dict:
+    conn = dbpool.connect(db_path)
+    offers = {}
+    for rid in ids:
+        offers[rid] = [(r[0], r[1]) for r in conn.execute(
+            "SELECT provider_phone, eta_minutes FROM request_offers WHERE request_id=? ORDER BY score, id", (rid,)
+        ).fetchall()]
+    conn.close()
+
+    tops = [o[0] for o in offers.values() if o]
+    per_rider = Counter(p for p, _ in tops)
+    busy, served = set(), []
+    for rid in ids:
+        for phone, eta in offers[rid]:
+            if phone not in busy:
+                busy.add(phone)
+                served.append(eta)
+                break
+    return {
+        "top_eta_total": sum(e for _, e in tops),
+        "top_eta_mean": statistics.mean(e for _, e in tops) if tops else 0.0,
+        "top_riders": len(per_rider),
+        "top_max_per_rider": max(per_rider.values()) if per_rider else 0,
+        "served": len(served),
+        "served_eta_total": sum(served),
+        "served_eta_mean": statistics.mean(served) if served else 0.0,
+    }
+
+
+def solve_only(max_offers: int = 5) -> None:
+    per_request = max_offers * batch_matcher.CANDIDATES_PER_REQUEST
+    print(f"{'requests':>9}{'riders':>8}{'all riders ms':>15}{'top-k ms':>10}")
+    for n in (20, 50, 100, 200):
+        for m in (300, 1000, 3000):
+            rnd = random.Random(n * m)
+            phones = [f"+2547{j:08d}" for j in range(m)]
+            costs = [[(float(rnd.randint(2, 40)), p) for p in phones] for _ in range(n)]
+            t0 = time.perf_counter()
+            batch_matcher.assign(costs, per_request=per_request)
+            fast = (time.perf_counter() - t0) * 1000.0
+            slow = "-"
+            if n * m <= 50 * 3000:     # the old solve takes seconds beyond this
+                t0 = time.perf_counter()
+                batch_matcher.assign(costs, per_request=m)
+                slow = f"{(time.perf_counter() - t0) * 1000.0:.0f}"
+            print(f"{n:>9}{m:>8}{slow:>15}{fast:>10.0f}")
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark greedy build_offers vs batched min-cost matching")
+    ap.add_argument("--riders", type=int, default=1000)
+    ap.add_argument("--requests", type=int, default=batch_matcher.MAX_BATCH)
+    ap.add_argument("--stage-share", type=float, default=0.6, help="share of requests at the bus stage")
+    ap.add_argument("--seed", type=int, default=9)
+    ap.add_argument("--solve-only", action="store_true", help="time assign() alone, no DB")
+    args = ap.parse_args()
+    if args.solve_only:
+        solve_only()
+        return
+
+    rnd = random.Random(args.seed)
+    tmp = tempfile.mkdtemp(prefix="batch_bench_")
+    base = os.path.join(tmp, "base.db")
+    migrations.migrate(base)
+    core.DB_PATH = base
+    seed(base, args.riders, rnd)
+    pickups = [STAGE if rnd.random() < args.stage_share else rnd.choice(LANDMARKS) for _ in range(args.requests)]
+
+    results = {}
+    for mode in ("greedy", "batch"):
+        db_path = os.path.join(tmp, f"{mode}.db")
+        copy_db(base, db_path)
+        core.DB_PATH = db_path
+        ids = [core.create_request(f"+2547990{i:05d}", 1, VILLAGE, lm, "") for i, lm in enumerate(pickups)]
+        t0 = time.perf_counter()
+        if mode == "greedy":
+            for rid in ids:
+                core.build_offers(rid, max_offers=5)
+        else:
+            solve_ms = batch_matcher.match_requests(ids, max_offers=5)["solve_ms"]
+        dt = time.perf_counter() - t0
+        results[mode] = measure(db_path, ids)
+        results[mode]["ms"] = dt * 1000.0
+        results[mode]["solve_ms"] = solve_ms if mode == "batch" else 0.0
+
+    print(f"riders={args.riders} requests={args.requests} stage_share={args.stage_share}")
+    print(f"{'':22}{'greedy':>10}{'batch':>10}")
+    for k, fmt in (("top_eta_total", "{:10d}"), ("top_eta_mean", "{:10.1f}"), ("top_riders", "{:10d}"),
+                   ("top_max_per_rider", "{:10d}"), ("served", "{:10d}"), ("served_eta_total", "{:10d}"),
+                   ("served_eta_mean", "{:10.1f}"), ("ms", "{:10.1f}"), ("solve_ms", "{:10.1f}")):
+        print(f"{k:22}" + fmt.format(results["greedy"][k]) + fmt.format(results["batch"][k]))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+bench_bulk_requests.py
+
+One-by-one create_request + build_offers vs bulk_requests.ingest for a
+SACCO upload (market day / school runs): many rows, a few villages and
+landmarks, riders spread over them.
+
+Both runs start from the same DB (riders, landmarks, a seeded travel
+matrix). Reported per run:
+- ms: wall time for the whole upload (bulk: also match_ms)
+- top slots: how many riders got the first-ranked offer of some request,
+  and the most top slots one rider got
+
+Exit 1 when bulk does not spread the top slots wider than one-by-one
+(more riders with a top slot, fewer top slots for the busiest rider).
+
+Usage:
+    python scripts/bench_bulk_requests.py --rows 500 --riders 200
+"""
+
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from collections import Counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+
+import angelopp_core as core  # noqa: E402
+import bulk_requests  # noqa: E402
+import dbpool  # noqa: E402
+import migrations  # noqa: E402
+import travel_matrix  # noqa: E402
+
+VILLAGES = ["Bumala", "Butula"]
+LANDMARKS = ["Market Gate", "Water Pump", "Police Station", "Primary School", "Church", "Junction"]
+
+
+def seed(db_path: str, riders: int, rnd: random.Random) -> None:
+    conn = dbpool.connect(db_path)
+    for v in VILLAGES:
+        for nm in LANDMARKS:
+            conn.execute("INSERT INTO landmarks(village, name) VALUES (?, ?)", (v, nm))
+    conn.commit()
+    conn.close()
+    for v in VILLAGES:
+        for i, a in enumerate(LANDMARKS):
+            for b in LANDMARKS[i:]:
+                travel_matrix.seed(db_path, v, a, b, 2 if a == b else rnd.randint(3, 20))
+        travel_matrix.build(db_path, v)
+    for i in range(riders):
+        ph = f"+2547{i:08d}"
+        core.upsert_provider(ph, "rider", f"Rider {i}", VILLAGES[i % len(VILLAGES)])
+        core.set_provider_landmark(ph, rnd.choice(LANDMARKS))
+        core.provider_set_service(ph, 1, 1)
+
+
+def copy_db(src: str, dst: str) -> None:
+    a, b = sqlite3.connect(src), sqlite3.connect(dst)
+    a.backup(b)
+    a.close()
+    b.close()
+
+
+def top_slots(db_path: str, ids: list) -> dict:
+    conn = dbpool.connect(db_path)
+    tops = Counter()
+    for rid in ids:
+        r = conn.execute("SELECT provider_phone FROM request_offers WHERE request_id=? ORDER BY score, id LIMIT 1",
+                         (rid,)).fetchone()
+        if r:
+            tops[r[0]] += 1
+    conn.close()
+    return {"riders_with_top_slot": len(tops), "max_top_slots_per_rider": max(tops.values()) if tops else 0}
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark one-by-one build_offers vs bulk_requests.ingest")
+    ap.add_argument("--rows", type=int, default=500)
+    ap.add_argument("--riders", type=int, default=200)
+    ap.add_argument("--max-offers", type=int, default=5)
+    ap.add_argument("--seed", type=int, default=22)
+    args = ap.parse_args()
+
+    rnd = random.Random(args.seed)
+    tmp = tempfile.mkdtemp(prefix="bulk_bench_")
+    base = os.path.join(tmp, "base.db")
+    migrations.migrate(base)
+    core.DB_PATH = base
+    seed(base, args.riders, rnd)
+    rows = [bulk_requests.BulkRow(f"+2547990{i:05d}", 1, rnd.choice(VILLAGES), rnd.choice(LANDMARKS), "bench", i + 2)
+            for i in range(args.rows)]
+
+    results = {}
+    for mode in ("one_by_one", "bulk"):
+        db_path = os.path.join(tmp, f"{mode}.db")
+        copy_db(base, db_path)
+        core.DB_PATH = db_path
+        t0 = time.perf_counter()
+        if mode == "one_by_one":
+            ids = []
+            for r in rows:
+                rid = core.create_request(r.customer_phone, r.service_id, r.village, r.landmark, r.note)
+                core.build_offers(rid, max_offers=args.max_offers)
+                ids.append(rid)
+            match_ms = 0.0
+        else:
+            res = bulk_requests.ingest(rows, max_offers=args.max_offers)
+            ids, match_ms = res["request_ids"], res["match_ms"]
+        results[mode] = {"ms": (time.perf_counter() - t0) * 1000.0, "match_ms": match_ms, **top_slots(db_path, ids)}
+
+    print(f"rows={args.rows} riders={args.riders} villages={len(VILLAGES)} landmarks={len(LANDMARKS)}")
+    print(f"{'':26}{'one_by_one':>12}{'bulk':>10}")
+    for k, fmt in (("ms", "{:.1f}"), ("match_ms", "{:.1f}"),
+                   ("riders_with_top_slot", "{:d}"), ("max_top_slots_per_rider", "{:d}")):
+        print(f"{k:26}" + fmt.format(results["one_by_one"][k]).rjust(12) + fmt.format(results["bulk"][k]).rjust(10))
+
+    one, bulk = results["one_by_one"], results["bulk"]
+    if (bulk["riders_with_top_slot"] <= one["riders_with_top_slot"]
+            or bulk["max_top_slots_per_rider"] >= one["max_top_slots_per_rider"]):
+        print("PROBLEM bulk does not spread the top slots wider than one-by-one")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""
+bench_fairness.py
+
+Per-candidate scoring (score_candidate + explain_score per rider) vs the
+batched score_batch() over a synthetic village roster. Also checks that
+both paths give the same order.
+
+Usage:
+    python scripts/bench_fairness.py --riders 50000
+    python scripts/bench_fairness.py --riders 50000 --no-numpy
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+
+from policies import fairness  # noqa: E402
+from policies.fairness import Candidate, PolicyWeights, explain_score, score_batch, score_candidate  # noqa: E402
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark fairness scoring")
+    ap.add_argument("--riders", type=int, default=20000)
+    ap.add_argument("--seed", type=int, default=7)
+    ap.add_argument("--no-numpy", action="store_true")
+    args = ap.parse_args()
+
+    rnd = random.Random(args.seed)
+    n = args.riders
+    eta = [None if rnd.random() < 0.05 else rnd.randint(1, 40) for _ in range(n)]
+    trust = [round(rnd.random(), 2) for _ in range(n)]
+    recent = [rnd.randint(0, 14) for _ in range(n)]
+    income = [round(rnd.random(), 2) for _ in range(n)]
+    w = PolicyWeights()
+
+    cands = [Candidate(str(i), eta[i], trust[i], recent[i], income[i]) for i in range(n)]
+    t0 = time.perf_counter()
+    old_order = sorted(cands, key=lambda c: score_candidate(c, w), reverse=True)
+    old_expl = [explain_score(c, w) for c in old_order]
+    t_old = time.perf_counter() - t0
+
+    use_numpy = not args.no_numpy
+    t0 = time.perf_counter()
+    b = score_batch(eta, trust, recent, income, w, use_numpy=use_numpy)
+    t_score = time.perf_counter() - t0
+    new_expl = [b.explain(i) for i in b.order]
+    t_new = time.perf_counter() - t0
+
+    same = [c.phone for c in old_order] == [str(i) for i in b.order]
+    drift = max(abs(x["total"] - y["total"]) for x, y in zip(old_expl, new_expl)) if n else 0.0
+    engine = "numpy" if (use_numpy and fairness.np is not None) else "python"
+    print(f"riders={n}")
+    print(f"per-candidate: {t_old * 1000:8.1f} ms")
+    print(f"score_batch ({engine}): {t_new * 1000:8.1f} ms  ({t_old / t_new if t_new else 0:.1f}x), "
+          f"of which scoring+ranking {t_score * 1000:.1f} ms")
+    print(f"same order: {same}  max score drift: {drift:.2e}")
+    if not same:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""
+bench_offer_inbox.py
+
+Provider inbox latency (angelopp_core.provider_pending_offers, USSD P*4)
+with a year of offer history in request_offers: 1M offers by default,
+mostly closed, a few percent stale OFFERED rows that predate
+offer_scheduler.
+
+Same data, four layouts:
+- v1:      index (provider_phone, status), sorts in a temp b-tree
+- v9:      index (provider_phone, status, created_at)
+- v11:     covering index idx_offers_inbox
+- archive: v11 after offer_archive.archive(days=30)
+
+Usage:
+    python scripts/bench_offer_inbox.py --offers 1000000 --providers 2000 --lookups 5000
+"""
+
+import argparse
+import datetime
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+
+import angelopp_core as core  # noqa: E402
+import dbpool  # noqa: E402
+import migrations  # noqa: E402
+import offer_archive  # noqa: E402
+
+OFFERS_PER_REQUEST = 5
+DAYS = 365
+STALE_SHARE = 0.02      # closed-era OFFERED rows nobody expired
+
+
+def seed(db_path: str, offers: int, providers: int, rnd: random.Random) -> None:
+    phones = [f"+2547{i:08d}" for i in range(providers)]
+    n_req = offers // OFFERS_PER_REQUEST
+    now = datetime.datetime.utcnow()
+    conn = dbpool.connect(db_path)
+    reqs, rows = [], []
+    for rid in range(1, n_req + 1):
+        # ids grow with time, newest last
+        age = (n_req - rid) / n_req * DAYS * 86400 + rnd.random() * 60
+        ts = (now - datetime.timedelta(seconds=age)).strftime("%Y-%m-%d %H:%M:%S")
+        recent = age < 600
+        reqs.append((rid, f"+2547990{rid % 100000:05d}", 1, "Bumala", "Market Gate", "",
+                     "OFFERED" if recent else "CLOSED", ts))
+        winner = rnd.randrange(OFFERS_PER_REQUEST)
+        for k, ph in enumerate(rnd.sample(phones, OFFERS_PER_REQUEST)):
+            if recent:
+                st = "OFFERED"
+            elif rnd.random() < STALE_SHARE:
+                st = "OFFERED"
+            elif k == winner:
+                st = "ACCEPTED"
+            else:
+                st = rnd.choice(("PASSED", "PASSED", "PASSED", "EXPIRED"))
+            rows.append((rid, ph, float(k), 5 + k, st, ts))
+        if len(rows) >= 100000:
+            _flush(conn, reqs, rows)
+            reqs, rows = [], []
+    _flush(conn, reqs, rows)
+    conn.close()
+
+
+def _flush(conn, reqs, rows) -> None:
+    conn.executemany("INSERT INTO service_requests(id, customer_phone, service_id, village, landmark, note, status, created_at) "
+                     "VALUES (?, ?, ?, ?, ?, ?, ?, ?)", reqs)
+    conn.executemany("INSERT INTO request_offers(request_id, provider_phone, score, eta_minutes, status, created_at) "
+                     "VALUES (?, ?, ?, ?, ?, ?)", rows)
+    conn.commit()
+
+
+def set_index(db_path: str, layout: str) -> None:
+    conn = dbpool.connect(db_path)
+    for ix in ("idx_offers_provider", "idx_offers_provider_created", "idx_offers_inbox"):
+        conn.execute(f"DROP INDEX IF EXISTS {ix}")
+    if layout == "v1":
+        conn.execute("CREATE INDEX idx_offers_provider ON request_offers(provider_phone, status)")
+    elif layout == "v9":
+        conn.execute("CREATE INDEX idx_offers_provider_created ON request_offers(provider_phone, status, created_at)")
+    else:
+        conn.execute("CREATE INDEX idx_offers_inbox "
+                     "ON request_offers(provider_phone, status, created_at, request_id, eta_minutes)")
+    conn.execute("ANALYZE")
+    conn.commit()
+    conn.close()
+
+
+def measure(phones: list, lookups: int, rnd: random.Random) -> dict:
+    lat, shown = [], 0
+    for _ in range(lookups):
+        ph = rnd.choice(phones)
+        t0 = time.perf_counter()
+        rows = core.provider_pending_offers(ph, limit=5)
+        lat.append((time.perf_counter() - t0) * 1e6)
+        shown += len(rows)
+    lat.sort()
+    return {
+        "p50_us": statistics.median(lat),
+        "p95_us": lat[int(len(lat) * 0.95) - 1],
+        "p99_us": lat[int(len(lat) * 0.99) - 1],
+        "rows_shown": shown,
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark the provider inbox query with a large offer history")
+    ap.add_argument("--offers", type=int, default=1000000)
+    ap.add_argument("--providers", type=int, default=2000)
+    ap.add_argument("--lookups", type=int, default=5000)
+    ap.add_argument("--days", type=int, default=30, help="archive retention")
+    ap.add_argument("--seed", type=int, default=7)
+    args = ap.parse_args()
+
+    rnd = random.Random(args.seed)
+    db_path = os.path.join(tempfile.mkdtemp(prefix="inbox_bench_"), "inbox.db")
+    migrations.migrate(db_path)
+    core.DB_PATH = db_path
+
+    t0 = time.perf_counter()
+    seed(db_path, args.offers, args.providers, rnd)
+    print(f"seeded {args.offers} offers for {args.providers} providers in {time.perf_counter() - t0:.1f}s")
+    phones = [f"+2547{i:08d}" for i in range(args.providers)]
+    conn = dbpool.connect(db_path)
+    stale = conn.execute("SELECT COUNT(*) FROM request_offers WHERE status='OFFERED'").fetchone()[0]
+    conn.close()
+    print(f"OFFERED rows (incl. stale): {stale}")
+
+    print(f"{'layout':10}{'hot rows':>10}{'p50 us':>10}{'p95 us':>10}{'p99 us':>10}{'shown':>8}")
+    for layout in ("v1", "v9", "v11", "archive"):
+        if layout == "archive":
+            t0 = time.perf_counter()
+            res = offer_archive.archive(db_path, days=args.days)
+            print(f"archive: moved {res['moved']} ({res['stale']} stale OFFERED) in "
+                  f"{res['batches']} batches, {time.perf_counter() - t0:.1f}s")
+        set_index(db_path, "v11" if layout == "archive" else layout)
+        conn = dbpool.connect(db_path)
+        hot = conn.execute("SELECT COUNT(*) FROM request_offers").fetchone()[0]
+        conn.close()
+        measure(phones, min(500, args.lookups), random.Random(1))      # warm up
+        m = measure(phones, args.lookups, random.Random(args.seed))
+        print(f"{layout:10}{hot:>10}{m['p50_us']:>10.0f}{m['p95_us']:>10.0f}{m['p99_us']:>10.0f}{m['rows_shown']:>8}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""
+bench_provider_roster.py
+
+Candidate lookups for matching: the old providers JOIN provider_services
+query vs the in-memory roster (provider_roster.candidates), under a mixed
+workload of lookups and provider writes (landmark / availability / service).
+
+A second roster instance stands in for another gunicorn worker: it only
+sees writes through the provider_changes feed and must end up identical.
+With --threads N, N threads keep reading (and so refreshing) that second
+roster concurrently with the writes, the way gunicorn threads share one.
+
+Usage:
+    python scripts/bench_provider_roster.py --providers 5000 --lookups 20000 --write-ratio 0.02
+    python scripts/bench_provider_roster.py --providers 2000 --lookups 5000 --write-ratio 0.2 --threads 8
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+
+import angelopp_core as core  # noqa: E402
+import dbpool  # noqa: E402
+import migrations  # noqa: E402
+import provider_roster  # noqa: E402
+
+VILLAGES = ["Bumala", "Butula", "Busia", "Mundika", "Nangina"]
+LANDMARKS = ["Market Gate", "Water Pump", "Police Station", "Stage", "Church", "Hospital"]
+
+OLD_SQL = """
+SELECT p.phone, p.provider_type, p.name, p.village, p.sacco, p.current_landmark
+FROM providers p
+JOIN provider_services ps ON ps.phone = p.phone
+WHERE ps.service_id=? AND ps.active=1
+  AND p.village=?
+ORDER BY p.updated_at DESC
+"""
+
+
+def seed(db_path: str, n: int, rnd: random.Random) -> list:
+    services = [r[0] for r in dbpool.connect(db_path).execute("SELECT id FROM services").fetchall()]
+    conn = dbpool.connect(db_path)
+    phones = []
+    for i in range(n):
+        ph = f"+2547{i:08d}"
+        phones.append(ph)
+        conn.execute(
+            "INSERT INTO providers(phone, provider_type, name, village, sacco, current_landmark, is_available, updated_at) "
+            "VALUES (?, 'rider', ?, ?, '', ?, 1, datetime('now', ?))",
+            (ph, f"Rider {i}", rnd.choice(VILLAGES), rnd.choice(LANDMARKS), f"-{rnd.randint(0, 86400)} seconds")
+        )
+        for sid in rnd.sample(services, rnd.randint(1, 3)):
+            conn.execute("INSERT INTO provider_services(phone, service_id, active) VALUES (?, ?, 1)", (ph, sid))
+    conn.commit()
+    conn.close()
+    return services, phones
+
+
+def same_rows(a, b) -> bool:
+    # updated_at ties have no defined order in SQL: compare as sets
+    return sorted(r["phone"] for r in a) == sorted(r["phone"] for r in b)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark provider roster cache vs SQL")
+    ap.add_argument("--providers", type=int, default=5000)
+    ap.add_argument("--lookups", type=int, default=20000)
+    ap.add_argument("--write-ratio", type=float, default=0.02)
+    ap.add_argument("--seed", type=int, default=5)
+    ap.add_argument("--threads", type=int, default=0, help="threads refreshing the second roster concurrently")
+    args = ap.parse_args()
+
+    rnd = random.Random(args.seed)
+    tmp = tempfile.mkdtemp(prefix="roster_bench_")
+    db_path = os.path.join(tmp, "bench.db")
+    migrations.migrate(db_path)
+    core.DB_PATH = db_path
+    services, phones = seed(db_path, args.providers, rnd)
+
+    roster = provider_roster.get_roster(db_path)
+    other = provider_roster.ProviderRoster(db_path, sync_seconds=0.5)   # "another worker"
+    roster.stats()
+    other.stats()
+
+    stop = threading.Event()
+
+    def reader(n: int) -> None:
+        r = random.Random(n)
+        while not stop.is_set():
+            other.candidates(r.choice(VILLAGES), r.choice(services))
+            time.sleep(0.001)       # a request's other work
+
+    if args.threads:
+        other.sync_seconds = 0.0
+    readers = [threading.Thread(target=reader, args=(i,), daemon=True) for i in range(args.threads)]
+    for t in readers:
+        t.start()
+
+    t_sql = t_roster = 0.0
+    writes = mismatches = 0
+    conn = dbpool.connect(db_path)
+    for _ in range(args.lookups):
+        if rnd.random() < args.write_ratio:
+            ph = rnd.choice(phones)
+            kind = rnd.random()
+            if kind < 0.6:
+                core.set_provider_landmark(ph, rnd.choice(LANDMARKS))
+            elif kind < 0.8:
+                core.set_provider_available(ph, rnd.random() < 0.7)
+            else:
+                core.provider_set_service(ph, rnd.choice(services), rnd.choice([0, 1]))
+            writes += 1
+
+        village, sid = rnd.choice(VILLAGES), rnd.choice(services)
+        t0 = time.perf_counter()
+        old = [dict(r) for r in conn.execute(OLD_SQL, (sid, village)).fetchall()]
+        t1 = time.perf_counter()
+        new = core.get_candidate_providers(sid, village, None)
+        t2 = time.perf_counter()
+        t_sql += t1 - t0
+        t_roster += t2 - t1
+        if not same_rows(old, new):
+            mismatches += 1
+    conn.close()
+    stop.set()
+    for t in readers:
+        t.join()
+
+    other.sync_seconds = 0.5
+    time.sleep(0.6)
+    converged = all(
+        same_rows(other.candidates(v, sid), roster.candidates(v, sid)) for v in VILLAGES for sid in services
+    )
+
+    st = roster.stats()
+    n = max(1, args.lookups)
+    print(f"providers={args.providers} lookups={args.lookups} writes={writes}")
+    print(f"SQL query:        {t_sql / n * 1e6:8.1f} us/lookup")
+    print(f"roster.candidates:{t_roster / n * 1e6:8.1f} us/lookup ({t_sql / t_roster if t_roster else 0:.1f}x)")
+    print(f"memo hit rate:    {st['memo_hit_rate'] * 100:.1f}% ({st['memo_hits']} hits, {st['memo_misses']} misses)")
+    print(f"feed position:    {st['last_change_id']}  other worker converged: {converged}")
+    print(f"mismatches vs SQL: {mismatches}")
+    if mismatches or not converged:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+"""
+check_cold_archive.py
+
+Row-count check for cold_archive.py on a seeded temp DB: old and recent,
+closed and open rows in every archived table, then archive(days=90).
+
+Checks:
+- every _all view has the same row count before and after
+- exactly the closed + old rows left the hot DB (with their assignments
+  and offers); open and recent rows stayed
+- no id in both hot and cold (cold_archive.verify)
+- a second run moves nothing
+- the provider inbox still reads the hot DB
+- quiet channels / categories (only old messages) keep their newest
+  KEEP_MESSAGES rows hot: the channel "last message" screen and
+  ussd.get_latest_messages show the same rows before and after
+
+Exit 1 on any problem.
+
+Usage:
+    python scripts/check_cold_archive.py --scale 200
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+from collections import Counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+
+import angelopp_core as core  # noqa: E402
+import cold_archive  # noqa: E402
+import dbpool  # noqa: E402
+import migrations  # noqa: E402
+import ussd  # noqa: E402
+
+OLD, RECENT = "-200 days", "-2 days"
+RIDER = "+254700000001"
+# (channel_id, category) with only old messages; channel 3 shares News with the busy channel 1
+QUIET = ((2, "Sacco"), (3, "News"))
+
+
+def seed(db_path: str, n: int) -> dict:
+    """Insert n rows per group; returns how many rows of each table should move."""
+    conn = dbpool.connect(db_path)
+    cur = conn.cursor()
+    expect = {"service_requests": 0, "assignments": 0, "offers": 0, "delivery_requests": 0,
+              "messages": 0, "points_ledger": 0}
+
+    # (status, age, should move)
+    for status, age, moves in (("CLOSED", OLD, True), ("EXPIRED", OLD, True), ("ACCEPTED", OLD, False),
+                               ("CLOSED", RECENT, False), ("OFFERED", RECENT, False)):
+        for i in range(n):
+            cur.execute("INSERT INTO service_requests(customer_phone, service_id, status, created_at, closed_at) "
+                        "VALUES (?, 1, ?, datetime('now', ?), CASE WHEN ?='CLOSED' THEN datetime('now', ?) END)",
+                        (f"+25479900{i:04d}", status, age, status, age))
+            rid = cur.lastrowid
+            if status in ("CLOSED", "ACCEPTED"):
+                cur.execute("INSERT INTO assignments(request_id, provider_phone, assigned_at) "
+                            "VALUES (?, ?, datetime('now', ?))", (rid, f"+2547000{i % 50:05d}", age))
+                expect["assignments"] += moves
+            offers = [(rid, f"+2547000{(i + k) % 50:05d}", "PASSED" if k else "ACCEPTED", age) for k in range(3)]
+            if status == "OFFERED":
+                offers = [(rid, RIDER if k == 0 else f"+2547001{k:05d}", "OFFERED", age) for k in range(3)]
+            cur.executemany("INSERT INTO request_offers(request_id, provider_phone, status, created_at) "
+                            "VALUES (?, ?, ?, datetime('now', ?))", offers[:2])
+            cur.execute("INSERT INTO request_offers_archive(id, request_id, provider_phone, status, created_at) "
+                        "VALUES ((SELECT COALESCE(MAX(id), 0) + 1000000 FROM request_offers_archive), ?, ?, ?, "
+                        "datetime('now', ?))", offers[2])
+            expect["service_requests"] += moves
+            expect["offers"] += 3 * moves
+
+    for status, age, moves in (("delivered", OLD, True), ("cancelled", OLD, True), ("accepted", OLD, False),
+                               ("delivered", RECENT, False), ("new", RECENT, False)):
+        cur.executemany("INSERT INTO delivery_requests(source_phone, status, created_at, updated_at) "
+                        "VALUES (?, ?, datetime('now', ?), datetime('now', ?))",
+                        [(f"+25479900{i:04d}", status, age, age) for i in range(n)])
+        expect["delivery_requests"] += n * moves
+
+    for age, moves in ((OLD, True), (RECENT, False)):
+        cur.executemany("INSERT INTO messages(channel_id, category, text, created_at) "
+                        "VALUES (1, 'News', ?, datetime('now', ?))", [(f"msg {i}", age) for i in range(n)])
+        cur.executemany("INSERT INTO points_ledger(phone, pts, reason, created_at) "
+                        "VALUES (?, 5, 'daily', datetime('now', ?))", [(f"+25479900{i:04d}", age) for i in range(n)])
+        expect["points_ledger"] += n * moves
+    for channel_id, category in QUIET:
+        cur.executemany("INSERT INTO messages(channel_id, category, text, created_at) "
+                        "VALUES (?, ?, ?, datetime('now', ?))",
+                        [(channel_id, category, f"quiet {channel_id} {i}", OLD) for i in range(n)])
+
+    # old messages move unless among the newest KEEP_MESSAGES of their channel or category
+    keep, seen = set(), Counter()
+    rows = cur.execute("SELECT id, channel_id, lower(trim(category)), created_at < datetime('now', '-90 days') "
+                       "FROM messages ORDER BY id DESC").fetchall()
+    for mid, channel_id, category, _ in rows:
+        seen["c", channel_id] += 1
+        seen["k", category] += 1
+        if seen["c", channel_id] <= cold_archive.KEEP_MESSAGES or seen["k", category] <= cold_archive.KEEP_MESSAGES:
+            keep.add(mid)
+    expect["messages"] = sum(1 for mid, _, _, old in rows if old and mid not in keep)
+    conn.commit()
+    conn.close()
+    return expect
+
+
+def latest_messages() -> list:
+    """What the message screens show: last message per quiet channel, latest per category."""
+    conn = dbpool.connect(ussd.DB_PATH)
+    out = [tuple(conn.execute("SELECT text, created_at FROM messages WHERE channel_id=? ORDER BY id DESC LIMIT 1",
+                              (channel_id,)).fetchone() or ()) for channel_id, _ in QUIET]
+    conn.close()
+    return out + [ussd.get_latest_messages(category, limit=cold_archive.KEEP_MESSAGES) for _, category in QUIET]
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Row-count check for the hot/cold archive job")
+    ap.add_argument("--scale", type=int, default=200, help="rows per (table, status, age) group")
+    args = ap.parse_args()
+
+    tmp = tempfile.mkdtemp(prefix="cold_check_")
+    db_path = os.path.join(tmp, "bumala.db")
+    archive_path = os.path.join(tmp, "bumala_archive.db")
+    migrations.migrate(db_path)
+    core.DB_PATH = db_path
+    ussd.DB_PATH = db_path
+    expect = seed(db_path, args.scale)
+    problems = []
+
+    conn = cold_archive.connect(db_path, archive_path)
+    before = cold_archive.counts(conn)
+    conn.close()
+    inbox_before = len(core.provider_pending_offers(RIDER, limit=50))
+    screens_before = latest_messages()
+
+    res = cold_archive.archive(db_path, archive_path, days=90)
+
+    conn = cold_archive.connect(db_path, archive_path)
+    after = cold_archive.counts(conn)
+    problems += cold_archive.verify(conn)
+    conn.close()
+
+    for view in cold_archive.VIEWS:
+        if before[view] != after[view]:
+            problems.append(f"{view}: {before[view]} rows before, {after[view]} after")
+    moved = {
+        "service_requests": before["main.service_requests"] - after["main.service_requests"],
+        "assignments": before["main.assignments"] - after["main.assignments"],
+        "offers": (before["main.request_offers"] + before["main.request_offers_archive"]
+                   - after["main.request_offers"] - after["main.request_offers_archive"]),
+        "delivery_requests": before["main.delivery_requests"] - after["main.delivery_requests"],
+        "messages": before["main.messages"] - after["main.messages"],
+        "points_ledger": before["main.points_ledger"] - after["main.points_ledger"],
+    }
+    for k, want in expect.items():
+        if moved[k] != want:
+            problems.append(f"{k}: moved {moved[k]}, expected {want}")
+    if after["cold.request_offers_archive"] != expect["offers"]:
+        problems.append(f"cold offers: {after['cold.request_offers_archive']}, expected {expect['offers']}")
+
+    again = cold_archive.archive(db_path, archive_path, days=90)
+    if any(again["moved"].values()):
+        problems.append(f"second run moved {again['moved']}")
+    inbox_after = len(core.provider_pending_offers(RIDER, limit=50))
+    if inbox_after != inbox_before:
+        problems.append(f"provider inbox: {inbox_before} offers before, {inbox_after} after")
+    screens_after = latest_messages()
+    if screens_after != screens_before or not all(screens_after):
+        problems.append(f"message screens: {screens_before} before, {screens_after} after")
+
+    print("moved: " + " ".join(f"{k}={v}" for k, v in res["moved"].items()))
+    print(f"{'':34}{'before':>8}{'after':>8}")
+    for k in before:
+        print(f"{k:34}{before[k]:>8}{after[k]:>8}")
+    for p in problems:
+        print("PROBLEM", p)
+    print(f"problems: {len(problems)}")
+    if problems:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
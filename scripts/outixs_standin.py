@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+outixs_standin.py
+
+Local stand-in for the Outixs transition API (dev / catch-up tests only).
+
+- POST /transition           one transition  -> 201, or 409 if internal_id seen before
+- POST /transitions/batch    {"transitions": [...]} -> {"results": [{internal_id, status}]}
+- GET  /stats                counters (requests, transitions, duplicates)
+
+Usage:
+    python scripts/outixs_standin.py --port 8080
+    python scripts/outixs_standin.py --port 8080 --no-batch      # old Outixs (404 on batch)
+    python scripts/outixs_standin.py --port 8080 --fail-rate 0.2 # random 503s per item
+    OUTIXS_URL=http://127.0.0.1:8080 python app/outixs_outbox.py --db /tmp/bumala.db
+"""
+
+import argparse
+import json
+import random
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+_lock = threading.Lock()
+_seen = set()
+_stats = {"requests": 0, "batch_requests": 0, "transitions": 0, "duplicates": 0, "failed": 0}
+
+
+def _accept(tr: dict, fail_rate: float) -> dict:
+    iid = str(((tr or {}).get("transition") or {}).get("internal_id") or "")
+    if not iid:
+        return {"internal_id": None, "status": 400, "error": "missing internal_id"}
+    if fail_rate and random.random() < fail_rate:
+        with _lock:
+            _stats["failed"] += 1
+        return {"internal_id": iid, "status": 503, "error": "random failure"}
+    with _lock:
+        if iid in _seen:
+            _stats["duplicates"] += 1
+            return {"internal_id": iid, "status": 409}
+        _seen.add(iid)
+        _stats["transitions"] += 1
+    return {"internal_id": iid, "status": 201}
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"   # keep-alive, like the real endpoint
+    batch = True
+    fail_rate = 0.0
+
+    def _send(self, code: int, body: dict) -> None:
+        raw = json.dumps(body).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(raw)))
+        self.end_headers()
+        self.wfile.write(raw)
+
+    def _body(self):
+        n = int(self.headers.get("Content-Length") or 0)
+        try:
+            return json.loads(self.rfile.read(n) or b"{}")
+        except Exception:
+            return None
+
+    def do_GET(self):
+        if self.path == "/stats":
+            with _lock:
+                return self._send(200, dict(_stats))
+        self._send(404, {"error": "not found"})
+
+    def do_POST(self):
+        body = self._body()
+        with _lock:
+            _stats["requests"] += 1
+
+        if self.path == "/transition":
+            if not isinstance(body, dict):
+                return self._send(400, {"error": "bad json"})
+            res = _accept(body, self.fail_rate)
+            return self._send(res["status"], res)
+
+        if self.path == "/transitions/batch" and self.batch:
+            if not isinstance(body, dict) or not isinstance(body.get("transitions"), list):
+                return self._send(400, {"error": "expected {transitions: [...]}"})
+            with _lock:
+                _stats["batch_requests"] += 1
+            results = [_accept(tr, self.fail_rate) for tr in body["transitions"]]
+            return self._send(200, {"results": results})
+
+        self._send(404, {"error": "not found"})
+
+    def log_message(self, *args):
+        pass
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Local stand-in Outixs server")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8080)
+    ap.add_argument("--no-batch", action="store_true", help="answer 404 on /transitions/batch")
+    ap.add_argument("--fail-rate", type=float, default=0.0, help="fraction of items answered 503")
+    args = ap.parse_args()
+
+    Handler.batch = not args.no_batch
+    Handler.fail_rate = max(0.0, min(1.0, args.fail_rate))
+    srv = ThreadingHTTPServer((args.host, args.port), Handler)
+    print(f"Outixs stand-in on http://{args.host}:{args.port} (batch={'on' if Handler.batch else 'off'})")
+    try:
+        srv.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""
+stress_claim_offer.py
+
+Many providers accepting the same request at once (a request fans out to
+several riders). Every round: one request, --riders offers, one thread per
+rider released together on a barrier, all calling claim_offer().
+
+Checks per round: exactly one ACCEPTED, one assignment row, the other
+offers PASSED, request ACCEPTED, no exceptions. Exit 1 on any violation.
+
+--legacy runs the old check-then-insert accept_offer for comparison
+(expect double winners / IntegrityErrors).
+
+Usage:
+    python scripts/stress_claim_offer.py --rounds 200 --riders 5
+    python scripts/stress_claim_offer.py --rounds 200 --riders 20 --legacy
+"""
+
+import argparse
+import collections
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+
+import angelopp_core as core  # noqa: E402
+import dbpool  # noqa: E402
+import migrations  # noqa: E402
+
+
+def legacy_accept(provider_phone: str, offer_id: int) -> str:
+    """accept_offer before claim_offer: separate SELECTs, then INSERT + UPDATEs."""
+    conn = core.db()
+    cur = conn.cursor()
+    try:
+        cur.execute("SELECT request_id FROM request_offers WHERE id=? AND provider_phone=? AND status='OFFERED'",
+                    (offer_id, provider_phone))
+        row = cur.fetchone()
+        if not row:
+            return core.CLAIM_GONE
+        request_id = int(row["request_id"])
+        cur.execute("SELECT 1 FROM assignments WHERE request_id=?", (request_id,))
+        if cur.fetchone():
+            cur.execute("UPDATE request_offers SET status='PASSED' WHERE id=?", (offer_id,))
+            conn.commit()
+            return core.CLAIM_TAKEN
+        cur.execute("INSERT INTO assignments(request_id, provider_phone) VALUES (?, ?)", (request_id, provider_phone))
+        cur.execute("UPDATE request_offers SET status='ACCEPTED' WHERE id=?", (offer_id,))
+        cur.execute("UPDATE service_requests SET status='ACCEPTED' WHERE id=?", (request_id,))
+        cur.execute("UPDATE request_offers SET status='PASSED' WHERE request_id=? AND id<>?", (request_id, offer_id))
+        conn.commit()
+        return core.CLAIM_ACCEPTED
+    finally:
+        conn.close()
+
+
+def seed_round(db_path: str, riders: list) -> tuple:
+    conn = dbpool.connect(db_path)
+    cur = conn.cursor()
+    cur.execute("INSERT INTO service_requests(customer_phone, service_id, village, landmark, status) "
+                "VALUES ('+254799999999', 1, 'Bumala', 'Market Gate', 'OFFERED')")
+    request_id = int(cur.lastrowid)
+    offers = []
+    for ph in riders:
+        cur.execute("INSERT INTO request_offers(request_id, provider_phone, score, eta_minutes) VALUES (?, ?, 5, 5)",
+                    (request_id, ph))
+        offers.append((ph, int(cur.lastrowid)))
+    conn.commit()
+    conn.close()
+    return request_id, offers
+
+
+def check_round(db_path: str, request_id: int, outcomes: list) -> list:
+    problems = []
+    won = outcomes.count(core.CLAIM_ACCEPTED)
+    if won != 1:
+        problems.append(f"{won} winners")
+    errors = [o for o in outcomes if o.startswith("ERROR")]
+    if errors:
+        problems.append(f"{len(errors)} errors")
+    conn = dbpool.connect(db_path)
+    n_assign = conn.execute("SELECT COUNT(*) FROM assignments WHERE request_id=?", (request_id,)).fetchone()[0]
+    by_status = dict(conn.execute(
+        "SELECT status, COUNT(*) FROM request_offers WHERE request_id=? GROUP BY status", (request_id,)
+    ).fetchall())
+    req_status = conn.execute("SELECT status FROM service_requests WHERE id=?", (request_id,)).fetchone()[0]
+    conn.close()
+    if n_assign != 1:
+        problems.append(f"{n_assign} assignments")
+    if by_status.get("ACCEPTED", 0) != 1 or by_status.get("OFFERED", 0):
+        problems.append(f"offers {by_status}")
+    if req_status != "ACCEPTED":
+        problems.append(f"request {req_status}")
+    return problems
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Concurrent accept stress test for claim_offer")
+    ap.add_argument("--rounds", type=int, default=200)
+    ap.add_argument("--riders", type=int, default=5)
+    ap.add_argument("--legacy", action="store_true", help="old accept_offer (expect failures)")
+    args = ap.parse_args()
+
+    db_path = os.path.join(tempfile.mkdtemp(prefix="claim_stress_"), "stress.db")
+    migrations.migrate(db_path)
+    core.DB_PATH = db_path
+    riders = [f"+2547{i:08d}" for i in range(args.riders)]
+    accept = legacy_accept if args.legacy else (lambda ph, oid: core.claim_offer(ph, oid)[0])
+
+    totals = collections.Counter()
+    bad_rounds = 0
+    t0 = time.perf_counter()
+    for rnd in range(args.rounds):
+        request_id, offers = seed_round(db_path, riders)
+        barrier = threading.Barrier(len(offers))
+        outcomes = []
+        lock = threading.Lock()
+
+        def worker(phone, offer_id):
+            barrier.wait()
+            try:
+                out = accept(phone, offer_id)
+            except Exception as e:
+                out = f"ERROR {type(e).__name__}"
+            finally:
+                dbpool.close_thread()
+            with lock:
+                outcomes.append(out)
+
+        threads = [threading.Thread(target=worker, args=o) for o in offers]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        totals.update(outcomes)
+        problems = check_round(db_path, request_id, outcomes)
+        if problems:
+            bad_rounds += 1
+            if bad_rounds <= 5:
+                print(f"round {rnd}: {', '.join(problems)}  outcomes={sorted(outcomes)}")
+    dt = time.perf_counter() - t0
+
+    print(f"{'legacy accept_offer' if args.legacy else 'claim_offer'}: "
+          f"{args.rounds} rounds x {args.riders} riders in {dt:.1f}s "
+          f"({dt / max(1, args.rounds) * 1000:.1f} ms/round)")
+    print("outcomes: " + ", ".join(f"{k}={v}" for k, v in sorted(totals.items())))
+    print(f"rounds with a violation: {bad_rounds}")
+    if bad_rounds:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()